@@ -0,0 +1,347 @@
+"""Monthly gzip archive segments for old movements.
+
+Movements older than the retention age are moved out of ``db.movements``
+into one ``movements-YYYY-MM.ndjson.gz`` file per month, rows sorted newest
+first. ``manifest.json`` in the same directory lists every segment with
+its row count and timestamp range, so a date-bounded read opens only the
+segments that overlap it.
+
+Segments are written (and the manifest updated) before the rows are
+deleted from Mongo, and a re-run merges by movement id, so an interrupted
+run loses nothing. The archiver always moves the oldest rows, which keeps
+every archived movement older than every hot one; readers rely on that and
+continue into the archive once the hot collection runs out, but only when
+asked to or when their date range reaches ``newest()``.
+
+``db.archive_state`` holds one ``equipment:<id>`` document per archived
+item listing the months its movements are in, so a per-item read decodes
+only those segments (or none). It is updated before the hot rows are
+deleted; the first run after an upgrade builds it from the existing
+segments, and ``--reindex`` rebuilds it by hand.
+
+Run it by hand with::
+
+    python archive.py --older-than-days 365
+    python archive.py --reindex
+
+or set ``MOVEMENT_RETENTION_DAYS`` and the server runs it once a day.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+import orjson
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from migrations import DATE_FIELDS, parse_iso_datetime
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+DELETE_BATCH_SIZE = 1000
+INDEX_BATCH_SIZE = 1000
+EQUIPMENT_INDEX_ID = "equipment_index"
+DECODED_SEGMENT_CACHE = 4
+ARCHIVE_INTERVAL_SECONDS = 24 * 3600
+LOCK_TTL = timedelta(hours=1)
+
+
+def _month_start(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month_start: datetime) -> datetime:
+    return (month_start + timedelta(days=32)).replace(day=1)
+
+
+def _sort_key(doc: dict):
+    return doc['timestamp'], doc['id']
+
+
+class MovementArchive:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._segments: List[dict] = []
+        self._manifest_mtime: Optional[float] = None
+        self._decoded = OrderedDict()
+        self._decoded_lock = threading.Lock()
+        # Set once db.archive_state has the per-equipment months of every segment
+        self.equipment_index_ready = False
+
+    # ---- manifest ----
+
+    def segments(self) -> List[dict]:
+        """Manifest entries, newest month first; reloaded when another process rewrote it"""
+        path = self.directory / MANIFEST_NAME
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            self._segments, self._manifest_mtime = [], None
+            return self._segments
+        if mtime != self._manifest_mtime:
+            entries = json.loads(path.read_text())["segments"]
+            for entry in entries:
+                entry["min_timestamp"] = parse_iso_datetime(entry["min_timestamp"])
+                entry["max_timestamp"] = parse_iso_datetime(entry["max_timestamp"])
+            self._segments = sorted(entries, key=lambda e: e["month"], reverse=True)
+            self._manifest_mtime = mtime
+        return self._segments
+
+    def segments_for(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        months: Optional[List[str]] = None
+    ) -> List[dict]:
+        return [
+            s for s in self.segments()
+            if (start is None or s["max_timestamp"] >= start) and (end is None or s["min_timestamp"] <= end)
+            and (months is None or s["month"] in months)
+        ]
+
+    def newest(self) -> Optional[datetime]:
+        """Timestamp of the newest archived movement (None if nothing is archived)"""
+        segments = self.segments()
+        return segments[0]["max_timestamp"] if segments else None
+
+    def _write_manifest(self, segments: List[dict]) -> None:
+        entries = [
+            {**s, "min_timestamp": s["min_timestamp"].isoformat(), "max_timestamp": s["max_timestamp"].isoformat()}
+            for s in sorted(segments, key=lambda e: e["month"])
+        ]
+        self._write_atomic(self.directory / MANIFEST_NAME, json.dumps({"segments": entries}, indent=1).encode())
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4()}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    # ---- segments ----
+
+    def read_segment(self, segment: dict) -> List[dict]:
+        """All rows of a segment, newest first (blocking; call from a thread)"""
+        key = (segment["file"], segment["count"], segment["max_timestamp"])
+        with self._decoded_lock:
+            if key in self._decoded:
+                self._decoded.move_to_end(key)
+                return self._decoded[key]
+        rows = []
+        with gzip.open(self.directory / segment["file"], 'rb') as f:
+            for line in f:
+                doc = orjson.loads(line)
+                for field in DATE_FIELDS["movements"]:
+                    if doc.get(field):
+                        doc[field] = parse_iso_datetime(doc[field])
+                rows.append(doc)
+        with self._decoded_lock:
+            self._decoded[key] = rows
+            if len(self._decoded) > DECODED_SEGMENT_CACHE:
+                self._decoded.popitem(last=False)
+        return rows
+
+    def write_segment(self, month: str, rows: List[dict]) -> None:
+        """Replace a month's segment with ``rows`` merged into what it already holds"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = {s["month"]: s for s in self.segments()}
+        merged = {}
+        if month in segments:
+            merged.update((doc['id'], doc) for doc in self.read_segment(segments[month]))
+        merged.update((doc['id'], doc) for doc in rows)
+        ordered = sorted(merged.values(), key=_sort_key, reverse=True)
+
+        file_name = f"movements-{month}.ndjson.gz"
+        payload = b"".join(orjson.dumps(doc) + b"\n" for doc in ordered)
+        self._write_atomic(self.directory / file_name, gzip.compress(payload))
+        segments[month] = {
+            "month": month,
+            "file": file_name,
+            "count": len(ordered),
+            "min_timestamp": ordered[-1]['timestamp'],
+            "max_timestamp": ordered[0]['timestamp'],
+        }
+        self._write_manifest(list(segments.values()))
+
+    def find(
+        self,
+        matches: Callable[[dict], bool],
+        start: Optional[datetime],
+        end: Optional[datetime],
+        limit: int,
+        months: Optional[List[str]] = None
+    ) -> List[dict]:
+        """Up to ``limit`` archived rows accepted by ``matches``, newest first (blocking)"""
+        found = []
+        for row in self.iter_rows(matches, start, end, months):
+            found.append(row)
+            if len(found) >= limit:
+                break
+        return found
+
+    def iter_rows(
+        self,
+        matches: Callable[[dict], bool],
+        start: Optional[datetime],
+        end: Optional[datetime],
+        months: Optional[List[str]] = None
+    ) -> Iterator[dict]:
+        for segment in self.segments_for(start, end, months):
+            for row in self.read_segment(segment):
+                if matches(row):
+                    yield row
+
+
+def archive_from_environment(root_dir: Path) -> MovementArchive:
+    """The archive at ``MOVEMENT_ARCHIVE_DIR`` (default: ``archive/`` under ``root_dir``)"""
+    return MovementArchive(Path(os.environ.get('MOVEMENT_ARCHIVE_DIR', root_dir / 'archive')))
+
+
+async def iter_oldest_first(archive: MovementArchive) -> AsyncIterator[dict]:
+    """Every archived row, oldest first, for rebuilds that replay the movement log"""
+    for segment in reversed(archive.segments()):
+        rows = await asyncio.to_thread(archive.read_segment, segment)
+        for row in reversed(rows):
+            yield row
+
+
+# ============= Equipment index =============
+
+def _equipment_key(equipment_id: str) -> str:
+    return f"equipment:{equipment_id}"
+
+
+async def _index_segment(db, month: str, equipment_ids) -> None:
+    updates = [
+        UpdateOne({"_id": _equipment_key(equipment_id)}, {"$addToSet": {"months": month}}, upsert=True)
+        for equipment_id in equipment_ids
+    ]
+    for start in range(0, len(updates), INDEX_BATCH_SIZE):
+        await db.archive_state.bulk_write(updates[start:start + INDEX_BATCH_SIZE], ordered=False)
+
+
+async def build_equipment_index(db, archive: MovementArchive) -> None:
+    """Record the months of every item's archived movements, from the segments on disk"""
+    for segment in archive.segments():
+        rows = await asyncio.to_thread(archive.read_segment, segment)
+        await _index_segment(db, segment["month"], {row['equipment_id'] for row in rows})
+    await db.archive_state.update_one(
+        {"_id": EQUIPMENT_INDEX_ID}, {"$set": {"built_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+
+async def equipment_months(db, archive: MovementArchive, equipment_id: str) -> Optional[List[str]]:
+    """Archive months holding movements of ``equipment_id``; None until the index is built"""
+    if not archive.equipment_index_ready:
+        if not await db.archive_state.find_one({"_id": EQUIPMENT_INDEX_ID}, {"_id": 1}):
+            return None
+        # Only ever extended from here on, so it can be trusted for good
+        archive.equipment_index_ready = True
+    doc = await db.archive_state.find_one({"_id": _equipment_key(equipment_id)}, {"_id": 0, "months": 1})
+    return doc["months"] if doc else []
+
+# ============= Retention job =============
+
+async def _acquire_lock(db, owner: str) -> bool:
+    """One archiver at a time across workers; the lease expires if a holder dies"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.archive_state.update_one(
+            {"_id": "lock", "$or": [{"until": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "until": now + LOCK_TTL}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def _release_lock(db, owner: str) -> None:
+    await db.archive_state.delete_one({"_id": "lock", "owner": owner})
+
+
+async def archive_movements(db, archive: MovementArchive, older_than_days: int) -> int:
+    """Move movements older than ``older_than_days`` into monthly segments"""
+    owner = str(uuid.uuid4())
+    if not await _acquire_lock(db, owner):
+        logger.info("Another process is archiving movements")
+        return 0
+    try:
+        if not await db.archive_state.find_one({"_id": EQUIPMENT_INDEX_ID}, {"_id": 1}):
+            await build_equipment_index(db, archive)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        moved = 0
+        while True:
+            oldest = await db.movements.find_one(
+                {"timestamp": {"$lt": cutoff}}, {"_id": 0, "timestamp": 1}, sort=[("timestamp", ASCENDING)]
+            )
+            if not oldest:
+                break
+            month_start = _month_start(oldest['timestamp'])
+            month_range = {"$gte": month_start, "$lt": min(_next_month(month_start), cutoff)}
+            rows = await db.movements.find({"timestamp": month_range}, {"_id": 0}).to_list(None)
+            month = month_start.strftime("%Y-%m")
+            await asyncio.to_thread(archive.write_segment, month, rows)
+            await _index_segment(db, month, {doc['equipment_id'] for doc in rows})
+
+            ids = [doc['id'] for doc in rows]
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                await db.movements.delete_many({"id": {"$in": ids[start:start + DELETE_BATCH_SIZE]}})
+            moved += len(rows)
+            logger.info("Archived %d movements from %s", len(rows), month)
+        return moved
+    finally:
+        await _release_lock(db, owner)
+
+
+async def archive_periodically(db, archive: MovementArchive, older_than_days: int) -> None:
+    while True:
+        try:
+            await archive_movements(db, archive, older_than_days)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Movement archival failed; retrying at the next run")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+async def _main(args) -> None:
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        archive = archive_from_environment(root_dir)
+        if args.reindex:
+            await build_equipment_index(db, archive)
+            logger.info("Indexed %d archive segments", len(archive.segments()))
+            return
+        moved = await archive_movements(db, archive, args.older_than_days)
+        logger.info("Archived %d movements in total", moved)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old movements into monthly segments")
+    parser.add_argument(
+        "--older-than-days", type=int,
+        default=int(os.environ.get('MOVEMENT_RETENTION_DAYS', '365')),
+        help="move movements older than this many days (default: MOVEMENT_RETENTION_DAYS or 365)"
+    )
+    parser.add_argument("--reindex", action="store_true", help="rebuild the per-equipment index of the segments instead")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
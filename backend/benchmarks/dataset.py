@@ -0,0 +1,272 @@
+"""Seed a database with a synthetic, reproducible equipment/movement dataset.
+
+Every item gets a random number of strictly alternating check-outs and
+check-ins spread over the last ``--days`` days; an item whose last movement
+is a check-out is left "On Loan", some of them past their expected return
+date. Documents are metadata rows sharing one sample PDF blob in
+``uploads/``. Equal arguments and ``--seed`` give the same data, ids
+included, so runs against different versions are comparable.
+
+Rows go in with unordered ``insert_many`` batches; afterwards the declared
+indexes are created and the derived collections (``equipment_stats``,
+``borrowers``) rebuilt from the movement log. Run from the backend
+directory::
+
+    python -m benchmarks.dataset --equipment 100000 --movements 5000000 --documents 50000 --drop
+
+It refuses to write into a database that already holds equipment unless
+``--drop`` is given, which drops every collection the server uses.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import borrowers as borrower_index
+import loan_stats
+import search as equipment_search
+from indexes import INDEXES, ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).parent.parent
+INSERT_BATCH_SIZE = 10_000
+PROGRESS_EVERY = 500_000
+
+CATALOG = [
+    ("Notebook", "Latitude 5440"),
+    ("Notebook", "ThinkPad T14"),
+    ("Notebook", "MacBook Air M2"),
+    ("Projetor", "Epson PowerLite X49"),
+    ("Câmera", "Canon EOS R50"),
+    ("Tablet", "iPad 10"),
+    ("Monitor", "Dell P2423"),
+    ("Microfone", "Rode NT-USB"),
+]
+NOTES = [None, None, "Kit com carregador", "Com bolsa", "Verificar bateria"]
+# Available items not currently loaned end up in these statuses now and then
+IDLE_STATUSES = ["Available"] * 18 + ["Maintenance", "Retired"]
+
+# A minimal valid PDF; every seeded document (and every benchmark upload) shares it
+SAMPLE_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def sample_blob(uploads_dir: Path) -> dict:
+    """Write the shared sample PDF as a content-addressed blob"""
+    sha256 = hashlib.sha256(SAMPLE_PDF).hexdigest()
+    path = uploads_dir / f"{sha256}.pdf"
+    uploads_dir.mkdir(exist_ok=True)
+    if not path.exists():
+        path.write_bytes(SAMPLE_PDF)
+    return {"filename": path.name, "file_path": str(path), "file_size": len(SAMPLE_PDF), "sha256": sha256}
+
+
+def generate(
+    equipment: int,
+    movements: int,
+    borrowers: int,
+    days: int,
+    seed: int,
+    now: datetime
+) -> Iterator[tuple]:
+    """Yield ``(equipment doc, [its movements])`` one item at a time"""
+    rng = random.Random(seed)
+    counts = [0] * equipment
+    for _ in range(movements):
+        counts[rng.randrange(equipment)] += 1
+    window = days * 86400
+
+    for i, count in enumerate(counts):
+        kind, model = CATALOG[i % len(CATALOG)]
+        equipment_id = _uuid(rng)
+        name = f"{kind} {i:06d}"
+        offsets = sorted(rng.uniform(0, window) for _ in range(count))
+        # Created a little before its first movement (or at a random point if never loaned)
+        first = offsets[0] if offsets else rng.uniform(0, window)
+        created_at = now - timedelta(seconds=window - first + rng.uniform(3600, 30 * 86400))
+
+        item_movements = []
+        loan = None
+        for n, offset in enumerate(offsets):
+            timestamp = now - timedelta(seconds=window - offset)
+            if n % 2 == 0:
+                borrower = rng.randrange(borrowers)
+                loan = {
+                    "borrower_name": f"Borrower {borrower}",
+                    "borrower_email": f"borrower{borrower}@example.com",
+                    "delivery_date": timestamp,
+                    "expected_return_date": timestamp + timedelta(days=rng.randint(1, 30)),
+                }
+                movement_type, actual_return_date = "check_out", None
+            else:
+                movement_type, actual_return_date = "check_in", timestamp
+            item_movements.append({
+                "id": _uuid(rng),
+                "equipment_id": equipment_id,
+                "equipment_name": name,
+                "movement_type": movement_type,
+                **loan,
+                "actual_return_date": actual_return_date,
+                "notes": rng.choice(NOTES),
+                "timestamp": timestamp,
+            })
+
+        on_loan = count % 2 == 1
+        doc = {
+            "id": equipment_id,
+            "name": name,
+            "model": model,
+            "serial_number": f"SN{i:08d}",
+            "status": "On Loan" if on_loan else rng.choice(IDLE_STATUSES),
+            "current_borrower": loan["borrower_name"] if on_loan else None,
+            "current_borrower_email": loan["borrower_email"] if on_loan else None,
+            "delivery_date": loan["delivery_date"] if on_loan else None,
+            "expected_return_date": loan["expected_return_date"] if on_loan else None,
+            "created_at": created_at,
+            "updated_at": item_movements[-1]["timestamp"] if item_movements else created_at,
+        }
+        doc.update(equipment_search.search_fields(doc))
+        yield doc, item_movements
+
+
+def generate_documents(equipment_ids: List[str], documents: int, days: int, seed: int, now: datetime, blob: dict) -> Iterator[dict]:
+    rng = random.Random(seed + 1)
+    for i in range(documents):
+        yield {
+            "id": _uuid(rng),
+            "equipment_id": rng.choice(equipment_ids),
+            "movement_id": None,
+            "original_filename": f"termo-{i:06d}.pdf",
+            **blob,
+            "uploaded_at": now - timedelta(seconds=rng.uniform(0, days * 86400)),
+        }
+
+
+class _BatchWriter:
+    def __init__(self, collection, batch_size: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.buffer: List[dict] = []
+        self.written = 0
+
+    async def add(self, docs) -> None:
+        self.buffer.extend(docs)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self.buffer:
+            await self.collection.insert_many(self.buffer, ordered=False)
+            self.written += len(self.buffer)
+            self.buffer = []
+
+
+async def seed(
+    db,
+    equipment: int,
+    movements: int,
+    documents: int,
+    borrowers: int = 0,
+    days: int = 730,
+    seed: int = 42,
+    uploads_dir: Path = BACKEND_DIR / 'uploads',
+    batch_size: int = INSERT_BATCH_SIZE,
+    derived: bool = True,
+) -> dict:
+    """Insert the dataset into ``db`` and return the number of rows written per collection"""
+    now = datetime.now(timezone.utc)
+    borrowers = borrowers or max(1, equipment // 4)
+    equipment_writer = _BatchWriter(db.equipment, batch_size)
+    movement_writer = _BatchWriter(db.movements, batch_size)
+    equipment_ids = []
+    reported = 0
+
+    for doc, item_movements in generate(equipment, movements, borrowers, days, seed, now):
+        equipment_ids.append(doc["id"])
+        await equipment_writer.add([doc])
+        await movement_writer.add(item_movements)
+        if movement_writer.written - reported >= PROGRESS_EVERY:
+            reported = movement_writer.written
+            logger.info("Inserted %d equipment, %d movements", equipment_writer.written, reported)
+    await equipment_writer.flush()
+    await movement_writer.flush()
+
+    document_writer = _BatchWriter(db.documents, batch_size)
+    if documents and equipment_ids:
+        blob = sample_blob(uploads_dir)
+        for doc in generate_documents(equipment_ids, documents, days, seed, now, blob):
+            await document_writer.add([doc])
+        await document_writer.flush()
+        await db.blobs.update_one({"_id": blob["file_path"]}, {"$inc": {"refs": document_writer.written}}, upsert=True)
+
+    counts = {
+        "equipment": equipment_writer.written,
+        "movements": movement_writer.written,
+        "documents": document_writer.written,
+    }
+    logger.info("Inserted %s", counts)
+    if derived:
+        logger.info("Creating indexes")
+        await ensure_indexes(db)
+        counts["equipment_stats"] = await loan_stats.rebuild(db)
+        counts["borrowers"] = await borrower_index.rebuild(db)
+        logger.info("Rebuilt %d equipment_stats and %d borrowers", counts["equipment_stats"], counts["borrowers"])
+    return counts
+
+
+async def drop(db) -> None:
+    for collection_name in set(INDEXES) | {"overdue_snapshot", "settings", "archive_state", "counters", "blobs"}:
+        await db.drop_collection(collection_name)
+
+
+async def _main(args) -> int:
+    load_dotenv(BACKEND_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.drop:
+            await drop(db)
+        elif await db.equipment.find_one({}, {"_id": 1}):
+            logger.error("%s already holds equipment; pass --drop to replace it", os.environ['DB_NAME'])
+            return 1
+        await seed(
+            db, args.equipment, args.movements, args.documents,
+            borrowers=args.borrowers, days=args.days, seed=args.seed,
+            batch_size=args.batch_size, derived=not args.no_derived
+        )
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--equipment", type=int, default=100_000)
+    parser.add_argument("--movements", type=int, default=5_000_000)
+    parser.add_argument("--documents", type=int, default=50_000)
+    parser.add_argument("--borrowers", type=int, default=0, help="distinct borrowers (default: equipment / 4)")
+    parser.add_argument("--days", type=int, default=730, help="spread movements over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=INSERT_BATCH_SIZE)
+    parser.add_argument("--drop", action="store_true", help="drop the server's collections first")
+    parser.add_argument("--no-derived", action="store_true", help="skip indexes and the stats/borrower rebuilds")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,311 @@
+"""Concurrent async load against the API, reported per endpoint as JSON.
+
+``--concurrency`` workers loop for ``--duration`` seconds, each picking
+its next operation from a weighted mix:
+
+* ``equipment`` - ``GET /api/equipment`` (first page, sometimes by status)
+* ``movements`` - ``GET /api/movements`` (first page)
+* ``stats`` - ``GET /api/stats``
+* ``overdue`` - ``GET /api/overdue/detailed``
+* ``loan`` - ``POST /api/movements`` check-out then check-in of an
+  Available item; every worker owns its own items, so there are no 409s
+* ``upload`` - ``POST /api/documents/upload`` of the sample PDF
+
+Requests in the first ``--warmup`` seconds are not recorded. The report has
+requests, errors, requests per second and p50/p95/p99/max latency in
+milliseconds for every endpoint, plus the run parameters and git revision,
+so two reports from different versions can be compared side by side.
+
+The target is a running server (``--url``), the app in this process over
+ASGI against ``MONGO_URL`` (``--in-process``), or the app in this process
+against an in-memory mongomock-motor database seeded on the spot
+(``--mongomock``; needs ``pip install mongomock-motor``, and only measures
+the Python side). In-process targets store uploads in a temporary
+directory that is removed afterwards, never in ``backend/uploads``. Seed a
+real database with ``benchmarks.dataset`` first. Run from the backend directory::
+
+    python -m benchmarks.load --url http://localhost:8001 --concurrency 32 --duration 60 --output before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+from dotenv import load_dotenv
+
+from benchmarks import dataset
+
+DEFAULT_MIX = "equipment=30,movements=20,stats=15,overdue=15,loan=15,upload=5"
+ITEMS_PER_WORKER = 4
+PAGE_SIZE = 50
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # Requests started before this perf_counter() value are warm-up
+        self.record_from = float("inf")
+
+    def record(self, endpoint: str, start: float, status) -> None:
+        if start >= self.record_from:
+            self.latencies[endpoint].append(time.perf_counter() - start)
+            self.statuses[endpoint][str(status)] += 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint in sorted(self.latencies):
+            ordered = sorted(self.latencies[endpoint])
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": sum(n for status, n in statuses.items() if not status.startswith("2")),
+                "rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+                "statuses": dict(sorted(statuses.items())),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {
+            "total": {
+                "requests": total,
+                "errors": sum(e["errors"] for e in endpoints.values()),
+                "rps": round(total / elapsed, 2),
+            },
+            "endpoints": endpoints,
+        }
+
+
+async def timed(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        recorder.record(endpoint, start, type(e).__name__)
+        return None
+    recorder.record(endpoint, start, response.status_code)
+    return response
+
+# ============= Operations =============
+
+
+async def list_equipment(client, recorder, worker):
+    params = {"limit": PAGE_SIZE}
+    if worker.rng.random() < 0.3:
+        params["status"] = worker.rng.choice(["Available", "On Loan"])
+    await timed(client, recorder, "GET /equipment", "GET", "/equipment", params=params)
+
+
+async def list_movements(client, recorder, worker):
+    await timed(client, recorder, "GET /movements", "GET", "/movements", params={"limit": PAGE_SIZE})
+
+
+async def stats(client, recorder, worker):
+    await timed(client, recorder, "GET /stats", "GET", "/stats")
+
+
+async def overdue(client, recorder, worker):
+    await timed(client, recorder, "GET /overdue/detailed", "GET", "/overdue/detailed")
+
+
+async def loan(client, recorder, worker):
+    if not worker.items:
+        return
+    equipment_id = worker.items[worker.loans % len(worker.items)]
+    worker.loans += 1
+    borrower = {"borrower_name": f"Load Worker {worker.number}", "borrower_email": f"load{worker.number}@example.com"}
+    due = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+    await timed(client, recorder, "POST /movements check_out", "POST", "/movements", json={
+        "equipment_id": equipment_id, "movement_type": "check_out", "expected_return_date": due, **borrower
+    })
+    await timed(client, recorder, "POST /movements check_in", "POST", "/movements", json={
+        "equipment_id": equipment_id, "movement_type": "check_in", **borrower
+    })
+
+
+async def upload(client, recorder, worker):
+    if not worker.items:
+        return
+    await timed(
+        client, recorder, "POST /documents/upload", "POST", "/documents/upload",
+        data={"equipment_id": worker.rng.choice(worker.items)},
+        files={"file": ("benchmark.pdf", dataset.SAMPLE_PDF, "application/pdf")}
+    )
+
+
+OPERATIONS = {
+    "equipment": list_equipment,
+    "movements": list_movements,
+    "stats": stats,
+    "overdue": overdue,
+    "loan": loan,
+    "upload": upload,
+}
+
+
+class Worker:
+    def __init__(self, number: int, items: List[str], seed: int):
+        self.number = number
+        self.items = items
+        self.loans = 0
+        self.rng = random.Random(seed + number)
+
+
+async def available_items(client: httpx.AsyncClient, count: int) -> List[str]:
+    """Up to ``count`` Available equipment ids, for the check-out/check-in loop"""
+    ids, cursor = [], None
+    while len(ids) < count:
+        params = {"status": "Available", "limit": min(1000, count - len(ids))}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/equipment", params=params)
+        response.raise_for_status()
+        ids.extend(item["id"] for item in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    return ids
+
+
+async def run(client: httpx.AsyncClient, args) -> dict:
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    items = await available_items(client, args.concurrency * ITEMS_PER_WORKER) if "loan" in mix or "upload" in mix else []
+    if ("loan" in mix or "upload" in mix) and not items:
+        print("No Available equipment: loan and upload are skipped", file=sys.stderr)
+    workers = [
+        Worker(n, items[n * ITEMS_PER_WORKER:(n + 1) * ITEMS_PER_WORKER], args.seed)
+        for n in range(args.concurrency)
+    ]
+    recorder = Recorder()
+    recorder.record_from = time.perf_counter() + args.warmup
+    deadline = recorder.record_from + args.duration
+
+    async def drive(worker: Worker) -> None:
+        while time.perf_counter() < deadline:
+            operation = OPERATIONS[worker.rng.choices(names, weights)[0]]
+            await operation(client, recorder, worker)
+            # An in-process stand-in may never suspend; let the other workers in
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(drive(worker) for worker in workers))
+    return recorder.report(time.perf_counter() - recorder.record_from)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _use_mongomock(server) -> None:
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("--mongomock needs mongomock-motor: pip install mongomock-motor")
+    client = AsyncMongoMockClient(tz_aware=True)
+    server.client = client
+    server.db = server.overdue_monitor.db = client[os.environ['DB_NAME']]
+    server._supports_transactions = False
+
+
+async def _main(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url.rstrip("/") + "/api", limits=limits, timeout=args.timeout) as client:
+            return await run(client, args)
+
+    # server.py connects lazily, so the stand-in can be swapped in before startup
+    import server
+    with tempfile.TemporaryDirectory(prefix="benchmark-uploads-") as uploads_dir:
+        # Benchmark uploads (and the seeded sample blob) stay out of the source tree
+        server.UPLOADS_DIR = Path(uploads_dir)
+        if args.mongomock:
+            _use_mongomock(server)
+            # Indexes are created by the startup hook below
+            await dataset.seed(
+                server.db, args.equipment, args.movements, args.documents,
+                seed=args.seed, uploads_dir=server.UPLOADS_DIR, derived=False
+            )
+        await server.app.router.startup()
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark/api", timeout=args.timeout) as client:
+                return await run(client, args)
+        finally:
+            await server.app.router.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server, e.g. http://localhost:8001")
+    target.add_argument("--in-process", action="store_true", help="serve the app in this process against MONGO_URL")
+    target.add_argument("--mongomock", action="store_true", help="serve the app in this process against mongomock-motor")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to record")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds to run before recording")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    seeding = parser.add_argument_group("--mongomock dataset")
+    seeding.add_argument("--equipment", type=int, default=2_000)
+    seeding.add_argument("--movements", type=int, default=20_000)
+    seeding.add_argument("--documents", type=int, default=500)
+    args = parser.parse_args()
+
+    load_dotenv(dataset.BACKEND_DIR / '.env')
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'benchmark')
+    started_at = datetime.now(timezone.utc)
+    report = asyncio.run(_main(args))
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": started_at.isoformat(),
+            "target": args.url or ("mongomock" if args.mongomock else "in-process"),
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": parse_mix(args.mix),
+        },
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
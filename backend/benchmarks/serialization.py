@@ -0,0 +1,119 @@
+"""Micro-benchmark of the list-endpoint response serialization paths.
+
+Compares, for 1k and 10k synthetic rows shaped like Mongo reads:
+
+* ``response_model`` - what FastAPI does for ``response_model=List[...]``:
+  validate every row, dump to JSON-able Python, then ``json.dumps``
+* ``construct+dump_json`` - trusted ``model_construct`` rows serialized by a
+  precompiled ``TypeAdapter`` in pydantic-core
+* ``orjson`` - the raw rows through ``ORJSONResponse``, as the list
+  endpoints now do
+
+Run from the backend directory::
+
+    python -m benchmarks.serialization [--rows 1000 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+# server.py reads these at import time; no connection is made
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from server import Equipment, Movement  # noqa: E402
+
+
+def equipment_rows(count: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"Notebook {i}",
+        "model": "Latitude 5440",
+        "serial_number": f"SN{i:08d}",
+        "status": "On Loan" if i % 3 else "Available",
+        "current_borrower": f"Borrower {i % 97}" if i % 3 else None,
+        "current_borrower_email": f"borrower{i % 97}@example.com" if i % 3 else None,
+        "delivery_date": now - timedelta(days=i % 30) if i % 3 else None,
+        "expected_return_date": now + timedelta(days=i % 45) if i % 3 else None,
+        "created_at": now - timedelta(days=365),
+        "updated_at": now,
+    } for i in range(count)]
+
+
+def movement_rows(count: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()),
+        "equipment_id": str(uuid.uuid4()),
+        "equipment_name": f"Notebook {i}",
+        "movement_type": "check_out" if i % 2 else "check_in",
+        "borrower_name": f"Borrower {i % 97}",
+        "borrower_email": f"borrower{i % 97}@example.com",
+        "delivery_date": now - timedelta(days=i % 30),
+        "expected_return_date": now + timedelta(days=i % 45),
+        "actual_return_date": None if i % 2 else now,
+        "notes": "Kit with charger and bag",
+        "timestamp": now - timedelta(minutes=i),
+    } for i in range(count)]
+
+
+def _response_model(adapter, model, rows) -> bytes:
+    validated = adapter.validate_python(rows)
+    content = adapter.dump_python(validated, mode='json')
+    # starlette.responses.JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _construct_dump_json(adapter, model, rows) -> bytes:
+    return adapter.dump_json([model.model_construct(**row) for row in rows])
+
+
+def _orjson(adapter, model, rows) -> bytes:
+    return orjson.dumps(rows)
+
+
+PATHS = {
+    "response_model": _response_model,
+    "construct+dump_json": _construct_dump_json,
+    "orjson": _orjson,
+}
+
+
+def best_time(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    datasets = [("equipment", Equipment, equipment_rows), ("movements", Movement, movement_rows)]
+    print(f"{'dataset':<12}{'rows':>8}  {'path':<22}{'ms':>10}{'speedup':>10}")
+    for name, model, make_rows in datasets:
+        adapter = TypeAdapter(List[model])
+        for count in args.rows:
+            rows = make_rows(count)
+            baseline = None
+            for path, fn in PATHS.items():
+                elapsed = best_time(lambda: fn(adapter, model, rows), args.repeat)
+                baseline = baseline or elapsed
+                print(f"{name:<12}{count:>8}  {path:<22}{elapsed * 1000:>10.2f}{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
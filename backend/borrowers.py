@@ -0,0 +1,217 @@
+"""Normalized borrower index, maintained alongside the movement log.
+
+``db.borrowers`` holds one document per borrower, keyed by the normalized
+(trimmed, lower-cased) e-mail address:
+
+* ``name`` - the most recent spelling used on a check-out
+* ``aliases`` - every raw e-mail spelling seen, for the history lookup
+* ``loan_count`` - check-outs so far
+* ``active_equipment_ids`` / ``active_loans`` - items currently held
+* ``first_seen_at`` / ``last_activity_at``
+
+A check-in is credited to the item's current borrower (taken from the
+equipment document before the update), not to whoever typed the form.
+``python borrowers.py --rebuild`` recomputes the collection from the
+archived movements, db.movements and the equipment currently on loan.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from archive import MovementArchive, archive_from_environment, iter_oldest_first
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def normalize_email(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
+
+
+def movement_updates(movements: Iterable[Tuple[object, dict]], now: datetime) -> List[UpdateOne]:
+    """Borrower updates for ``(MovementCreate, equipment before the update)`` pairs.
+
+    Check-outs to the same borrower are merged into one upsert, so a batch
+    never races itself on the unique email index.
+    """
+    checkouts = {}
+    updates = []
+    for movement, equipment in movements:
+        if movement.movement_type == "check_out":
+            email = normalize_email(movement.borrower_email)
+            entry = checkouts.setdefault(email, {"name": movement.borrower_name, "aliases": set(), "ids": []})
+            entry["aliases"].add(movement.borrower_email)
+            entry["ids"].append(equipment["id"])
+        else:
+            holder = normalize_email(equipment.get("current_borrower_email"))
+            if not holder:
+                continue
+            # Matches only if the loan was recorded here, so legacy loans leave no negative count
+            updates.append(UpdateOne(
+                {"email": holder, "active_equipment_ids": equipment["id"]},
+                {
+                    "$pull": {"active_equipment_ids": equipment["id"]},
+                    "$inc": {"active_loans": -1},
+                    "$set": {"last_activity_at": now},
+                }
+            ))
+    for email, entry in checkouts.items():
+        updates.append(UpdateOne(
+            {"email": email},
+            {
+                "$set": {"name": entry["name"], "last_activity_at": now},
+                "$setOnInsert": {"email": email, "first_seen_at": now},
+                "$inc": {"loan_count": len(entry["ids"]), "active_loans": len(entry["ids"])},
+                "$addToSet": {
+                    "aliases": {"$each": sorted(entry["aliases"])},
+                    "active_equipment_ids": {"$each": entry["ids"]},
+                },
+            },
+            upsert=True
+        ))
+    return updates
+
+
+def equipment_deleted_update(equipment_id: str) -> UpdateOne:
+    return UpdateOne(
+        {"active_equipment_ids": equipment_id},
+        {"$pull": {"active_equipment_ids": equipment_id}, "$inc": {"active_loans": -1}}
+    )
+
+
+async def apply_updates(db, updates: List[UpdateOne], session=None) -> None:
+    if updates:
+        await db.borrowers.bulk_write(updates, ordered=False, session=session)
+
+
+async def _archived_history(archive: MovementArchive) -> dict:
+    """The per-borrower figures ``rebuild`` aggregates from db.movements, over archived rows"""
+    history = {}
+    async for movement in iter_oldest_first(archive):
+        email = normalize_email(movement.get("borrower_email"))
+        if not email:
+            continue
+        row = history.setdefault(email, {
+            "_id": email,
+            "name": None,
+            "aliases": set(),
+            "loan_count": 0,
+            "first_seen_at": movement["timestamp"],
+        })
+        # Same precedence as the aggregation: the latest check-out spelling, else the latest one
+        if movement["movement_type"] == "check_out":
+            row["loan_count"] += 1
+            row["name"] = movement["borrower_name"]
+        elif not row["loan_count"]:
+            row["name"] = movement["borrower_name"]
+        row["aliases"].add(movement["borrower_email"])
+        row["last_activity_at"] = movement["timestamp"]
+    return history
+
+
+def _merge_history(archived: Optional[dict], hot: Optional[dict]) -> dict:
+    """One borrower's figures over archived rows followed by (newer) hot ones"""
+    if not archived or not hot:
+        return archived or hot
+    return {
+        "_id": hot["_id"],
+        "name": hot["name"] if hot["loan_count"] or not archived["loan_count"] else archived["name"],
+        "aliases": set(archived["aliases"]) | set(hot["aliases"]),
+        "loan_count": archived["loan_count"] + hot["loan_count"],
+        "first_seen_at": archived["first_seen_at"],
+        "last_activity_at": hot["last_activity_at"],
+    }
+
+
+async def rebuild(db, archive: Optional[MovementArchive] = None) -> int:
+    """Recompute every borrower document from movements (archived ones too) and current loans"""
+    email = {"$toLower": {"$trim": {"input": "$borrower_email"}}}
+    is_checkout = {"$eq": ["$movement_type", "check_out"]}
+    history = db.movements.aggregate([
+        # Check-outs sort last, so $last picks the latest check-out spelling of the name
+        {"$addFields": {"_is_checkout": {"$cond": [is_checkout, 1, 0]}}},
+        {"$sort": {"_is_checkout": 1, "timestamp": 1}},
+        {"$group": {
+            "_id": email,
+            "name": {"$last": "$borrower_name"},
+            "aliases": {"$addToSet": "$borrower_email"},
+            "loan_count": {"$sum": "$_is_checkout"},
+            "first_seen_at": {"$min": "$timestamp"},
+            "last_activity_at": {"$max": "$timestamp"},
+        }},
+    ], allowDiskUse=True)
+    archived = await _archived_history(archive) if archive is not None else {}
+    rows = {}
+    async for row in history:
+        rows[row["_id"]] = _merge_history(archived.pop(row["_id"], None), row)
+    rows.update(archived)
+
+    borrowers = {}
+    for row in rows.values():
+        if not row["_id"]:
+            continue
+        borrowers[row["_id"]] = {
+            "email": row["_id"],
+            "name": row["name"],
+            "aliases": sorted(row["aliases"]),
+            "loan_count": row["loan_count"],
+            "active_equipment_ids": [],
+            "active_loans": 0,
+            "first_seen_at": row["first_seen_at"],
+            "last_activity_at": row["last_activity_at"],
+        }
+
+    now = datetime.now(timezone.utc)
+    on_loan = db.equipment.find({"status": "On Loan"}, {"_id": 0, "id": 1, "current_borrower": 1, "current_borrower_email": 1})
+    async for equipment in on_loan:
+        holder = normalize_email(equipment.get("current_borrower_email"))
+        if not holder:
+            continue
+        doc = borrowers.setdefault(holder, {
+            "email": holder,
+            "name": equipment.get("current_borrower"),
+            "aliases": [equipment["current_borrower_email"]],
+            "loan_count": 0,
+            "active_equipment_ids": [],
+            "active_loans": 0,
+            "first_seen_at": now,
+            "last_activity_at": now,
+        })
+        if equipment["current_borrower_email"] not in doc["aliases"]:
+            doc["aliases"].append(equipment["current_borrower_email"])
+        doc["active_equipment_ids"].append(equipment["id"])
+        doc["active_loans"] += 1
+
+    await db.borrowers.delete_many({})
+    docs = list(borrowers.values())
+    for start in range(0, len(docs), REBUILD_BATCH_SIZE):
+        await db.borrowers.insert_many(docs[start:start + REBUILD_BATCH_SIZE], ordered=False)
+    return len(docs)
+
+
+async def _main(args) -> None:
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        if args.rebuild:
+            count = await rebuild(client[os.environ['DB_NAME']], archive_from_environment(root_dir))
+            logger.info("Rebuilt %d borrowers", count)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the borrower index")
+    parser.add_argument("--rebuild", action="store_true", help="recompute db.borrowers from movements (archived too) and loans")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,92 @@
+"""In-process read caches that the write endpoints invalidate."""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight load.
+
+    The load runs as its own task, so a caller that goes away (a client
+    disconnect cancels its request) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def start(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    async def run(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        return await asyncio.shield(self.start(key, loader))
+
+    def _finished(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Retrieved here too, in case every caller was cancelled meanwhile
+            future.exception()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+class ReadCache:
+    """Keyed TTL cache for read endpoints.
+
+    Concurrent misses for a key share one load, so a burst of identical
+    requests costs one database call. With ``stale_seconds`` an expired entry
+    is still served for that long while a single background load refreshes
+    it. ``invalidate`` drops every entry and bumps a generation counter, so a
+    load that was already in flight when a write happened is returned to its
+    callers but neither stored nor shared with later ones.
+    """
+
+    def __init__(self, ttl_seconds: float, stale_seconds: float = 0):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries = {}
+        self._generation = 0
+        self._flights = SingleFlight()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        if entry is not None and entry[0] + self.stale_seconds > now:
+            self._refresh(key, loader)
+            return entry[1]
+        return await self._flights.run((self._generation, key), lambda: self._load(key, loader))
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        generation = self._generation
+        value = await loader()
+        if generation == self._generation:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        return value
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        flight_key = (self._generation, key)
+        if flight_key in self._flights:
+            return
+        future = self._flights.start(flight_key, lambda: self._load(key, loader))
+        future.add_done_callback(lambda done: self._log_failure(key, done))
+
+    @staticmethod
+    def _log_failure(key: Hashable, future: asyncio.Future) -> None:
+        # Nobody awaits a background refresh; the stale entry simply expires
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Background refresh of %r failed", key, exc_info=future.exception())
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._entries.clear()
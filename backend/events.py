@@ -0,0 +1,115 @@
+"""In-process event bus and the Server-Sent Events stream behind /api/events.
+
+Write endpoints publish equipment, movement and document changes, and the
+overdue monitor publishes the overdue list whenever it changes. With
+``EVENTS_CHANGE_STREAMS=1`` (replica set required) the collection events
+come from Mongo change streams instead, so every worker sees every write.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# collection -> event prefix for change-stream sourced events
+WATCHED_COLLECTIONS = {"equipment": "equipment", "movements": "movement", "documents": "document"}
+_OPERATIONS = {"insert": "created", "update": "updated", "replace": "updated", "delete": "deleted"}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def publish(self, event_type: str, data: dict) -> None:
+        message = {"type": event_type, "data": data, "at": datetime.now(timezone.utc)}
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A client that stopped reading is dropped; EventSource reconnects
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+def format_sse(message: dict) -> str:
+    payload = json.dumps(message, default=_json_default)
+    return f"event: {message['type']}\ndata: {payload}\n\n"
+
+
+async def sse_stream(bus: EventBus, request: Request):
+    queue = bus.subscribe()
+    try:
+        # Tell EventSource how long to wait before reconnecting
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if message is None:
+                break
+            yield format_sse(message)
+    finally:
+        bus.unsubscribe(queue)
+
+
+async def watch_change_streams(db, bus: EventBus) -> None:
+    """Publish inserts, updates and deletes of the watched collections"""
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+        "operationType": {"$in": list(_OPERATIONS)},
+    }}]
+    resume_token: Optional[dict] = None
+    while True:
+        try:
+            async with db.watch(
+                pipeline,
+                full_document="updateLookup",
+                # deletes carry the old document only where pre-images are enabled
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    prefix = WATCHED_COLLECTIONS[change["ns"]["coll"]]
+                    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+                    document.pop("_id", None)
+                    document.pop("search_tokens", None)
+                    document.pop("search_words", None)
+                    document.pop("search_version", None)
+                    bus.publish(f"{prefix}.{_OPERATIONS[change['operationType']]}", document)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream interrupted; resuming in 5s")
+            await asyncio.sleep(5)
@@ -0,0 +1,229 @@
+"""MongoDB index declarations, startup reconciliation and query-plan checks.
+
+The server calls ``ensure_indexes`` on startup. To check the query plans of
+every endpoint run::
+
+    python indexes.py --verify
+
+which reconciles the indexes, runs ``explain()`` on each endpoint query shape
+and exits non-zero when any of them falls back to a COLLSCAN.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+import changes as change_log
+
+logger = logging.getLogger(__name__)
+
+# ============= Index Declarations =============
+
+INDEXES = {
+    "equipment": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("status", ASCENDING), ("expected_return_date", ASCENDING)],
+            name="status_expected_return_date",
+        ),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)], name="name_id"),
+        IndexModel(
+            [("status", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)],
+            name="status_name_id",
+        ),
+        IndexModel([("search_tokens", ASCENDING)], name="search_tokens"),
+        IndexModel([("search_words", ASCENDING)], name="search_words"),
+    ],
+    "movements": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("timestamp", DESCENDING), ("id", DESCENDING)], name="timestamp_id"),
+        IndexModel(
+            [("equipment_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)],
+            name="equipment_id_timestamp_id",
+        ),
+        IndexModel(
+            [("movement_type", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)],
+            name="movement_type_timestamp_id",
+        ),
+        IndexModel(
+            [("borrower_email", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)],
+            name="borrower_email_timestamp_id",
+        ),
+    ],
+    "documents": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("equipment_id", ASCENDING)], name="equipment_id"),
+    ],
+    "settings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "borrowers": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Only borrowers currently holding equipment, for ?active=true
+        IndexModel(
+            [("email", ASCENDING), ("active_loans", ASCENDING)],
+            name="active_email",
+            partialFilterExpression={"active_loans": {"$gt": 0}},
+        ),
+        IndexModel([("active_equipment_ids", ASCENDING)], name="active_equipment_ids"),
+    ],
+    "changes": [
+        IndexModel([("seq", ASCENDING)], name="seq_unique", unique=True),
+        IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=change_log.RETENTION_DAYS * 86400),
+    ],
+    "equipment_stats": [
+        IndexModel([("equipment_id", ASCENDING)], name="equipment_id_unique", unique=True),
+        IndexModel(
+            [("total_loan_seconds", ASCENDING), ("equipment_id", ASCENDING)],
+            name="total_loan_seconds_equipment_id",
+        ),
+        IndexModel([("loan_count", ASCENDING), ("equipment_id", ASCENDING)], name="loan_count_equipment_id"),
+        IndexModel([("late_returns", ASCENDING), ("equipment_id", ASCENDING)], name="late_returns_equipment_id"),
+    ],
+}
+
+
+def _same_spec(existing: dict, index: IndexModel) -> bool:
+    wanted = index.document
+    return (
+        list(existing["key"]) == list(wanted["key"].items())
+        and bool(existing.get("unique")) == bool(wanted.get("unique"))
+        and existing.get("expireAfterSeconds") == wanted.get("expireAfterSeconds")
+    )
+
+
+async def ensure_indexes(db, prune: bool = False) -> None:
+    """Create missing indexes and rebuild the ones whose spec has changed.
+
+    Undeclared indexes are left alone unless ``prune`` is set.
+    """
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = {index.document["name"] for index in indexes}
+
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing:
+                if _same_spec(existing[name], index):
+                    continue
+                logger.info("Rebuilding index %s.%s", collection_name, name)
+                await collection.drop_index(name)
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                # e.g. duplicate ids in legacy data; keep serving without it
+                logger.error("Could not create index %s.%s: %s", collection_name, name, e)
+
+        if prune:
+            for name in existing:
+                if name != "_id_" and name not in declared:
+                    logger.info("Dropping undeclared index %s.%s", collection_name, name)
+                    await collection.drop_index(name)
+
+# ============= Query Plan Verification =============
+
+def query_shapes():
+    """(endpoint, collection, filter, sort) for every query the API issues."""
+    now = datetime.now(timezone.utc)
+    some_id = "00000000-0000-0000-0000-000000000000"
+    overdue = {"status": "On Loan", "expected_return_date": {"$lt": now}}
+    by_name = [("name", ASCENDING), ("id", ASCENDING)]
+    by_time = [("timestamp", DESCENDING), ("id", DESCENDING)]
+    return [
+        ("get_equipment", "equipment", {"id": some_id}, None),
+        ("get_all_equipment", "equipment", {}, by_name),
+        ("get_all_equipment?status", "equipment", {"status": "Available"}, by_name),
+        ("get_all_equipment?ids", "equipment", {"id": {"$in": [some_id]}}, None),
+        ("get_all_equipment?search", "equipment", {
+            "search_tokens": {"$all": ["macbook", "pro"]},
+            "$or": [{"search_words": {"$all": ["macbook", "pro"]}}, {"search_words": "macbookpro"}],
+        }, by_name),
+        ("get_all_equipment?search&partial", "equipment",
+         {"search_tokens": {"$all": ["book", "pro"]}, "id": {"$nin": [some_id]}}, by_name),
+        ("get_overdue_equipment", "equipment", overdue, None),
+        ("get_overdue_detailed", "equipment", overdue, None),
+        ("export_overdue", "equipment", overdue, [("expected_return_date", ASCENDING)]),
+        ("create_movement", "movements", {"id": some_id}, None),
+        ("get_all_movements", "movements", {}, by_time),
+        ("get_all_movements?equipment_id", "movements", {"equipment_id": some_id}, by_time),
+        ("get_all_movements?movement_type", "movements", {"movement_type": "check_out"}, by_time),
+        ("get_all_movements?start_date", "movements", {"timestamp": {"$gte": now}}, by_time),
+        ("get_equipment_documents", "documents", {"equipment_id": some_id}, None),
+        ("download_document", "documents", {"id": some_id}, None),
+        ("get_settings", "settings", {"id": "system_settings"}, None),
+        ("get_borrowers", "borrowers", {}, [("email", ASCENDING)]),
+        ("get_borrowers?active", "borrowers", {"active_loans": {"$gt": 0}}, [("email", ASCENDING)]),
+        ("get_borrower_active", "borrowers", {"email": "a@example.com"}, None),
+        ("get_borrower_history", "movements", {"borrower_email": {"$in": ["a@example.com", "A@example.com"]}}, by_time),
+        ("delete_equipment", "borrowers", {"active_equipment_ids": some_id}, None),
+        ("get_changes", "changes", {"seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+        ("get_equipment_stats", "equipment_stats", {"equipment_id": some_id}, None),
+        ("get_utilization_report", "equipment_stats", {},
+         [("total_loan_seconds", DESCENDING), ("equipment_id", DESCENDING)]),
+        ("get_utilization_report?sort=loan_count", "equipment_stats", {},
+         [("loan_count", DESCENDING), ("equipment_id", DESCENDING)]),
+    ]
+
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+    # classic and SBE explain output nest the plan differently
+    if "queryPlan" in plan:
+        yield from _plan_stages(plan["queryPlan"])
+
+
+async def verify_query_plans(db) -> list:
+    """Explain every query shape; return the endpoints that COLLSCAN."""
+    failures = []
+    for endpoint, collection_name, query, sort in query_shapes():
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning = explain["queryPlanner"]["winningPlan"]
+        stages = [stage for stage in _plan_stages(winning) if stage]
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        logger.info("%-36s %-10s %s", endpoint, collection_name, " <- ".join(stages))
+        if status == "COLLSCAN":
+            failures.append(endpoint)
+    return failures
+
+
+async def _main(args) -> int:
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await ensure_indexes(db, prune=args.prune)
+        if not args.verify:
+            return 0
+        failures = await verify_query_plans(db)
+        if failures:
+            logger.error("COLLSCAN in: %s", ", ".join(failures))
+            return 1
+        logger.info("All query shapes are served by an index")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB indexes")
+    parser.add_argument("--verify", action="store_true", help="explain() every endpoint query and fail on COLLSCAN")
+    parser.add_argument("--prune", action="store_true", help="drop indexes that are not declared here")
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sys.exit(asyncio.run(_main(parser.parse_args())))
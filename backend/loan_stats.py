@@ -0,0 +1,202 @@
+"""Per-equipment loan statistics, maintained incrementally from movements.
+
+``db.equipment_stats`` holds one document per equipment item:
+
+* ``loan_count`` - check-outs so far
+* ``total_loan_seconds`` - time on loan over completed loans
+* ``late_returns`` - check-ins after the expected return date
+* ``last_borrower_name`` / ``last_borrower_email`` / ``last_checkout_at``
+* ``current_loan_started_at`` - set while the item is out
+* ``tracked_since`` - equipment creation time, the utilization denominator
+
+``create_movement`` and the batch endpoint apply ``movement_update`` in the
+same request, so reading an item's statistics is a single indexed lookup.
+``python loan_stats.py --rebuild`` recomputes everything from the archived
+movements followed by db.movements.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+
+from archive import MovementArchive, archive_from_environment, iter_oldest_first
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def checkout_update(equipment: dict, borrower_name: str, borrower_email: str, now: datetime) -> UpdateOne:
+    return UpdateOne(
+        {"equipment_id": equipment['id']},
+        {
+            "$inc": {"loan_count": 1},
+            "$set": {
+                "equipment_name": equipment['name'],
+                "last_borrower_name": borrower_name,
+                "last_borrower_email": borrower_email,
+                "last_checkout_at": now,
+                "current_loan_started_at": now,
+                "updated_at": now,
+            },
+            "$setOnInsert": {
+                "total_loan_seconds": 0,
+                "late_returns": 0,
+                "tracked_since": equipment.get('created_at') or now,
+            },
+        },
+        upsert=True
+    )
+
+
+def checkin_update(equipment: dict, now: datetime) -> UpdateOne:
+    """``equipment`` is the document as it was before the check-in"""
+    expected_return = equipment.get('expected_return_date')
+    late = 1 if expected_return and now > expected_return else 0
+    # Pipeline update: the loan duration needs the stored start time
+    return UpdateOne(
+        {"equipment_id": equipment['id']},
+        [{"$set": {
+            "total_loan_seconds": {"$add": [
+                {"$ifNull": ["$total_loan_seconds", 0]},
+                {"$cond": [
+                    {"$ifNull": ["$current_loan_started_at", False]},
+                    {"$divide": [{"$subtract": [now, "$current_loan_started_at"]}, 1000]},
+                    0
+                ]}
+            ]},
+            "late_returns": {"$add": [{"$ifNull": ["$late_returns", 0]}, late]},
+            "loan_count": {"$ifNull": ["$loan_count", 0]},
+            "equipment_name": equipment['name'],
+            "current_loan_started_at": None,
+            "tracked_since": {"$ifNull": ["$tracked_since", equipment.get('created_at') or now]},
+            "updated_at": now,
+        }}],
+        upsert=True
+    )
+
+
+def movement_update(equipment: dict, movement_type: str, borrower_name: str, borrower_email: str, now: datetime) -> UpdateOne:
+    if movement_type == "check_out":
+        return checkout_update(equipment, borrower_name, borrower_email, now)
+    return checkin_update(equipment, now)
+
+
+async def apply_updates(db, updates: List[UpdateOne], session=None) -> None:
+    if updates:
+        await db.equipment_stats.bulk_write(updates, ordered=False, session=session)
+
+
+def present(doc: Optional[dict], equipment_id: str, now: datetime) -> dict:
+    """API shape, counting the loan in progress towards utilization"""
+    doc = doc or {}
+    total = doc.get('total_loan_seconds', 0)
+    started = doc.get('current_loan_started_at')
+    if started:
+        total += (now - started).total_seconds()
+    tracked = (now - doc['tracked_since']).total_seconds() if doc.get('tracked_since') else 0
+    loan_count = doc.get('loan_count', 0)
+    return {
+        "equipment_id": equipment_id,
+        "equipment_name": doc.get('equipment_name'),
+        "loan_count": loan_count,
+        "total_loan_days": round(total / 86400, 2),
+        "average_loan_days": round(total / 86400 / loan_count, 2) if loan_count else 0,
+        "late_returns": doc.get('late_returns', 0),
+        "last_borrower_name": doc.get('last_borrower_name'),
+        "last_borrower_email": doc.get('last_borrower_email'),
+        "last_checkout_at": doc.get('last_checkout_at'),
+        "on_loan": bool(started),
+        "utilization": round(min(total / tracked, 1.0), 4) if tracked > 0 else 0,
+    }
+
+
+def _replay(stats: dict, created: dict, movement: dict) -> None:
+    """Apply one movement to the rebuilt stats; each item's movements must come oldest first"""
+    equipment_id = movement['equipment_id']
+    equipment = created.get(equipment_id, {})
+    doc = stats.setdefault(equipment_id, {
+        "equipment_id": equipment_id,
+        "equipment_name": equipment.get('name', movement['equipment_name']),
+        "loan_count": 0,
+        "total_loan_seconds": 0,
+        "late_returns": 0,
+        "current_loan_started_at": None,
+        "current_expected_return": None,
+        "tracked_since": equipment.get('created_at') or movement['timestamp'],
+    })
+    if movement['movement_type'] == "check_out":
+        doc['loan_count'] += 1
+        doc['last_borrower_name'] = movement['borrower_name']
+        doc['last_borrower_email'] = movement['borrower_email']
+        doc['last_checkout_at'] = movement['timestamp']
+        doc['current_loan_started_at'] = movement['timestamp']
+        doc['current_expected_return'] = movement.get('expected_return_date')
+    elif doc['current_loan_started_at']:
+        doc['total_loan_seconds'] += (movement['timestamp'] - doc['current_loan_started_at']).total_seconds()
+        expected = doc['current_expected_return']
+        if expected and movement['timestamp'] > expected:
+            doc['late_returns'] += 1
+        doc['current_loan_started_at'] = None
+        doc['current_expected_return'] = None
+
+
+async def rebuild(db, archive: Optional[MovementArchive] = None) -> int:
+    """Recompute every equipment_stats document from the movement log.
+
+    Archived movements are all older than the hot ones, so replaying the
+    archive first keeps every item's movements in order.
+    """
+    created = {
+        e['id']: e for e in await db.equipment.find(
+            {}, {"_id": 0, "id": 1, "name": 1, "created_at": 1}
+        ).to_list(None)
+    }
+    await db.equipment_stats.delete_many({})
+
+    stats = {}
+    if archive is not None:
+        async for movement in iter_oldest_first(archive):
+            if movement['movement_type'] in ("check_out", "check_in"):
+                _replay(stats, created, movement)
+    cursor = db.movements.find(
+        {"movement_type": {"$in": ["check_out", "check_in"]}}, {"_id": 0}
+    ).sort([("equipment_id", ASCENDING), ("timestamp", ASCENDING)]).batch_size(REBUILD_BATCH_SIZE)
+    async for movement in cursor:
+        _replay(stats, created, movement)
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for doc in stats.values():
+        doc.pop('current_expected_return')
+        doc['updated_at'] = now
+        docs.append(doc)
+    for start in range(0, len(docs), REBUILD_BATCH_SIZE):
+        await db.equipment_stats.insert_many(docs[start:start + REBUILD_BATCH_SIZE], ordered=False)
+    return len(docs)
+
+
+async def _main(args) -> None:
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        if args.rebuild:
+            count = await rebuild(client[os.environ['DB_NAME']], archive_from_environment(root_dir))
+            logger.info("Rebuilt loan statistics for %d equipment items", count)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain per-equipment loan statistics")
+    parser.add_argument("--rebuild", action="store_true", help="recompute equipment_stats from the archive and db.movements")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
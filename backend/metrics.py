@@ -0,0 +1,295 @@
+"""Request and Mongo command instrumentation, exposed in Prometheus text format.
+
+``MetricsMiddleware`` records per-route request counts, latency and response
+size; the route label is the path template (``/api/equipment/{equipment_id}``),
+so ids never become label values. ``MongoCommandMetrics`` is a pymongo
+``CommandListener`` recording per-collection, per-command durations and
+returned document counts, and how often a ``find``/``aggregate`` came back
+with exactly as many documents as its limit allowed. With ``SLOW_QUERY_MS``
+set, commands at least that slow are also logged.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 10, 100, 1_000, 10_000)
+SLOW_COMMAND_LOG_CHARS = 1000
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self._values: Dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _labels(self.label_names + ("le",), labels + (le,))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]:g}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+# ============= HTTP =============
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time from request to the last response byte", ("method", "route")
+)
+http_response_size = registry.histogram(
+    "http_response_size_bytes", "Response body size", ("method", "route"), buckets=SIZE_BUCKETS
+)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last chunk"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[dict] = None
+
+    def _route_label(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched endpoint in the shared scope
+            route = self._route_label(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, status)
+            http_latency.observe(time.perf_counter() - start, method, route)
+            http_response_size.observe(size, method, route)
+
+# ============= Mongo =============
+
+mongo_commands = registry.counter(
+    "mongo_commands_total", "Mongo commands by collection, command and outcome", ("collection", "command", "outcome")
+)
+mongo_latency = registry.histogram(
+    "mongo_command_duration_seconds", "Mongo command round-trip time", ("collection", "command")
+)
+mongo_documents = registry.histogram(
+    "mongo_documents_returned", "Documents a cursor returned in total, or a write command matched",
+    ("collection", "command"), buckets=COUNT_BUCKETS
+)
+mongo_limit_reached = registry.counter(
+    "mongo_limit_reached_total", "find/aggregate results that filled their limit exactly",
+    ("collection", "command")
+)
+mongo_slow_commands = registry.counter(
+    "mongo_slow_commands_total", "Commands slower than SLOW_QUERY_MS", ("collection", "command")
+)
+
+# Commands whose value names the collection; getMore names it in "collection"
+_COLLECTION_COMMANDS = {
+    "find", "aggregate", "count", "distinct", "insert", "update", "delete",
+    "findAndModify", "createIndexes", "listIndexes", "dropIndexes",
+}
+_TRACKED_COMMANDS = _COLLECTION_COMMANDS | {"getMore", "explain", "killCursors"}
+
+
+# Session plumbing and bulk payloads are left out of the slow-query log
+_UNLOGGED_FIELDS = {"lsid", "$clusterTime", "$db", "txnNumber", "documents", "updates", "deletes"}
+
+
+def _collection(command_name: str, command) -> str:
+    if command_name in _COLLECTION_COMMANDS:
+        value = command.get(command_name)
+        return value if isinstance(value, str) else "-"
+    if command_name == "getMore":
+        return command.get("collection", "-")
+    return "-"
+
+
+def _command_limit(command_name: str, command) -> Optional[int]:
+    if command_name == "find":
+        return command.get("limit")
+    if command_name == "aggregate":
+        for stage in reversed(command.get("pipeline", [])):
+            if "$limit" in stage:
+                return stage["$limit"]
+    return None
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, slow_ms: Optional[float] = None):
+        self.slow_ms = slow_ms
+        # (connection, request id) -> (collection, limit, getMore cursor id, command summary)
+        self._pending: Dict[tuple, tuple] = {}
+        # open cursor id -> [collection, command, limit, documents so far]
+        self._cursors: Dict[int, list] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        if event.command_name not in _TRACKED_COMMANDS:
+            return
+        command = event.command
+        summary = None
+        if self.slow_ms is not None:
+            summary = {k: v for k, v in command.items() if k not in _UNLOGGED_FIELDS}
+        with self._lock:
+            if event.command_name == "killCursors":
+                for cursor_id in command.get("cursors", []):
+                    self._close_cursor(self._cursors.pop(cursor_id, None))
+            self._pending[(event.connection_id, event.request_id)] = (
+                _collection(event.command_name, command),
+                _command_limit(event.command_name, command),
+                command.get("getMore"),
+                summary,
+            )
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return None
+        collection, limit, cursor_id, summary = pending
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands.inc(collection, event.command_name, outcome)
+        mongo_latency.observe(seconds, collection, event.command_name)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            mongo_slow_commands.inc(collection, event.command_name)
+            logger.warning(
+                "Slow Mongo %s on %s: %.1f ms %s",
+                event.command_name, collection, seconds * 1000, str(summary)[:SLOW_COMMAND_LOG_CHARS]
+            )
+        return collection, limit, cursor_id
+
+    @staticmethod
+    def _close_cursor(entry: Optional[list]) -> None:
+        if entry is None:
+            return
+        collection, command_name, limit, count = entry
+        mongo_documents.observe(count, collection, command_name)
+        if limit and count >= limit:
+            mongo_limit_reached.inc(collection, command_name)
+
+    def succeeded(self, event) -> None:
+        finished = self._finish(event, "ok")
+        if finished is None:
+            return
+        collection, limit, getmore_id = finished
+        cursor = event.reply.get("cursor")
+        if cursor is not None:
+            # A result spans the first batch and any getMores; count it when the cursor closes
+            with self._lock:
+                if getmore_id is not None:
+                    entry = self._cursors.pop(getmore_id, None)
+                    if entry is None:
+                        return
+                    entry[3] += len(cursor.get("nextBatch", []))
+                else:
+                    entry = [collection, event.command_name, limit, len(cursor.get("firstBatch", []))]
+                if cursor.get("id"):
+                    self._cursors[cursor["id"]] = entry
+                else:
+                    self._close_cursor(entry)
+        elif "n" in event.reply:
+            mongo_documents.observe(event.reply["n"], collection, event.command_name)
+
+    def failed(self, event) -> None:
+        self._finish(event, "error")
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,249 @@
+"""Resumable, batched data migrations.
+
+Earlier releases stored every date as an ISO-8601 string. ``migrate_dates``
+rewrites those fields as native BSON datetimes. It walks each collection in
+``_id`` order and records a checkpoint in ``db.migrations`` after every batch,
+so an interrupted run picks up where it stopped. ``backfill_search_tokens``
+(re)builds the search index fields of equipment written by an older
+tokenizer. Run them by hand with::
+
+    python migrations.py
+
+``backfill_blob_refs`` counts the references of blobs stored before
+``db.blobs`` existed; the server awaits it on startup, before serving.
+
+``python migrations.py --dedupe-uploads`` additionally moves documents that
+were uploaded before content-addressed storage onto their SHA-256 blobs,
+recounts every blob's references and deletes the files no document uses.
+Run it with the server stopped.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+
+from search import SEARCH_TOKENS_VERSION, search_fields
+from storage import CHUNK_SIZE, blob_path
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = {
+    "equipment": ["created_at", "updated_at", "delivery_date", "expected_return_date"],
+    "movements": ["timestamp", "delivery_date", "expected_return_date", "actual_return_date"],
+    "documents": ["uploaded_at"],
+    "settings": ["updated_at"],
+}
+BATCH_SIZE = 1000
+
+
+def parse_iso_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def _migrate_collection_dates(db, collection_name: str, fields: list) -> int:
+    checkpoint_id = f"dates_v1:{collection_name}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("done"):
+        return 0
+
+    any_string = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    last_id = checkpoint.get("last_id")
+    migrated = 0
+
+    while True:
+        query = any_string if last_id is None else {"$and": [any_string, {"_id": {"$gt": last_id}}]}
+        batch = await db[collection_name].find(query, {field: 1 for field in fields}).sort(
+            "_id", ASCENDING
+        ).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+
+        updates = []
+        for doc in batch:
+            converted = {}
+            for field in fields:
+                if isinstance(doc.get(field), str):
+                    try:
+                        converted[field] = parse_iso_datetime(doc[field])
+                    except ValueError:
+                        logger.warning("Unparseable %s.%s on %s: %r", collection_name, field, doc["_id"], doc[field])
+            if converted:
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": converted}))
+
+        if updates:
+            await db[collection_name].bulk_write(updates, ordered=False)
+        migrated += len(updates)
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"last_id": last_id}}, upsert=True)
+
+    await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"done": True}}, upsert=True)
+    return migrated
+
+
+async def migrate_dates(db) -> None:
+    """Convert ISO-string date fields to BSON datetimes in every collection"""
+    for collection_name, fields in DATE_FIELDS.items():
+        migrated = await _migrate_collection_dates(db, collection_name, fields)
+        if migrated:
+            logger.info("Converted dates on %d %s documents", migrated, collection_name)
+
+
+async def backfill_search_tokens(db) -> None:
+    """Tokenize equipment that predates the current search index version"""
+    stale = {"search_version": {"$ne": SEARCH_TOKENS_VERSION}}
+    projection = {"name": 1, "model": 1, "serial_number": 1}
+    migrated = 0
+    while True:
+        # Updated documents drop out of the filter, so each pass resumes by itself
+        batch = await db.equipment.find(stale, projection).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+        await db.equipment.bulk_write(
+            [UpdateOne({"_id": doc["_id"]}, {"$set": search_fields(doc)}) for doc in batch],
+            ordered=False
+        )
+        migrated += len(batch)
+    if migrated:
+        logger.info("Built search tokens for %d equipment documents", migrated)
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _document_refs(db) -> dict:
+    """file_path -> number of documents stored in it"""
+    pipeline = [{"$group": {"_id": "$file_path", "refs": {"$sum": 1}}}]
+    return {row["_id"]: row["refs"] async for row in db.documents.aggregate(pipeline) if row["_id"]}
+
+
+async def _write_in_batches(collection, updates: list) -> None:
+    for start in range(0, len(updates), BATCH_SIZE):
+        await collection.bulk_write(updates[start:start + BATCH_SIZE], ordered=False)
+
+
+async def backfill_blob_refs(db) -> None:
+    """Create the db.blobs reference counts for documents that predate them"""
+    checkpoint_id = "blob_refs_v1"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("done"):
+        return
+    refs = await _document_refs(db)
+    # $max, so a run that was interrupted half way can simply start over
+    await _write_in_batches(db.blobs, [
+        UpdateOne({"_id": file_path}, {"$max": {"refs": count}}, upsert=True) for file_path, count in refs.items()
+    ])
+    await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"done": True}}, upsert=True)
+    if refs:
+        logger.info("Counted references for %d blobs", len(refs))
+
+
+def _link_or_copy(source: Path, target: Path) -> None:
+    """Make ``target`` a copy of ``source``, atomically; the source stays"""
+    temp_path = target.with_name(f".{target.name}.{uuid.uuid4()}.part")
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, target)
+
+
+async def dedupe_uploads(db, uploads_dir: Path) -> None:
+    """Point legacy uuid-named documents at content-addressed blobs.
+
+    Every step can be repeated: documents are repointed first while their old
+    files stay in place, and only then are the reference counts rebuilt from
+    db.documents and the files no document uses deleted. An interrupted run
+    is finished by running it again.
+    """
+    moved = 0
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        batch = await db.documents.find(query, {"id": 1, "file_path": 1}).sort(
+            "_id", ASCENDING
+        ).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        for doc in batch:
+            old_path = Path(doc["file_path"])
+            if not old_path.exists():
+                continue
+            sha256 = await asyncio.to_thread(_file_sha256, old_path)
+            new_path = blob_path(uploads_dir, sha256, old_path.suffix)
+            if new_path == old_path:
+                continue
+            if not new_path.exists():
+                await asyncio.to_thread(_link_or_copy, old_path, new_path)
+            await db.documents.update_one({"_id": doc["_id"]}, {"$set": {
+                "file_path": str(new_path),
+                "filename": new_path.name,
+                "sha256": sha256,
+            }})
+            moved += 1
+
+    refs = await _document_refs(db)
+    await _write_in_batches(db.blobs, [
+        UpdateOne({"_id": file_path}, {"$set": {"refs": count}}, upsert=True) for file_path, count in refs.items()
+    ])
+    unused = [blob["_id"] async for blob in db.blobs.find({}, {"_id": 1}) if blob["_id"] not in refs]
+    for start in range(0, len(unused), BATCH_SIZE):
+        await db.blobs.delete_many({"_id": {"$in": unused[start:start + BATCH_SIZE]}})
+    removed = 0
+    for path in uploads_dir.iterdir():
+        # Hidden files are uploads and deletions in progress
+        if path.name.startswith('.') or not path.is_file() or str(path) in refs:
+            continue
+        path.unlink(missing_ok=True)
+        removed += 1
+
+    if moved or removed:
+        logger.info("Moved %d documents onto content-addressed blobs, deleted %d unused files", moved, removed)
+
+
+async def run_migrations(db) -> None:
+    try:
+        await migrate_dates(db)
+        await backfill_search_tokens(db)
+    except Exception:
+        logger.exception("Data migration failed; it will resume on the next start")
+
+
+async def _main(args) -> None:
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        await migrate_dates(db)
+        await backfill_search_tokens(db)
+        await backfill_blob_refs(db)
+        if args.dedupe_uploads:
+            await dedupe_uploads(db, root_dir / 'uploads')
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run data migrations")
+    parser.add_argument("--dedupe-uploads", action="store_true", help="move legacy uploads onto content-addressed blobs")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""Background computation of the overdue equipment snapshot.
+
+``OverdueMonitor`` recomputes the overdue list every
+``Settings.check_interval_hours``, or earlier when the next loan falls due or
+a write endpoint calls ``invalidate``. Once its first refresh is in, only
+the background task queries Mongo; the read endpoints get the last result
+from memory, so right after a write they may briefly see the previous list. It is also persisted to
+``db.overdue_snapshot`` for other processes and for inspection, one document
+per overdue item (``_id`` is the equipment id), so the list is not bound by
+the 16MB document limit and a refresh rewrites only the rows that changed.
+``on_change`` is called with the new detail rows whenever the set of overdue
+items changes.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from pymongo import ASCENDING, ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_HOURS = 1
+WRITE_BATCH_SIZE = 1000
+READY_WAIT_SECONDS = 5
+
+
+def overdue_details(equipment_list: List[dict], now: datetime) -> List[dict]:
+    """Rows for /overdue/detailed, with days_overdue computed once"""
+    details = []
+    for equip in equipment_list:
+        expected_return = equip['expected_return_date']
+        details.append({
+            "id": equip['id'],
+            "name": equip['name'],
+            "model": equip['model'],
+            "borrower_name": equip.get('current_borrower', 'N/A'),
+            "borrower_email": equip.get('current_borrower_email', 'N/A'),
+            "expected_return_date": expected_return.isoformat(),
+            "days_overdue": (now - expected_return).days,
+            "status": "Atrasado"
+        })
+    return details
+
+
+class OverdueMonitor:
+    def __init__(
+        self,
+        db,
+        overdue_filter: Callable[[], dict],
+        projection: dict,
+        on_change: Optional[Callable[[List[dict]], None]] = None
+    ):
+        self.db = db
+        self.overdue_filter = overdue_filter
+        self.projection = projection
+        self.on_change = on_change
+        self.equipment: List[dict] = []
+        self.details: List[dict] = []
+        self.computed_at: Optional[datetime] = None
+        self._ready = asyncio.Event()
+        self._persisted: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            await self._refresh()
+
+    async def _query(self):
+        now = datetime.now(timezone.utc)
+        equipment = await self.db.equipment.find(self.overdue_filter(), self.projection).sort(
+            "expected_return_date", ASCENDING
+        ).to_list(None)
+        return equipment, overdue_details(equipment, now), now
+
+    async def _refresh(self) -> None:
+        equipment, details, now = await self._query()
+        changed = self.computed_at is not None and (
+            {row['id'] for row in details} != {row['id'] for row in self.details}
+        )
+        # Served from memory even if persisting fails below
+        self.equipment, self.details, self.computed_at = equipment, details, now
+        self._ready.set()
+        if changed and self.on_change:
+            self.on_change(details)
+        await self._persist(equipment, details, now)
+
+    async def _persist(self, equipment: List[dict], details: List[dict], now: datetime) -> None:
+        # What the collection holds; unknown (None) until a persist completes
+        previous, self._persisted = self._persisted, None
+        writes = [
+            ReplaceOne({"_id": equip['id']}, {"computed_at": now, "equipment": equip, "details": row}, upsert=True)
+            for equip, row in zip(equipment, details)
+            if previous is None or previous.get(equip['id']) != (equip, row)
+        ]
+        for start in range(0, len(writes), WRITE_BATCH_SIZE):
+            await self.db.overdue_snapshot.bulk_write(writes[start:start + WRITE_BATCH_SIZE], ordered=False)
+        if previous is None:
+            # Whatever an earlier process or failed attempt left behind, including the old single-document form
+            await self.db.overdue_snapshot.delete_many({"computed_at": {"$ne": now}})
+        else:
+            current = {equip['id'] for equip in equipment}
+            gone = [equipment_id for equipment_id in previous if equipment_id not in current]
+            for start in range(0, len(gone), WRITE_BATCH_SIZE):
+                await self.db.overdue_snapshot.delete_many({"_id": {"$in": gone[start:start + WRITE_BATCH_SIZE]}})
+        self._persisted = {equip['id']: (equip, row) for equip, row in zip(equipment, details)}
+
+    async def snapshot(self):
+        """(equipment, details) as of the last background refresh.
+
+        Before the first refresh has finished, waits up to
+        ``READY_WAIT_SECONDS`` and then queries Mongo directly, so a failing
+        first refresh slows the overdue endpoints down instead of hanging them.
+        """
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=READY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                equipment, details, _ = await self._query()
+                return equipment, details
+        return self.equipment, self.details
+
+    def invalidate(self) -> None:
+        """Called after equipment and movement writes; the background task refreshes"""
+        self._wake.set()
+
+    async def _seconds_until_next_check(self) -> float:
+        settings = await self.db.settings.find_one({"id": "system_settings"}, {"_id": 0}) or {}
+        interval = max(settings.get('check_interval_hours', DEFAULT_INTERVAL_HOURS), 1) * 3600
+
+        # Wake up when the next outstanding loan becomes overdue, if that is sooner
+        now = datetime.now(timezone.utc)
+        next_due = await self.db.equipment.find_one(
+            {"status": "On Loan", "expected_return_date": {"$gte": now}},
+            {"_id": 0, "expected_return_date": 1},
+            sort=[("expected_return_date", ASCENDING)]
+        )
+        if next_due:
+            interval = min(interval, (next_due['expected_return_date'] - now).total_seconds() + 1)
+        return interval
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.refresh()
+                timeout = await self._seconds_until_next_check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Overdue check failed")
+                timeout = 60
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,267 @@
+"""Optional in-memory replica of ``db.equipment`` for the hot read endpoints.
+
+With ``EQUIPMENT_REPLICA=1`` the server loads every equipment document at
+startup and keeps three secondary indexes next to the ``id`` map:
+
+* ``(name, id)`` order, overall and per ``status``, for the paginated list
+* ``(expected_return_date, id)`` of items on loan, for the overdue lists
+
+The write endpoints apply their changes here right after writing to Mongo.
+With several workers the replica also follows an equipment change stream
+(``EVENTS_CHANGE_STREAMS=1``) so it sees the other workers' writes.
+``check`` compares the replica with Mongo and can reload it.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+import search as equipment_search
+from migrations import DATE_FIELDS, parse_iso_datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_IDS = 100
+EQUIPMENT_DATE_FIELDS = frozenset(DATE_FIELDS["equipment"])
+
+
+def _normalize(value, field: Optional[str] = None):
+    # A legacy ISO string the background date migration has not converted yet
+    if field in EQUIPMENT_DATE_FIELDS and isinstance(value, str):
+        try:
+            value = parse_iso_datetime(value)
+        except ValueError:
+            return value
+    # Compare equal to what Mongo hands back: UTC, millisecond precision
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+class EquipmentReplica:
+    def __init__(self, fields: Iterable[str]):
+        self.fields = list(fields)
+        self.ready = False
+        self.loaded_at: Optional[datetime] = None
+        self._docs: Dict[str, dict] = {}
+        self._tokens: Dict[str, frozenset] = {}
+        self._words: Dict[str, frozenset] = {}
+        # Mongo _id -> id, since a delete event carries only the _id
+        self._object_ids: Dict[object, str] = {}
+        self._by_name: List[tuple] = []
+        self._by_status: Dict[str, List[tuple]] = defaultdict(list)
+        self._due: List[tuple] = []
+        # Changes made while a load is in flight, replayed on top of it
+        self._pending: Optional[list] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- loading ----
+
+    async def load(self, db) -> None:
+        self._pending = []
+        try:
+            docs = await db.equipment.find({}, {f: 1 for f in self.fields}).to_list(None)
+        except BaseException:
+            self._pending = None
+            raise
+        pending, self._pending = self._pending, None
+        self._docs, self._tokens, self._words, self._object_ids = {}, {}, {}, {}
+        self._by_name, self._by_status, self._due = [], defaultdict(list), []
+        for doc in docs:
+            self._insert(doc)
+        for method, args in pending:
+            method(*args)
+        self.loaded_at = datetime.now(timezone.utc)
+        self.ready = True
+        logger.info("Equipment replica loaded with %d items", len(self._docs))
+
+    async def refresh(self, db, equipment_ids: List[str]) -> None:
+        """Re-read the given items from Mongo, e.g. after a bulk insert"""
+        docs = await db.equipment.find(
+            {"id": {"$in": equipment_ids}}, {f: 1 for f in self.fields}
+        ).to_list(len(equipment_ids))
+        found = {doc['id'] for doc in docs}
+        for doc in docs:
+            self.upsert(doc)
+        for equipment_id in equipment_ids:
+            if equipment_id not in found:
+                self.remove(equipment_id)
+
+    # ---- writes ----
+
+    def upsert(self, doc: dict) -> None:
+        if self._pending is not None:
+            self._pending.append((self.upsert, (doc,)))
+        self._discard(doc['id'])
+        self._insert(doc)
+
+    def update(self, equipment_id: str, fields: dict) -> None:
+        """Merge ``$set`` fields into an item the replica already holds"""
+        if self._pending is not None:
+            self._pending.append((self.update, (equipment_id, fields)))
+        current = self._docs.get(equipment_id)
+        if current is None:
+            return
+        self._discard(equipment_id)
+        self._insert({**current, **fields})
+
+    def remove(self, equipment_id: str) -> None:
+        if self._pending is not None:
+            self._pending.append((self.remove, (equipment_id,)))
+        self._discard(equipment_id)
+
+    def _insert(self, doc: dict) -> None:
+        if '_id' in doc:
+            self._object_ids[doc['_id']] = doc['id']
+        doc = {f: _normalize(doc.get(f), f) for f in self.fields}
+        equipment_id = doc['id']
+        self._docs[equipment_id] = doc
+        searchable = (doc.get('name'), doc.get('model'), doc.get('serial_number'))
+        self._tokens[equipment_id] = frozenset(equipment_search.build_search_tokens(*searchable))
+        self._words[equipment_id] = frozenset(equipment_search.build_search_words(*searchable))
+        key = (doc['name'], equipment_id)
+        insort(self._by_name, key)
+        insort(self._by_status[doc.get('status')], key)
+        if self._is_due(doc):
+            insort(self._due, (doc['expected_return_date'], equipment_id))
+
+    def _discard(self, equipment_id: str) -> None:
+        doc = self._docs.pop(equipment_id, None)
+        if doc is None:
+            return
+        self._tokens.pop(equipment_id, None)
+        self._words.pop(equipment_id, None)
+        key = (doc['name'], equipment_id)
+        self._remove_key(self._by_name, key)
+        self._remove_key(self._by_status[doc.get('status')], key)
+        if self._is_due(doc):
+            self._remove_key(self._due, (doc['expected_return_date'], equipment_id))
+
+    @staticmethod
+    def _is_due(doc: dict) -> bool:
+        # An unparseable date never matches the overdue query in Mongo either
+        return doc.get('status') == "On Loan" and isinstance(doc.get('expected_return_date'), datetime)
+
+    @staticmethod
+    def _remove_key(keys: List[tuple], key: tuple) -> None:
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    # ---- reads ----
+
+    def get(self, equipment_id: str) -> Optional[dict]:
+        return self._docs.get(equipment_id)
+
+    def page(self, status: Optional[str], after: Optional[tuple], limit: int) -> List[dict]:
+        """Up to ``limit`` items in (name, id) order, starting after ``after``"""
+        keys = self._by_status.get(status, []) if status else self._by_name
+        start = bisect_right(keys, tuple(after)) if after else 0
+        return [self._docs[equipment_id] for _, equipment_id in keys[start:start + limit]]
+
+    def search(self, status: Optional[str], terms: List[str], limit: int) -> List[dict]:
+        """Up to ``limit`` items whose tokens contain every term.
+
+        Selected like ``search.candidate_filters``: the whole-word tier first,
+        then the other matches, each in (name, id) order.
+        """
+        keys = self._by_status.get(status, []) if status else self._by_name
+        whole, partial = [], []
+        for _, equipment_id in keys:
+            if not self._tokens[equipment_id].issuperset(terms):
+                continue
+            if equipment_search.whole_word_match(self._words[equipment_id], terms):
+                whole.append(self._docs[equipment_id])
+                if len(whole) >= limit:
+                    break
+            elif len(partial) < limit:
+                partial.append(self._docs[equipment_id])
+        return (whole + partial)[:limit]
+
+    def overdue(self, now: datetime) -> List[dict]:
+        """Items on loan past their expected return date, most overdue first"""
+        end = bisect_left(self._due, (now,))
+        return [self._docs[equipment_id] for _, equipment_id in self._due[:end]]
+
+    def status_counts(self) -> Dict[str, int]:
+        return {status: len(keys) for status, keys in self._by_status.items() if keys}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # ---- consistency ----
+
+    async def check(self, db, repair: bool = False) -> dict:
+        """Compare every item with Mongo; with ``repair`` reload when they differ"""
+        mongo = {
+            doc['id']: {f: _normalize(doc.get(f), f) for f in self.fields}
+            async for doc in db.equipment.find({}, {"_id": 0, **{f: 1 for f in self.fields}})
+        }
+        missing = [i for i in mongo if i not in self._docs]
+        extra = [i for i in self._docs if i not in mongo]
+        different = [i for i, doc in mongo.items() if i in self._docs and self._docs[i] != doc]
+        consistent = not (missing or extra or different)
+        report = {
+            "consistent": consistent,
+            "checked_at": datetime.now(timezone.utc),
+            "mongo_count": len(mongo),
+            "replica_count": len(self._docs),
+            "missing": missing[:MAX_REPORTED_IDS],
+            "extra": extra[:MAX_REPORTED_IDS],
+            "different": different[:MAX_REPORTED_IDS],
+            "repaired": False,
+        }
+        if not consistent:
+            logger.warning(
+                "Equipment replica drift: %d missing, %d extra, %d different",
+                len(missing), len(extra), len(different)
+            )
+            if repair:
+                await self.load(db)
+                report["repaired"] = True
+        return report
+
+    # ---- change stream ----
+
+    async def follow(self, db) -> None:
+        """Apply equipment changes made by other workers"""
+        resume_token = None
+        while True:
+            try:
+                async with db.equipment.watch(
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}],
+                    full_document="updateLookup",
+                    resume_after=resume_token
+                ) as stream:
+                    if resume_token is None:
+                        # Anything written before the stream opened is picked up by a reload
+                        await self.load(db)
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get("fullDocument")
+                        if document:
+                            self.upsert(document)
+                        elif change["operationType"] == "delete":
+                            equipment_id = self._object_ids.pop(change["documentKey"]["_id"], None)
+                            if equipment_id:
+                                self.remove(equipment_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Equipment replica change stream interrupted; resuming in 5s")
+                await asyncio.sleep(5)
+
+    def start_following(self, db) -> None:
+        self._task = asyncio.create_task(self.follow(db))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
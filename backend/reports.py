@@ -0,0 +1,157 @@
+"""Server-side reporting over the movement log with pandas.
+
+Movements and equipment are pulled from Motor in batches and assembled
+column by column into DataFrames, so the report math runs vectorized
+instead of row by row in Python (or in the browser over one page of data).
+A loan is a check-out paired with the next check-in of the same item; the
+status guards on the movement endpoints keep the two strictly alternating.
+
+The functions here are synchronous over frames; the server runs them in a
+worker thread and caches the results per parameter set. Only movements
+still in Mongo are read: the server refuses a ``start_date`` that reaches
+into the archive (see archive.py).
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+LOAD_BATCH_SIZE = 5000
+MOVEMENT_COLUMNS = [
+    "equipment_id", "movement_type", "borrower_name", "borrower_email",
+    "expected_return_date", "timestamp",
+]
+EQUIPMENT_COLUMNS = ["id", "name", "model"]
+DURATION_BINS_DAYS = [0, 1, 3, 7, 14, 30, 60, 90, np.inf]
+# pandas names weekly periods by their last day: W-SUN runs Monday to Sunday
+PERIODS = {"day": "D", "week": "W-SUN"}
+
+
+async def load_frame(cursor, columns: List[str], batch_size: int = LOAD_BATCH_SIZE) -> pd.DataFrame:
+    """Drain a Motor cursor into a DataFrame, one batch of rows at a time"""
+    data: Dict[str, list] = {column: [] for column in columns}
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            break
+        for column, values in data.items():
+            values.extend(doc.get(column) for doc in batch)
+    frame = pd.DataFrame(data, columns=columns)
+    for column in columns:
+        if column == "timestamp" or column.endswith("_date"):
+            frame[column] = pd.to_datetime(frame[column], utc=True)
+    return frame
+
+
+def loans(movements: pd.DataFrame) -> pd.DataFrame:
+    """One row per completed loan: check-out joined to its check-in"""
+    ordered = movements.sort_values(["equipment_id", "timestamp"], kind="stable")
+    previous = ordered.groupby("equipment_id", sort=False).shift(1)
+    returned = (ordered["movement_type"] == "check_in") & (previous["movement_type"] == "check_out")
+    checkouts = previous[returned]
+    frame = pd.DataFrame({
+        "equipment_id": ordered.loc[returned, "equipment_id"],
+        "borrower_name": checkouts["borrower_name"],
+        "borrower_email": checkouts["borrower_email"],
+        "checked_out_at": checkouts["timestamp"],
+        "expected_return_date": checkouts["expected_return_date"],
+        "returned_at": ordered.loc[returned, "timestamp"],
+    })
+    frame["days"] = (frame["returned_at"] - frame["checked_out_at"]).dt.total_seconds() / 86400
+    frame["on_time"] = frame["expected_return_date"].isna() | (frame["returned_at"] <= frame["expected_return_date"])
+    return frame.reset_index(drop=True)
+
+
+def _round(value, digits: int = 2) -> Optional[float]:
+    return None if pd.isna(value) else round(float(value), digits)
+
+
+def loan_durations(completed: pd.DataFrame, equipment: pd.DataFrame) -> dict:
+    """Histogram, percentiles and per-model medians of loan length in days"""
+    days = completed["days"].to_numpy()
+    counts, _ = np.histogram(days, bins=DURATION_BINS_DAYS)
+    labels = [
+        f"{int(low)}+" if np.isinf(high) else f"{int(low)}-{int(high)}"
+        for low, high in zip(DURATION_BINS_DAYS[:-1], DURATION_BINS_DAYS[1:])
+    ]
+    percentiles = np.percentile(days, [50, 90, 95]) if days.size else [np.nan] * 3
+
+    by_model = completed.merge(equipment, left_on="equipment_id", right_on="id", how="left")
+    by_model = by_model.groupby(by_model["model"].fillna("N/A"))["days"].agg(["count", "median"])
+    by_model = by_model.sort_values("count", ascending=False)
+    return {
+        "loans": int(days.size),
+        "mean_days": _round(days.mean()) if days.size else None,
+        "p50_days": _round(percentiles[0]),
+        "p90_days": _round(percentiles[1]),
+        "p95_days": _round(percentiles[2]),
+        "histogram": [{"bucket_days": label, "loans": int(n)} for label, n in zip(labels, counts)],
+        "by_model": [
+            {"model": model, "loans": int(row["count"]), "median_days": _round(row["median"])}
+            for model, row in by_model.iterrows()
+        ],
+    }
+
+
+def checkouts_per_period(movements: pd.DataFrame, period: str) -> List[dict]:
+    """Check-out and check-in counts per day or per week (weeks start on Monday)"""
+    if movements.empty:
+        return []
+    counts = pd.crosstab(
+        movements["timestamp"].dt.tz_convert(None).dt.to_period(PERIODS[period]).dt.start_time,
+        movements["movement_type"]
+    ).reindex(columns=["check_out", "check_in"], fill_value=0)
+    # Keep empty periods in the series so charts have an even axis
+    full_range = pd.period_range(counts.index.min(), counts.index.max(), freq=PERIODS[period]).start_time
+    counts = counts.reindex(full_range, fill_value=0)
+    return [
+        {"period": start.date().isoformat(), "check_outs": int(row["check_out"]), "check_ins": int(row["check_in"])}
+        for start, row in counts.iterrows()
+    ]
+
+
+def on_time_returns(completed: pd.DataFrame, period: str) -> dict:
+    """Share of completed loans returned by their expected date, overall and per period"""
+    if completed.empty:
+        return {"loans": 0, "on_time": 0, "rate": None, "periods": []}
+    returned_in = completed["returned_at"].dt.tz_convert(None).dt.to_period(PERIODS[period]).dt.start_time
+    grouped = completed.groupby(returned_in)["on_time"].agg(["count", "sum", "mean"])
+    return {
+        "loans": int(len(completed)),
+        "on_time": int(completed["on_time"].sum()),
+        "rate": _round(completed["on_time"].mean(), 4),
+        "periods": [
+            {"period": start.date().isoformat(), "loans": int(row["count"]),
+             "on_time": int(row["sum"]), "rate": _round(row["mean"], 4)}
+            for start, row in grouped.iterrows()
+        ],
+    }
+
+
+def _normalized_email(frame: pd.DataFrame) -> pd.Series:
+    return frame["borrower_email"].str.strip().str.lower().rename("borrower_email")
+
+
+def borrower_ranking(movements: pd.DataFrame, completed: pd.DataFrame, limit: int) -> List[dict]:
+    """Borrowers by number of check-outs, with loan time and late returns.
+
+    ``movements`` must be in timestamp order so the latest name spelling wins.
+    """
+    checkouts = movements[movements["movement_type"] == "check_out"]
+    if checkouts.empty:
+        return []
+    # Keyed like db.borrowers (borrowers.normalize_email), so spellings of one address count together
+    ranking = checkouts.groupby(_normalized_email(checkouts)).agg(
+        borrower_name=("borrower_name", "last"), loans=("equipment_id", "size")
+    )
+    late = completed.assign(late=~completed["on_time"])
+    per_loan = late.groupby(_normalized_email(late)).agg(
+        total_days=("days", "sum"), late_returns=("late", "sum")
+    )
+    ranking = ranking.join(per_loan, how="left").fillna({"total_days": 0.0, "late_returns": 0})
+    ranking = ranking.sort_values(["loans", "total_days"], ascending=False).head(limit)
+    return [
+        {"borrower_email": email, "borrower_name": row["borrower_name"], "loans": int(row["loans"]),
+         "total_days": _round(row["total_days"]), "late_returns": int(row["late_returns"])}
+        for email, row in ranking.iterrows()
+    ]
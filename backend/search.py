@@ -0,0 +1,135 @@
+"""Tokenized n-gram search over equipment name, model and serial number.
+
+Each equipment document carries two multikey-indexed arrays:
+
+* ``search_tokens`` - every substring (up to ``MAX_GRAM`` characters) of
+  every word in ``name`` and ``model`` and of the compacted
+  ``serial_number``, so "book" finds "MacBook" and partial serials match
+* ``search_words`` - the whole words, for the best-scoring matches
+
+A search is an ``$all`` over the normalized query terms. Candidates are
+selected best tier first (``candidate_filters``): items where every term is
+a whole word, then any other match, each tier in name order, up to
+``MAX_CANDIDATES``; the candidates are ranked in Python. User input never
+reaches the database as a regex.
+"""
+import re
+import unicodedata
+from typing import List, Optional
+
+# Bump when the tokenization changes so migrations.py re-indexes every item
+SEARCH_TOKENS_VERSION = 2
+
+MAX_GRAM = 16
+MAX_SERIAL_LENGTH = 32
+MAX_QUERY_TERMS = 8
+MAX_CANDIDATES = 2000
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase and strip accents, so 'Câmera' and 'camera' tokenize alike"""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def words(text: Optional[str]) -> List[str]:
+    return _WORD_RE.findall(normalize(text))
+
+
+def _edge_grams(word: str) -> List[str]:
+    return [word[:size] for size in range(1, min(len(word), MAX_GRAM) + 1)]
+
+
+def _substrings(word: str) -> List[str]:
+    return [gram for start in range(len(word)) for gram in _edge_grams(word[start:])]
+
+
+def _compact_serial(serial_number: Optional[str]) -> str:
+    return ''.join(words(serial_number))[:MAX_SERIAL_LENGTH]
+
+
+def build_search_tokens(name: str, model: str, serial_number: Optional[str]) -> List[str]:
+    tokens = set()
+    for word in words(name) + words(model):
+        tokens.update(_substrings(word))
+    tokens.update(_substrings(_compact_serial(serial_number)))
+    return sorted(tokens)
+
+
+def build_search_words(name: str, model: str, serial_number: Optional[str]) -> List[str]:
+    # Truncated like the query terms, so a long word still matches itself
+    found = words(name) + words(model) + words(serial_number) + [_compact_serial(serial_number)]
+    return sorted({word[:MAX_GRAM] for word in found if word})
+
+
+def search_fields(doc: dict) -> dict:
+    """Fields to $set on an equipment document after name/model/serial change"""
+    name, model, serial_number = doc.get('name'), doc.get('model'), doc.get('serial_number')
+    return {
+        'search_tokens': build_search_tokens(name, model, serial_number),
+        'search_words': build_search_words(name, model, serial_number),
+        'search_version': SEARCH_TOKENS_VERSION,
+    }
+
+
+def query_terms(search: str) -> List[str]:
+    return [word[:MAX_GRAM] for word in words(search)][:MAX_QUERY_TERMS]
+
+
+def search_filter(terms: List[str]) -> dict:
+    return {'search_tokens': {'$all': terms}}
+
+
+def _serial_query(terms: List[str]) -> str:
+    """The query as a compacted serial number, as ``build_search_words`` stores it"""
+    return ''.join(terms)[:MAX_GRAM]
+
+
+def candidate_filters(terms: List[str]) -> List[dict]:
+    """Filters for the matches of ``terms``, best scoring first.
+
+    In ``_score`` every whole-word term (of the name, model or serial
+    number) scores at least 3 and any other term 1 or 2, so the first tier
+    holds the top results. It also takes a serial number typed in pieces
+    ("SN 0042"), which earns the exact-serial bonus. The second tier repeats
+    the first and the caller excludes what it already has.
+    """
+    whole_words = {'search_words': {'$all': terms}}
+    if len(terms) > 1:
+        whole_words = {'$or': [whole_words, {'search_words': _serial_query(terms)}]}
+    return [{**search_filter(terms), **whole_words}, search_filter(terms)]
+
+
+def whole_word_match(item_words, terms: List[str]) -> bool:
+    """Whether an item matching ``terms`` is in the first ``candidate_filters`` tier"""
+    return item_words.issuperset(terms) or (len(terms) > 1 and _serial_query(terms) in item_words)
+
+
+def _score(doc: dict, terms: List[str]) -> int:
+    # Truncated like search_words and the query terms, so long words keep their credit
+    name_words = {word[:MAX_GRAM] for word in words(doc.get('name'))}
+    model_words = {word[:MAX_GRAM] for word in words(doc.get('model'))}
+    serial_words = {word[:MAX_GRAM] for word in words(doc.get('serial_number'))}
+    serial = _compact_serial(doc.get('serial_number'))
+    score = 0
+    if serial and serial == ''.join(terms):
+        score += 10
+    for term in terms:
+        if term in name_words:
+            score += 4
+        elif term in model_words or term in serial_words or term == serial[:MAX_GRAM]:
+            score += 3
+        elif any(word.startswith(term) for word in name_words):
+            score += 2
+        else:
+            score += 1
+    return score
+
+
+def rank(docs: List[dict], terms: List[str]) -> List[dict]:
+    """Best match first; ties keep the (name, id) order of the query"""
+    return sorted(docs, key=lambda doc: -_score(doc, terms))
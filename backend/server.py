@@ -1,24 +1,53 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 from typing import List, Optional
 import uuid
+import io
+import csv
+import json
+import base64
+import orjson
 from datetime import datetime, timezone, timedelta
-import aiofiles
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import ReadCache
+from indexes import ensure_indexes
+from migrations import backfill_blob_refs, parse_iso_datetime, run_migrations
+from events import EventBus, sse_stream, watch_change_streams
+from overdue import OverdueMonitor, overdue_details
+import search as equipment_search
+import loan_stats
+import reports
+import borrowers as borrower_index
+import changes as change_log
+from archive import archive_from_environment, archive_periodically, equipment_months
+from replica import EquipmentReplica
+import metrics
+from storage import (
+    UPLOAD_TOO_LARGE_DETAIL, UploadSizeLimit, UploadTooLarge,
+    blob_path, commit_upload, discard_upload, document_response, receive_upload, release_blob, retain_blob
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Per-command timings for /metrics; SLOW_QUERY_MS also logs slow commands
+slow_query_ms = os.environ.get('SLOW_QUERY_MS')
+mongo_metrics = metrics.MongoCommandMetrics(slow_ms=float(slow_query_ms) if slow_query_ms else None)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
 # Create uploads directory
@@ -31,6 +60,38 @@ app = FastAPI(title="Equipment Loan Management API")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Dashboard counters; overdue state also changes with time, hence the TTL
+stats_cache = ReadCache(
+    ttl_seconds=float(os.environ.get('STATS_CACHE_TTL_SECONDS', '60')),
+    stale_seconds=float(os.environ.get('STATS_CACHE_STALE_SECONDS', '0'))
+)
+
+# Settings change rarely but are polled by every open page; by default this only
+# coalesces concurrent reads, so other workers' updates are seen immediately
+settings_cache = ReadCache(ttl_seconds=float(os.environ.get('SETTINGS_CACHE_TTL_SECONDS', '0')))
+
+# pandas reports over the movement log, keyed by report and parameters
+reports_cache = ReadCache(ttl_seconds=float(os.environ.get('REPORTS_CACHE_TTL_SECONDS', '300')))
+
+# Movements older than MOVEMENT_RETENTION_DAYS live in monthly archive files
+movement_archive = archive_from_environment(ROOT_DIR)
+MOVEMENT_RETENTION_DAYS = os.environ.get('MOVEMENT_RETENTION_DAYS')
+
+# Pushed to browsers over /api/events
+event_bus = EventBus()
+USE_CHANGE_STREAMS = os.environ.get('EVENTS_CHANGE_STREAMS') == '1'
+
+def publish_event(event_type: str, data: dict):
+    """Collection events come from the change stream instead when it is enabled"""
+    if not USE_CHANGE_STREAMS:
+        event_bus.publish(event_type, data)
+
+def invalidate_read_caches():
+    """Called by every endpoint that writes equipment or movements"""
+    stats_cache.invalidate()
+    reports_cache.invalidate()
+    overdue_monitor.invalidate()
+
 # ============= Models =============
 
 class Equipment(BaseModel):
@@ -82,6 +143,9 @@ class MovementCreate(BaseModel):
     expected_return_date: Optional[datetime] = None
     notes: Optional[str] = None
 
+class MovementBatch(BaseModel):
+    movements: List[MovementCreate]
+
 class Document(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -91,6 +155,7 @@ class Document(BaseModel):
     original_filename: str
     file_path: str
     file_size: int
+    sha256: Optional[str] = None
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Settings(BaseModel):
@@ -102,6 +167,107 @@ class Settings(BaseModel):
 class SettingsUpdate(BaseModel):
     check_interval_hours: int
 
+# ============= Pagination =============
+
+MAX_PAGE_SIZE = 1000
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(',', ':'), default=_cursor_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Only what encode_cursor writes: ids, names and ISO timestamps, or a sequence number
+    if (
+        not isinstance(values, list) or len(values) != size
+        or not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in values)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(fields, values, direction) -> dict:
+    """Match the rows that sort strictly after (values) on a two-field key"""
+    op = '$gt' if direction == ASCENDING else '$lt'
+    (primary, tiebreak), (primary_value, tiebreak_value) = fields, values
+    return {'$or': [
+        {primary: {op: primary_value}},
+        {primary: primary_value, tiebreak: {op: tiebreak_value}}
+    ]}
+
+# ============= Query Filters =============
+
+# Read exactly the model's fields (search_tokens etc. never leave the server), so
+# list endpoints can return rows as-is instead of re-validating them
+EQUIPMENT_PROJECTION = {"_id": 0, **{field: 1 for field in Equipment.model_fields}}
+MOVEMENT_PROJECTION = {"_id": 0, **{field: 1 for field in Movement.model_fields}}
+# What the detail page lists per document; paths and hashes stay on the server
+DOCUMENT_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "movement_id": 1, "original_filename": 1, "file_size": 1, "uploaded_at": 1}
+
+# Optional in-memory copy of db.equipment that the hot read endpoints answer from
+USE_EQUIPMENT_REPLICA = os.environ.get('EQUIPMENT_REPLICA') == '1'
+equipment_replica = EquipmentReplica(Equipment.model_fields)
+
+def replica_ready() -> bool:
+    return USE_EQUIPMENT_REPLICA and equipment_replica.ready
+
+def equipment_filter(status: Optional[str], search: Optional[str]) -> dict:
+    query = {}
+    if status and status != "All":
+        query['status'] = status
+    terms = equipment_search.query_terms(search) if search else []
+    if terms:
+        query.update(equipment_search.search_filter(terms))
+    return query
+
+def parse_date_param(value: str, name: str, end_of_day: bool = False) -> datetime:
+    """Parse a date/datetime query parameter; a bare end date covers the whole day"""
+    try:
+        parsed = parse_iso_datetime(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1) - timedelta(microseconds=1)
+    return parsed
+
+def movements_filter(
+    equipment_id: Optional[str],
+    movement_type: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> dict:
+    query = {}
+    if equipment_id:
+        query['equipment_id'] = equipment_id
+    if movement_type:
+        query['movement_type'] = movement_type
+    if start_date or end_date:
+        query['timestamp'] = {}
+        if start_date:
+            query['timestamp']['$gte'] = parse_date_param(start_date, 'start_date')
+        if end_date:
+            query['timestamp']['$lte'] = parse_date_param(end_date, 'end_date', end_of_day=True)
+    return query
+
+def overdue_filter() -> dict:
+    return {
+        "status": "On Loan",
+        "expected_return_date": {"$lt": datetime.now(timezone.utc)}
+    }
+
+# Recomputed in the background; the overdue endpoints read its snapshot
+overdue_monitor = OverdueMonitor(
+    db, overdue_filter, EQUIPMENT_PROJECTION,
+    on_change=lambda details: event_bus.publish("overdue.changed", {"items": details})
+)
+
 # ============= Equipment Endpoints =============
 
 @api_router.post("/equipment", response_model=Equipment)
@@ -110,52 +276,262 @@ async def create_equipment(equipment: EquipmentCreate):
     equipment_obj = Equipment(**equipment_dict)
     
     doc = equipment_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    if doc.get('delivery_date'):
-        doc['delivery_date'] = doc['delivery_date'].isoformat()
-    if doc.get('expected_return_date'):
-        doc['expected_return_date'] = doc['expected_return_date'].isoformat()
-    
+    doc.update(equipment_search.search_fields(doc))
     await db.equipment.insert_one(doc)
+    if USE_EQUIPMENT_REPLICA:
+        equipment_replica.upsert(doc)
+    await change_log.record(db, [("equipment", equipment_obj.id, "created")])
+    invalidate_read_caches()
+    publish_event("equipment.created", equipment_obj.model_dump())
     return equipment_obj
 
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+def _import_rows(upload: UploadFile, fmt: str):
+    """Yield (row_number, row dict or None, error) from a CSV or NDJSON upload"""
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        # row 1 is the header; blank cells are left out so the model defaults apply
+        for row_number, row in enumerate(csv.DictReader(text), start=2):
+            yield row_number, {k: v for k, v in row.items() if k and v}, None
+        return
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        yield row_number, row, None
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+def _build_import_batch(rows, size: int):
+    """Read, validate and tokenize up to ``size`` rows (blocking; call from a thread).
+
+    Returns ``(batch, errors, exhausted)``: ``(row_number, doc)`` pairs ready
+    to insert and ``(row_number, message)`` pairs for the rejected rows.
+    """
+    batch, errors = [], []
+    for count, (row_number, row, error) in enumerate(rows, start=1):
+        if error is None:
+            try:
+                equipment = EquipmentCreate.model_validate(row)
+            except ValidationError as e:
+                error = _validation_message(e)
+        if error:
+            errors.append((row_number, error))
+        else:
+            doc = Equipment(**equipment.model_dump()).model_dump()
+            doc.update(equipment_search.search_fields(doc))
+            batch.append((row_number, doc))
+        if count >= size:
+            return batch, errors, False
+    return batch, errors, True
+
+@api_router.post("/equipment/bulk")
+async def bulk_import_equipment(
+    file: UploadFile = File(...),
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$")
+):
+    """Import equipment from CSV (with a header row) or NDJSON in batched unordered inserts"""
+    if fmt is None:
+        fmt = 'ndjson' if Path(file.filename or '').suffix.lower() in ('.ndjson', '.jsonl') else 'csv'
+    
+    inserted = 0
+    failed = 0
+    errors = []
+    
+    def record_error(row_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": row_number, "error": message})
+    
+    async def flush(batch):
+        nonlocal inserted
+        if not batch:
+            return
+        failed_rows = set()
+        try:
+            result = await db.equipment.insert_many([doc for _, doc in batch], ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details['nInserted']
+            for write_error in e.details['writeErrors']:
+                failed_rows.add(write_error['index'])
+                record_error(batch[write_error['index']][0], write_error['errmsg'])
+        await change_log.record(db, [
+            ("equipment", doc['id'], "created") for i, (_, doc) in enumerate(batch) if i not in failed_rows
+        ])
+        if USE_EQUIPMENT_REPLICA:
+            await equipment_replica.refresh(db, [doc['id'] for _, doc in batch])
+    
+    rows = _import_rows(file, fmt)
+    exhausted = False
+    while not exhausted:
+        # Parsing, validation and tokenizing are CPU-bound: keep them off the event loop
+        batch, row_errors, exhausted = await asyncio.to_thread(_build_import_batch, rows, IMPORT_BATCH_SIZE)
+        for row_number, message in row_errors:
+            record_error(row_number, message)
+        await flush(batch)
+    
+    if inserted:
+        invalidate_read_caches()
+        publish_event("equipment.imported", {"count": inserted})
+    
+    return {
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors)
+    }
+
+def equipment_page_from_replica(status: Optional[str], terms: List[str], limit: int, cursor: Optional[str]):
+    """get_all_equipment answered from the in-memory replica, same ordering and cursors"""
+    if status == "All":
+        # As in equipment_filter: "All" is no status filter, not a status
+        status = None
+    if terms:
+        candidates = equipment_replica.search(status, terms, equipment_search.MAX_CANDIDATES)
+        return ORJSONResponse(equipment_search.rank(candidates, terms)[:limit])
+    after = decode_cursor(cursor, 2) if cursor else None
+    equipment_list = equipment_replica.page(status, after, limit + 1)
+    headers = {}
+    if len(equipment_list) > limit:
+        equipment_list = equipment_list[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(equipment_list[-1]['name'], equipment_list[-1]['id'])
+    return ORJSONResponse(equipment_list, headers=headers)
+
+async def equipment_by_ids(ids: str):
+    """The listed items (comma-separated ids) in the order given; unknown ids are skipped"""
+    equipment_ids = list(dict.fromkeys(i.strip() for i in ids.split(',') if i.strip()))
+    if len(equipment_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids per request")
+    if replica_ready():
+        found = {i: equipment_replica.get(i) for i in equipment_ids}
+    else:
+        docs = await db.equipment.find({"id": {"$in": equipment_ids}}, EQUIPMENT_PROJECTION).to_list(len(equipment_ids))
+        found = {doc['id']: doc for doc in docs}
+    return ORJSONResponse([found[i] for i in equipment_ids if found.get(i)])
+
+async def equipment_search_candidates(query: dict, terms: List[str]) -> List[dict]:
+    """Up to MAX_CANDIDATES matches of ``terms`` within ``query``, best scoring tier first"""
+    candidates = []
+    for tier in equipment_search.candidate_filters(terms):
+        room = equipment_search.MAX_CANDIDATES - len(candidates)
+        if room <= 0:
+            break
+        tier_query = {**query, **tier}
+        if candidates:
+            tier_query['id'] = {'$nin': [doc['id'] for doc in candidates]}
+        candidates += await db.equipment.find(tier_query, EQUIPMENT_PROJECTION).sort(
+            [("name", ASCENDING), ("id", ASCENDING)]
+        ).limit(room).to_list(room)
+    return candidates
+
 @api_router.get("/equipment", response_model=List[Equipment])
 async def get_all_equipment(
     status: Optional[str] = Query(None),
-    search: Optional[str] = Query(None)
+    search: Optional[str] = Query(None),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    ids: Optional[str] = Query(None)
 ):
-    query = {}
-    if status and status != "All":
-        query['status'] = status
-    if search:
-        query['$or'] = [
-            {'name': {'$regex': search, '$options': 'i'}},
-            {'model': {'$regex': search, '$options': 'i'}},
-            {'serial_number': {'$regex': search, '$options': 'i'}}
-        ]
+    if ids is not None:
+        return await equipment_by_ids(ids)
     
-    equipment_list = await db.equipment.find(query, {"_id": 0}).to_list(1000)
+    terms = equipment_search.query_terms(search) if search else []
+    if terms and cursor:
+        raise HTTPException(status_code=400, detail="Search results are ranked and not paginated; cursor cannot be combined with search")
+    if replica_ready():
+        return equipment_page_from_replica(status, terms, limit, cursor)
     
-    for equip in equipment_list:
-        for date_field in ['created_at', 'updated_at', 'delivery_date', 'expected_return_date']:
-            if equip.get(date_field) and isinstance(equip[date_field], str):
-                equip[date_field] = datetime.fromisoformat(equip[date_field])
+    if terms:
+        # Ranked by relevance, so the best `limit` matches are returned unpaginated
+        candidates = await equipment_search_candidates(equipment_filter(status, None), terms)
+        return ORJSONResponse(equipment_search.rank(candidates, terms)[:limit])
     
-    return equipment_list
+    query = equipment_filter(status, search)
+    if cursor:
+        query = {'$and': [query, keyset_filter(('name', 'id'), decode_cursor(cursor, 2), ASCENDING)]}
+    
+    equipment_list = await db.equipment.find(query, EQUIPMENT_PROJECTION).sort(
+        [("name", ASCENDING), ("id", ASCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    headers = {}
+    if len(equipment_list) > limit:
+        equipment_list = equipment_list[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(equipment_list[-1]['name'], equipment_list[-1]['id'])
+    
+    # Rows already have the Equipment shape; skip response_model validation
+    return ORJSONResponse(equipment_list, headers=headers)
+
+# Declared before /equipment/{equipment_id}, which would otherwise match it
+@api_router.get("/equipment/changes")
+async def get_equipment_changes(
+    since: Optional[str] = Query(None),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """The change feed restricted to equipment"""
+    return await change_feed(since, ["equipment"], limit)
 
 @api_router.get("/equipment/{equipment_id}", response_model=Equipment)
 async def get_equipment(equipment_id: str):
-    equipment = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
+    if replica_ready():
+        equipment = equipment_replica.get(equipment_id)
+    else:
+        equipment = await db.equipment.find_one({"id": equipment_id}, EQUIPMENT_PROJECTION)
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
-    for date_field in ['created_at', 'updated_at', 'delivery_date', 'expected_return_date']:
-        if equipment.get(date_field) and isinstance(equipment[date_field], str):
-            equipment[date_field] = datetime.fromisoformat(equipment[date_field])
-    
     return equipment
 
+@api_router.get("/equipment/{equipment_id}/stats")
+async def get_equipment_stats(equipment_id: str):
+    stats = await db.equipment_stats.find_one({"equipment_id": equipment_id}, {"_id": 0})
+    if not stats and not await db.equipment.find_one({"id": equipment_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Equipment not found")
+    return loan_stats.present(stats, equipment_id, datetime.now(timezone.utc))
+
+EQUIPMENT_DETAIL_MOVEMENTS = 20
+
+@api_router.get("/equipment/{equipment_id}/full")
+async def get_equipment_full(
+    equipment_id: str,
+    movements_limit: int = Query(EQUIPMENT_DETAIL_MOVEMENTS, ge=1, le=MAX_PAGE_SIZE),
+    history: bool = Query(False)
+):
+    """Everything the detail page shows, read concurrently in one request"""
+    async def read_equipment():
+        if replica_ready():
+            return equipment_replica.get(equipment_id)
+        return await db.equipment.find_one({"id": equipment_id}, EQUIPMENT_PROJECTION)
+    
+    equipment, (movements, next_cursor), documents, stats = await asyncio.gather(
+        read_equipment(),
+        movements_page(equipment_id, None, None, None, movements_limit, None, history),
+        db.documents.find({"equipment_id": equipment_id}, DOCUMENT_SUMMARY_PROJECTION).limit(1000).to_list(1000),
+        db.equipment_stats.find_one({"equipment_id": equipment_id}, {"_id": 0})
+    )
+    if not equipment:
+        raise HTTPException(status_code=404, detail="Equipment not found")
+    
+    return ORJSONResponse({
+        "equipment": equipment,
+        "movements": movements,
+        "movements_next_cursor": next_cursor,
+        "documents": documents,
+        "stats": loan_stats.present(stats, equipment_id, datetime.now(timezone.utc)),
+    })
+
 @api_router.put("/equipment/{equipment_id}", response_model=Equipment)
 async def update_equipment(equipment_id: str, equipment_update: EquipmentUpdate):
     existing = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
@@ -163,15 +539,18 @@ async def update_equipment(equipment_id: str, equipment_update: EquipmentUpdate)
         raise HTTPException(status_code=404, detail="Equipment not found")
     
     update_data = {k: v for k, v in equipment_update.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
+    if update_data.keys() & {'name', 'model', 'serial_number'}:
+        update_data.update(equipment_search.search_fields({**existing, **update_data}))
     
     await db.equipment.update_one({"id": equipment_id}, {"$set": update_data})
+    invalidate_read_caches()
     
-    updated = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
-    for date_field in ['created_at', 'updated_at', 'delivery_date', 'expected_return_date']:
-        if updated.get(date_field) and isinstance(updated[date_field], str):
-            updated[date_field] = datetime.fromisoformat(updated[date_field])
-    
+    updated = await db.equipment.find_one({"id": equipment_id}, EQUIPMENT_PROJECTION)
+    if USE_EQUIPMENT_REPLICA:
+        equipment_replica.upsert(updated)
+    await change_log.record(db, [("equipment", equipment_id, "updated")])
+    publish_event("equipment.updated", updated)
     return updated
 
 @api_router.delete("/equipment/{equipment_id}")
@@ -179,142 +558,421 @@ async def delete_equipment(equipment_id: str):
     result = await db.equipment.delete_one({"id": equipment_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Equipment not found")
+    if USE_EQUIPMENT_REPLICA:
+        equipment_replica.remove(equipment_id)
+    await db.equipment_stats.delete_one({"equipment_id": equipment_id})
+    await borrower_index.apply_updates(db, [borrower_index.equipment_deleted_update(equipment_id)])
+    await change_log.record(db, [("equipment", equipment_id, "deleted")])
+    invalidate_read_caches()
+    publish_event("equipment.deleted", {"id": equipment_id})
     return {"message": "Equipment deleted successfully"}
 
 # ============= Movement Endpoints =============
 
+# movement_type -> (required equipment status, resulting status)
+STATUS_TRANSITIONS = {
+    "check_out": ("Available", "On Loan"),
+    "check_in": ("On Loan", "Available"),
+}
+
+LOAN_FIELDS = [
+    "status", "current_borrower", "current_borrower_email",
+    "delivery_date", "expected_return_date", "updated_at"
+]
+
+def equipment_loan_fields(movement: MovementCreate, now: datetime) -> dict:
+    """Equipment fields to $set when a check-out or check-in is recorded"""
+    if movement.movement_type == "check_out":
+        return {
+            "status": "On Loan",
+            "current_borrower": movement.borrower_name,
+            "current_borrower_email": movement.borrower_email,
+            "delivery_date": movement.delivery_date,
+            "expected_return_date": movement.expected_return_date,
+            "updated_at": now
+        }
+    return {
+        "status": "Available",
+        "current_borrower": None,
+        "current_borrower_email": None,
+        "delivery_date": None,
+        "expected_return_date": None,
+        "updated_at": now
+    }
+
+class BatchConflict(Exception):
+    pass
+
+_supports_transactions: Optional[bool] = None
+
+async def supports_transactions() -> bool:
+    """Transactions need a replica set or sharded cluster, not a standalone mongod"""
+    global _supports_transactions
+    if _supports_transactions is None:
+        hello = await client.admin.command("hello")
+        _supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _supports_transactions
+
+def range_reaches_archive(start_date: Optional[str], end_date: Optional[str]) -> bool:
+    """Whether a date filter overlaps archived movements.
+
+    A range with no ``start_date`` is open towards the past, so any filter
+    without one reaches the archive; no filter at all is the default view of
+    the hot rows.
+    """
+    newest = movement_archive.newest()
+    if newest is None or not (start_date or end_date):
+        return False
+    return not start_date or parse_date_param(start_date, 'start_date') <= newest
+
+def reaches_archive(history: bool, start_date: Optional[str], end_date: Optional[str]) -> bool:
+    """Whether a movement read continues into the archive once the hot rows run out.
+
+    On request (``history``) or when the date filter overlaps the archive;
+    decoding segments is not worth it otherwise.
+    """
+    if movement_archive.newest() is None:
+        return False
+    return history or range_reaches_archive(start_date, end_date)
+
+async def archived_months(equipment_id: Optional[str]) -> Optional[List[str]]:
+    """The archive months worth opening for ``equipment_id`` (None: all of them)"""
+    if not equipment_id:
+        return None
+    return await equipment_months(db, movement_archive, equipment_id)
+
+def archived_movements_matcher(
+    equipment_id: Optional[str],
+    movement_type: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    before: Optional[tuple] = None
+):
+    """(predicate, start, end) selecting archived rows the way movements_filter selects hot ones.
+
+    ``before`` is the (timestamp, id) of the last row already returned; it
+    also drops rows an interrupted archive run left in both places.
+    """
+    start = parse_date_param(start_date, 'start_date') if start_date else None
+    end = parse_date_param(end_date, 'end_date', end_of_day=True) if end_date else None
+    if before and (end is None or before[0] < end):
+        end = before[0]
+    
+    def matches(doc: dict) -> bool:
+        return (
+            (not equipment_id or doc['equipment_id'] == equipment_id)
+            and (not movement_type or doc['movement_type'] == movement_type)
+            and (start is None or doc['timestamp'] >= start)
+            and (end is None or doc['timestamp'] <= end)
+            and (before is None or (doc['timestamp'], doc['id']) < before)
+        )
+    return matches, start, end
+
 @api_router.post("/movements", response_model=Movement)
 async def create_movement(movement: MovementCreate):
-    # Get equipment details
-    equipment = await db.equipment.find_one({"id": movement.equipment_id}, {"_id": 0})
-    if not equipment:
-        raise HTTPException(status_code=404, detail="Equipment not found")
+    if movement.movement_type not in STATUS_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="movement_type must be check_out or check_in")
+    required_status, _ = STATUS_TRANSITIONS[movement.movement_type]
+    now = datetime.now(timezone.utc)
     
-    movement_dict = movement.model_dump()
-    movement_dict['equipment_name'] = equipment['name']
+    loan_fields = equipment_loan_fields(movement, now)
     
-    if movement.movement_type == "check_out":
-        movement_dict['actual_return_date'] = None
-    elif movement.movement_type == "check_in":
-        movement_dict['actual_return_date'] = datetime.now(timezone.utc)
+    # One conditional update: of two concurrent check-outs only one can match.
+    # The previous state is returned because the loan statistics need it.
+    previous = await db.equipment.find_one_and_update(
+        {"id": movement.equipment_id, "status": required_status},
+        {"$set": loan_fields},
+        projection=EQUIPMENT_PROJECTION,
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        if not await db.equipment.find_one({"id": movement.equipment_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Equipment not found")
+        raise HTTPException(status_code=409, detail=f"Equipment is not {required_status}")
+    equipment = {**previous, **loan_fields}
+    if USE_EQUIPMENT_REPLICA:
+        equipment_replica.update(movement.equipment_id, loan_fields)
     
+    movement_dict = movement.model_dump()
+    movement_dict['equipment_name'] = equipment['name']
+    movement_dict['actual_return_date'] = now if movement.movement_type == "check_in" else None
+    movement_dict['timestamp'] = now
     movement_obj = Movement(**movement_dict)
     
-    # Update equipment status
-    if movement.movement_type == "check_out":
-        await db.equipment.update_one(
-            {"id": movement.equipment_id},
-            {"$set": {
-                "status": "On Loan",
-                "current_borrower": movement.borrower_name,
-                "current_borrower_email": movement.borrower_email,
-                "delivery_date": movement.delivery_date.isoformat() if movement.delivery_date else None,
-                "expected_return_date": movement.expected_return_date.isoformat() if movement.expected_return_date else None,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    elif movement.movement_type == "check_in":
-        await db.equipment.update_one(
-            {"id": movement.equipment_id},
-            {"$set": {
-                "status": "Available",
-                "current_borrower": None,
-                "current_borrower_email": None,
-                "delivery_date": None,
-                "expected_return_date": None,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    
     # Save movement
     doc = movement_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    if doc.get('delivery_date'):
-        doc['delivery_date'] = doc['delivery_date'].isoformat()
-    if doc.get('expected_return_date'):
-        doc['expected_return_date'] = doc['expected_return_date'].isoformat()
-    if doc.get('actual_return_date'):
-        doc['actual_return_date'] = doc['actual_return_date'].isoformat()
-    
     await db.movements.insert_one(doc)
+    await loan_stats.apply_updates(db, [loan_stats.movement_update(
+        previous, movement.movement_type, movement.borrower_name, movement.borrower_email, now
+    )])
+    await borrower_index.apply_updates(db, borrower_index.movement_updates([(movement, previous)], now))
+    await change_log.record(db, [("movements", movement_obj.id, "created"), ("equipment", movement.equipment_id, "updated")])
+    invalidate_read_caches()
+    publish_event("movement.created", movement_obj.model_dump())
+    publish_event("equipment.updated", equipment)
     return movement_obj
 
+@api_router.post("/movements/batch", response_model=List[Movement])
+async def create_movement_batch(batch: MovementBatch):
+    """Check a kit of items out to (or in from) one borrower, all or nothing"""
+    movements = batch.movements
+    if not movements:
+        raise HTTPException(status_code=400, detail="No movements given")
+    if len({m.borrower_email for m in movements}) > 1:
+        raise HTTPException(status_code=400, detail="All movements in a batch must be for the same borrower")
+    if any(m.movement_type not in STATUS_TRANSITIONS for m in movements):
+        raise HTTPException(status_code=400, detail="movement_type must be check_out or check_in")
+    equipment_ids = [m.equipment_id for m in movements]
+    if len(set(equipment_ids)) != len(equipment_ids):
+        raise HTTPException(status_code=400, detail="Each equipment may appear only once per batch")
+    
+    # Whole documents: the equipment.updated events carry them
+    equipment_list = await db.equipment.find(
+        {"id": {"$in": equipment_ids}}, EQUIPMENT_PROJECTION
+    ).to_list(len(equipment_ids))
+    equipment_by_id = {e['id']: e for e in equipment_list}
+    missing = [i for i in equipment_ids if i not in equipment_by_id]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Equipment not found: {', '.join(missing)}")
+    unavailable = [
+        m.equipment_id for m in movements
+        if equipment_by_id[m.equipment_id].get('status') != STATUS_TRANSITIONS[m.movement_type][0]
+    ]
+    if unavailable:
+        raise HTTPException(status_code=409, detail=f"Equipment not in the required status: {', '.join(unavailable)}")
+    
+    # BSON datetimes have millisecond precision; the stamp must round-trip exactly
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    movement_objs = []
+    updates = []
+    for movement in movements:
+        required_status, _ = STATUS_TRANSITIONS[movement.movement_type]
+        movement_dict = movement.model_dump()
+        movement_dict['equipment_name'] = equipment_by_id[movement.equipment_id]['name']
+        movement_dict['actual_return_date'] = now if movement.movement_type == "check_in" else None
+        movement_dict['timestamp'] = now
+        movement_objs.append(Movement(**movement_dict))
+        # Guarded on the current status, so a concurrent change makes the batch fail
+        updates.append(UpdateOne(
+            {"id": movement.equipment_id, "status": required_status},
+            {"$set": equipment_loan_fields(movement, now)}
+        ))
+    docs = [m.model_dump() for m in movement_objs]
+    stats_updates = [
+        loan_stats.movement_update(
+            equipment_by_id[m.equipment_id], m.movement_type, m.borrower_name, m.borrower_email, now
+        ) for m in movements
+    ]
+    borrower_updates = borrower_index.movement_updates(
+        [(m, equipment_by_id[m.equipment_id]) for m in movements], now
+    )
+    
+    async def apply(session=None):
+        result = await db.equipment.bulk_write(updates, ordered=False, session=session)
+        if result.matched_count != len(updates):
+            raise BatchConflict()
+        await db.movements.insert_many(docs, ordered=False, session=session)
+        await loan_stats.apply_updates(db, stats_updates, session=session)
+        await borrower_index.apply_updates(db, borrower_updates, session=session)
+    
+    try:
+        if await supports_transactions():
+            async with await client.start_session() as session:
+                await session.with_transaction(apply)
+        else:
+            try:
+                await apply()
+            except Exception:
+                # No transactions on a standalone server: restore the items that were
+                # updated, recognisable by this batch's updated_at stamp, and drop the
+                # movements. Statistics already applied need a --rebuild of
+                # loan_stats/borrowers to correct.
+                await db.equipment.bulk_write([
+                    UpdateOne(
+                        {"id": e['id'], "updated_at": now},
+                        {"$set": {f: e.get(f) for f in LOAN_FIELDS}}
+                    ) for e in equipment_list
+                ], ordered=False)
+                await db.movements.delete_many({"id": {"$in": [doc['id'] for doc in docs]}})
+                raise
+    except BatchConflict:
+        raise HTTPException(
+            status_code=409,
+            detail="Some equipment changed status; no movement in the batch was recorded"
+        )
+    
+    if USE_EQUIPMENT_REPLICA:
+        for movement in movements:
+            equipment_replica.update(movement.equipment_id, equipment_loan_fields(movement, now))
+    await change_log.record(
+        db,
+        [("movements", m.id, "created") for m in movement_objs]
+        + [("equipment", m.equipment_id, "updated") for m in movements]
+    )
+    invalidate_read_caches()
+    for movement, movement_obj in zip(movements, movement_objs):
+        publish_event("movement.created", movement_obj.model_dump())
+        publish_event("equipment.updated", {
+            **equipment_by_id[movement.equipment_id], **equipment_loan_fields(movement, now)
+        })
+    return movement_objs
+
+async def movements_page(
+    equipment_id: Optional[str],
+    movement_type: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    limit: int,
+    cursor: Optional[str],
+    history: bool = False
+):
+    """One page of movements, newest first, and the cursor of the next page (or None).
+
+    Archived movements are included only as ``reaches_archive`` decides.
+    """
+    query = movements_filter(equipment_id, movement_type, start_date, end_date)
+    before = None
+    if cursor:
+        last_timestamp, last_id = decode_cursor(cursor, 2)
+        before = (parse_date_param(last_timestamp, 'cursor'), last_id)
+        query = {'$and': [query, keyset_filter(('timestamp', 'id'), before, DESCENDING)]}
+    
+    movements = await db.movements.find(query, MOVEMENT_PROJECTION).sort(
+        [("timestamp", DESCENDING), ("id", DESCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(movements) <= limit and reaches_archive(history, start_date, end_date):
+        # Hot rows exhausted: the rest of the page comes from the (older) archive
+        if movements:
+            before = (movements[-1]['timestamp'], movements[-1]['id'])
+        matches, start, end = archived_movements_matcher(equipment_id, movement_type, start_date, end_date, before)
+        months = await archived_months(equipment_id)
+        archived = await asyncio.to_thread(
+            movement_archive.find, matches, start, end, limit + 1 - len(movements), months
+        )
+        movements += [{f: doc.get(f) for f in Movement.model_fields} for doc in archived]
+    
+    if len(movements) > limit:
+        movements = movements[:limit]
+        return movements, encode_cursor(movements[-1]['timestamp'], movements[-1]['id'])
+    return movements, None
+
 @api_router.get("/movements", response_model=List[Movement])
 async def get_all_movements(
     equipment_id: Optional[str] = Query(None),
     movement_type: Optional[str] = Query(None),
     start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None)
+    end_date: Optional[str] = Query(None),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    history: bool = Query(False)
 ):
-    query = {}
-    if equipment_id:
-        query['equipment_id'] = equipment_id
-    if movement_type:
-        query['movement_type'] = movement_type
-    if start_date or end_date:
-        query['timestamp'] = {}
-        if start_date:
-            query['timestamp']['$gte'] = start_date
-        if end_date:
-            query['timestamp']['$lte'] = end_date
-    
-    movements = await db.movements.find(query, {"_id": 0}).sort("timestamp", -1).to_list(1000)
-    
-    for mov in movements:
-        for date_field in ['timestamp', 'delivery_date', 'expected_return_date', 'actual_return_date']:
-            if mov.get(date_field) and isinstance(mov[date_field], str):
-                mov[date_field] = datetime.fromisoformat(mov[date_field])
+    """Newest first; with ``history`` the pages continue into archived movements"""
+    movements, next_cursor = await movements_page(
+        equipment_id, movement_type, start_date, end_date, limit, cursor, history
+    )
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
     
-    return movements
+    # Rows already have the Movement shape; skip response_model validation
+    return ORJSONResponse(movements, headers=headers)
 
 @api_router.get("/movements/overdue")
 async def get_overdue_equipment():
-    now = datetime.now(timezone.utc).isoformat()
-    equipment_list = await db.equipment.find({
-        "status": "On Loan",
-        "expected_return_date": {"$lt": now}
-    }, {"_id": 0}).to_list(1000)
-    
-    for equip in equipment_list:
-        for date_field in ['created_at', 'updated_at', 'delivery_date', 'expected_return_date']:
-            if equip.get(date_field) and isinstance(equip[date_field], str):
-                equip[date_field] = datetime.fromisoformat(equip[date_field])
-    
+    if replica_ready():
+        return ORJSONResponse(equipment_replica.overdue(datetime.now(timezone.utc)))
+    equipment_list, _ = await overdue_monitor.snapshot()
     return equipment_list
 
 @api_router.get("/overdue/detailed")
 async def get_overdue_detailed():
     """Get detailed overdue information with days calculation"""
-    now = datetime.now(timezone.utc)
-    now_iso = now.isoformat()
+    if replica_ready():
+        now = datetime.now(timezone.utc)
+        return overdue_details(equipment_replica.overdue(now), now)
+    _, details = await overdue_monitor.snapshot()
+    return details
+
+# ============= Borrower Endpoints =============
+
+BORROWER_PROJECTION = {"_id": 0, "aliases": 0}
+
+@api_router.get("/borrowers")
+async def get_borrowers(
+    active: bool = Query(False),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None)
+):
+    """Borrowers by e-mail; ``active=true`` keeps only those holding equipment"""
+    query = {"active_loans": {"$gt": 0}} if active else {}
+    if cursor:
+        (last_email,) = decode_cursor(cursor, 1)
+        query["email"] = {"$gt": last_email}
     
-    equipment_list = await db.equipment.find({
-        "status": "On Loan",
-        "expected_return_date": {"$lt": now_iso}
-    }, {"_id": 0}).to_list(1000)
-    
-    overdue_details = []
-    for equip in equipment_list:
-        expected_return = datetime.fromisoformat(equip['expected_return_date']) if isinstance(equip['expected_return_date'], str) else equip['expected_return_date']
-        
-        # Ensure expected_return has timezone info
-        if expected_return.tzinfo is None:
-            expected_return = expected_return.replace(tzinfo=timezone.utc)
-        
-        days_overdue = (now - expected_return).days
-        
-        overdue_details.append({
-            "id": equip['id'],
-            "name": equip['name'],
-            "model": equip['model'],
-            "borrower_name": equip.get('current_borrower', 'N/A'),
-            "borrower_email": equip.get('current_borrower_email', 'N/A'),
-            "expected_return_date": expected_return.isoformat(),
-            "days_overdue": days_overdue,
-            "status": "Atrasado"
-        })
+    borrower_list = await db.borrowers.find(query, BORROWER_PROJECTION).sort(
+        "email", ASCENDING
+    ).limit(limit + 1).to_list(limit + 1)
     
-    return overdue_details
+    headers = {}
+    if len(borrower_list) > limit:
+        borrower_list = borrower_list[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(borrower_list[-1]['email'])
+    return ORJSONResponse(borrower_list, headers=headers)
+
+async def find_borrower(email: str, projection: dict) -> dict:
+    borrower = await db.borrowers.find_one({"email": borrower_index.normalize_email(email)}, projection)
+    if not borrower:
+        raise HTTPException(status_code=404, detail="Borrower not found")
+    return borrower
+
+@api_router.get("/borrowers/{email}/active", response_model=List[Equipment])
+async def get_borrower_active(email: str):
+    borrower = await find_borrower(email, {"_id": 0, "active_equipment_ids": 1})
+    ids = borrower.get('active_equipment_ids', [])
+    equipment_list = await db.equipment.find({"id": {"$in": ids}}, EQUIPMENT_PROJECTION).sort(
+        "expected_return_date", ASCENDING
+    ).to_list(len(ids))
+    return ORJSONResponse(equipment_list)
+
+@api_router.get("/borrowers/{email}/history", response_model=List[Movement])
+async def get_borrower_history(
+    email: str,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    history: bool = Query(False)
+):
+    """Newest first; with ``history`` the pages continue into archived movements"""
+    borrower = await find_borrower(email, {"_id": 0, "aliases": 1})
+    aliases = borrower.get('aliases', [])
+    # Every spelling the borrower has used, each an indexed range
+    query = {"borrower_email": {"$in": aliases}}
+    before = None
+    if cursor:
+        last_timestamp, last_id = decode_cursor(cursor, 2)
+        before = (parse_date_param(last_timestamp, 'cursor'), last_id)
+        query = {'$and': [query, keyset_filter(('timestamp', 'id'), before, DESCENDING)]}
+    
+    movements = await db.movements.find(query, MOVEMENT_PROJECTION).sort(
+        [("timestamp", DESCENDING), ("id", DESCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(movements) <= limit and reaches_archive(history, None, None):
+        if movements:
+            before = (movements[-1]['timestamp'], movements[-1]['id'])
+        matches, start, end = archived_movements_matcher(None, None, None, None, before)
+        aliases = set(aliases)
+        archived = await asyncio.to_thread(
+            movement_archive.find,
+            lambda doc: doc.get('borrower_email') in aliases and matches(doc),
+            start, end, limit + 1 - len(movements)
+        )
+        movements += [{f: doc.get(f) for f in Movement.model_fields} for doc in archived]
+    
+    headers = {}
+    if len(movements) > limit:
+        movements = movements[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(movements[-1]['timestamp'], movements[-1]['id'])
+    return ORJSONResponse(movements, headers=headers)
 
 # ============= Document Endpoints =============
 
@@ -327,54 +985,54 @@ async def upload_document(
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
-    # Check file size (50MB max)
-    content = await file.read()
-    if len(content) > 50 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size must be less than 50MB")
-    
-    # Generate unique filename
-    file_ext = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOADS_DIR / unique_filename
+    # Stream to disk in chunks, enforcing the 50MB limit as bytes arrive
+    try:
+        temp_path, file_size, sha256 = await receive_upload(file, UPLOADS_DIR)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL)
     
-    # Save file
-    async with aiofiles.open(file_path, 'wb') as f:
-        await f.write(content)
+    # Identical content maps to the same blob
+    file_path = blob_path(UPLOADS_DIR, sha256, Path(file.filename).suffix)
     
-    # Create document record
     document = Document(
         equipment_id=equipment_id,
         movement_id=movement_id,
-        filename=unique_filename,
+        filename=file_path.name,
         original_filename=file.filename,
         file_path=str(file_path),
-        file_size=len(content)
+        file_size=file_size,
+        sha256=sha256
     )
     
+    # Reference first, then publish the blob, so a concurrent delete of the
+    # previous last reference cannot remove the file out from under us
     doc = document.model_dump()
-    doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-    
     await db.documents.insert_one(doc)
+    await retain_blob(db, str(file_path))
+    try:
+        await commit_upload(temp_path, file_path)
+    except OSError:
+        await discard_upload(temp_path)
+        await db.documents.delete_one({"id": document.id})
+        await release_blob(db, str(file_path))
+        raise
+    await change_log.record(db, [("documents", document.id, "created")])
+    publish_event("document.created", document.model_dump())
     
     return {
         "id": document.id,
         "filename": file.filename,
-        "file_size": len(content),
+        "file_size": file_size,
         "uploaded_at": document.uploaded_at.isoformat()
     }
 
 @api_router.get("/documents/equipment/{equipment_id}")
 async def get_equipment_documents(equipment_id: str):
-    documents = await db.documents.find({"equipment_id": equipment_id}, {"_id": 0}).to_list(1000)
-    
-    for doc in documents:
-        if doc.get('uploaded_at') and isinstance(doc['uploaded_at'], str):
-            doc['uploaded_at'] = datetime.fromisoformat(doc['uploaded_at'])
-    
+    documents = await db.documents.find({"equipment_id": equipment_id}, {"_id": 0}).limit(1000).to_list(1000)
     return documents
 
 @api_router.get("/documents/{document_id}/download")
-async def download_document(document_id: str):
+async def download_document(document_id: str, request: Request):
     document = await db.documents.find_one({"id": document_id}, {"_id": 0})
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -383,9 +1041,11 @@ async def download_document(document_id: str):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
     
-    return FileResponse(
+    return document_response(
+        request,
         path=file_path,
         filename=document['original_filename'],
+        sha256=document.get('sha256'),
         media_type='application/pdf'
     )
 
@@ -395,54 +1055,398 @@ async def delete_document(document_id: str):
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete file from disk
-    file_path = Path(document['file_path'])
-    if file_path.exists():
-        file_path.unlink()
-    
-    # Delete from database
-    await db.documents.delete_one({"id": document_id})
+    # Delete from database, then the file once nothing else shares it; only the
+    # request that actually deleted the record gives up its reference
+    result = await db.documents.delete_one({"id": document_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Document not found")
+    await release_blob(db, document['file_path'])
+    await change_log.record(db, [("documents", document_id, "deleted")])
+    publish_event("document.deleted", {"id": document_id, "equipment_id": document['equipment_id']})
     
     return {"message": "Document deleted successfully"}
 
-# ============= Stats Endpoint =============
+# ============= Replica Endpoints =============
 
-@api_router.get("/stats")
-async def get_stats():
-    total_equipment = await db.equipment.count_documents({})
-    available = await db.equipment.count_documents({"status": "Available"})
-    on_loan = await db.equipment.count_documents({"status": "On Loan"})
-    maintenance = await db.equipment.count_documents({"status": "Maintenance"})
+@api_router.get("/replica/check")
+async def check_equipment_replica(repair: bool = Query(False)):
+    """Compare the in-memory equipment replica with Mongo; ``repair`` reloads it on drift"""
+    if not USE_EQUIPMENT_REPLICA:
+        raise HTTPException(status_code=404, detail="Equipment replica is disabled")
+    return await equipment_replica.check(db, repair=repair)
+
+# ============= Change Feed Endpoints =============
+
+# Current state returned with each created/updated entry
+CHANGE_PROJECTIONS = {
+    "equipment": EQUIPMENT_PROJECTION,
+    "movements": MOVEMENT_PROJECTION,
+    "documents": {**DOCUMENT_SUMMARY_PROJECTION, "equipment_id": 1},
+}
+
+async def change_records(collection: str, ids: List[str]) -> dict:
+    docs = await db[collection].find({"id": {"$in": ids}}, CHANGE_PROJECTIONS[collection]).to_list(len(ids))
+    return {(collection, doc['id']): doc for doc in docs}
+
+async def change_feed(since: Optional[str], collections: Optional[List[str]], limit: int):
+    """Records created, updated or deleted after the ``since`` token.
+
+    Without ``since`` only the current token is returned: take it before
+    loading the full lists, then poll with it and apply the changes (they are
+    idempotent). A token older than the change log's retention gets 410 and
+    the client reloads everything.
+    """
+    now = datetime.now(timezone.utc)
+    if since is None:
+        return ORJSONResponse({"changes": [], "next": encode_cursor(await change_log.latest(db), now), "has_more": False})
     
-    now = datetime.now(timezone.utc).isoformat()
-    overdue = await db.equipment.count_documents({
-        "status": "On Loan",
-        "expected_return_date": {"$lt": now}
+    seq, issued = decode_cursor(since, 2)
+    if not isinstance(seq, int) or not isinstance(issued, str):
+        raise HTTPException(status_code=400, detail="Invalid since token")
+    issued_at = parse_date_param(issued, 'since token')
+    if issued_at < now - timedelta(days=change_log.RETENTION_DAYS):
+        raise HTTPException(status_code=410, detail="Change token expired; reload the full lists")
+    
+    entries, next_seq, next_at, has_more = await change_log.read_since(db, seq, collections, limit, now)
+    
+    wanted = {}
+    for entry in entries:
+        if entry['op'] != "deleted":
+            wanted.setdefault(entry['collection'], []).append(entry['record_id'])
+    records = {}
+    for found in await asyncio.gather(*(change_records(c, ids) for c, ids in wanted.items())):
+        records.update(found)
+    
+    changes = []
+    for entry in entries:
+        record = records.get((entry['collection'], entry['record_id']))
+        changes.append({
+            "seq": entry['seq'],
+            "collection": entry['collection'],
+            "id": entry['record_id'],
+            # Gone since; its own tombstone comes in a later page
+            "op": entry['op'] if record or entry['op'] == "deleted" else "deleted",
+            "at": entry['at'],
+            "record": record,
+        })
+    return ORJSONResponse({
+        "changes": changes,
+        "next": encode_cursor(next_seq, next_at or issued_at),
+        "has_more": has_more,
     })
+
+@api_router.get("/changes")
+async def get_changes(
+    since: Optional[str] = Query(None),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    return await change_feed(since, None, limit)
+
+# ============= Events Endpoint =============
+
+@api_router.get("/events")
+async def stream_events(request: Request):
+    return StreamingResponse(
+        sse_stream(event_bus, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============= Stats Endpoint =============
+
+async def compute_stats() -> dict:
+    """All dashboard counters in a single aggregation round trip.
+
+    Counted from current equipment state only, so archiving movements does
+    not change them.
+    """
+    pipeline = [
+        {"$facet": {
+            "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "overdue": [{"$match": overdue_filter()}, {"$count": "count"}]
+        }}
+    ]
+    result = (await db.equipment.aggregate(pipeline).to_list(1))[0]
+    by_status = {row['_id']: row['count'] for row in result['by_status']}
     
     return {
-        "total_equipment": total_equipment,
-        "available": available,
-        "on_loan": on_loan,
-        "maintenance": maintenance,
-        "overdue": overdue
+        "total_equipment": sum(by_status.values()),
+        "available": by_status.get("Available", 0),
+        "on_loan": by_status.get("On Loan", 0),
+        "maintenance": by_status.get("Maintenance", 0),
+        "overdue": result['overdue'][0]['count'] if result['overdue'] else 0
+    }
+
+def stats_from_replica() -> dict:
+    by_status = equipment_replica.status_counts()
+    return {
+        "total_equipment": len(equipment_replica),
+        "available": by_status.get("Available", 0),
+        "on_loan": by_status.get("On Loan", 0),
+        "maintenance": by_status.get("Maintenance", 0),
+        "overdue": len(equipment_replica.overdue(datetime.now(timezone.utc)))
     }
 
+@api_router.get("/stats")
+async def get_stats():
+    if replica_ready():
+        return stats_from_replica()
+    return await stats_cache.get_or_load("stats", compute_stats)
+
+# ============= Report Endpoints =============
+
+UTILIZATION_SORT_FIELDS = {
+    "total_loan_days": "total_loan_seconds",
+    "loan_count": "loan_count",
+    "late_returns": "late_returns",
+}
+
+@api_router.get("/reports/utilization")
+async def get_utilization_report(
+    sort: str = Query("total_loan_days", pattern="^(total_loan_days|loan_count|late_returns)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Equipment ranked by usage, read straight from the equipment_stats read model.
+
+    Ranking uses completed loans; loans still in progress are added to the
+    reported figures. Items that were never lent have no stats document.
+    """
+    direction = DESCENDING if order == "desc" else ASCENDING
+    rows = await db.equipment_stats.find({}, {"_id": 0}).sort(
+        [(UTILIZATION_SORT_FIELDS[sort], direction), ("equipment_id", direction)]
+    ).limit(limit).to_list(limit)
+    now = datetime.now(timezone.utc)
+    return [loan_stats.present(row, row['equipment_id'], now) for row in rows]
+
+def reject_archived_range(start_date: Optional[str], end_date: Optional[str]) -> None:
+    """Reports read only the hot movements; refuse a range that reaches archived ones.
+
+    Without any dates a report covers every movement still in Mongo.
+    """
+    if range_reaches_archive(start_date, end_date):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Reports cover movements after {movement_archive.newest().isoformat()}; "
+                   "older movements are archived, so give a later start_date"
+        )
+
+async def report_frames(start_date: Optional[str], end_date: Optional[str], with_equipment: bool = False):
+    """Movement (and optionally equipment) frames for the report functions, from hot data only"""
+    query = movements_filter(None, None, start_date, end_date)
+    query['movement_type'] = {'$in': list(STATUS_TRANSITIONS)}
+    movements = await reports.load_frame(
+        db.movements.find(query, {"_id": 0, **{c: 1 for c in reports.MOVEMENT_COLUMNS}}).sort(
+            [("timestamp", ASCENDING), ("id", ASCENDING)]
+        ),
+        reports.MOVEMENT_COLUMNS
+    )
+    equipment = None
+    if with_equipment:
+        equipment = await reports.load_frame(
+            db.equipment.find({}, {"_id": 0, **{c: 1 for c in reports.EQUIPMENT_COLUMNS}}),
+            reports.EQUIPMENT_COLUMNS
+        )
+    return movements, equipment
+
+async def cached_report(key: tuple, start_date: Optional[str], end_date: Optional[str], compute, with_equipment=False):
+    reject_archived_range(start_date, end_date)
+    
+    async def load():
+        movements, equipment = await report_frames(start_date, end_date, with_equipment)
+        # Vectorized but still CPU-bound: keep it off the event loop
+        return await asyncio.to_thread(compute, movements, equipment)
+    return await reports_cache.get_or_load(key + (start_date, end_date), load)
+
+@api_router.get("/reports/loan-durations")
+async def get_loan_durations_report(start_date: Optional[str] = Query(None), end_date: Optional[str] = Query(None)):
+    return await cached_report(
+        ("loan-durations",), start_date, end_date,
+        lambda movements, equipment: reports.loan_durations(reports.loans(movements), equipment),
+        with_equipment=True
+    )
+
+@api_router.get("/reports/activity")
+async def get_activity_report(
+    period: str = Query("day", pattern="^(day|week)$"),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None)
+):
+    return await cached_report(
+        ("activity", period), start_date, end_date,
+        lambda movements, _: reports.checkouts_per_period(movements, period)
+    )
+
+@api_router.get("/reports/on-time")
+async def get_on_time_report(
+    period: str = Query("week", pattern="^(day|week)$"),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None)
+):
+    return await cached_report(
+        ("on-time", period), start_date, end_date,
+        lambda movements, _: reports.on_time_returns(reports.loans(movements), period)
+    )
+
+@api_router.get("/reports/borrowers")
+async def get_borrowers_report(
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None)
+):
+    return await cached_report(
+        ("borrowers", limit), start_date, end_date,
+        lambda movements, _: reports.borrower_ranking(movements, reports.loans(movements), limit)
+    )
+
+# ============= Export Endpoints =============
+
+EQUIPMENT_EXPORT_FIELDS = [
+    'id', 'name', 'model', 'serial_number', 'status', 'current_borrower',
+    'current_borrower_email', 'delivery_date', 'expected_return_date', 'created_at', 'updated_at'
+]
+MOVEMENT_EXPORT_FIELDS = [
+    'id', 'equipment_id', 'equipment_name', 'movement_type', 'borrower_name', 'borrower_email',
+    'delivery_date', 'expected_return_date', 'actual_return_date', 'notes', 'timestamp'
+]
+EXPORT_BATCH_SIZE = 500
+
+def _pt_br_date(value: Optional[datetime], tz) -> str:
+    return value.astimezone(tz).strftime('%d/%m/%Y') if value else ''
+
+def _pt_br_datetime(value: Optional[datetime], tz) -> str:
+    return value.astimezone(tz).strftime('%d/%m/%Y, %H:%M:%S') if value else ''
+
+# The spreadsheets users download from the Reports page: (header, value of a row) per column.
+# NDJSON exports carry the raw *_EXPORT_FIELDS instead.
+EQUIPMENT_CSV_COLUMNS = [
+    ('nome', lambda doc, tz: doc.get('name')),
+    ('modelo', lambda doc, tz: doc.get('model')),
+    ('numero_serie', lambda doc, tz: doc.get('serial_number') or 'N/A'),
+    ('status', lambda doc, tz: doc.get('status')),
+    ('responsavel_atual', lambda doc, tz: doc.get('current_borrower') or 'N/A'),
+]
+OVERDUE_CSV_COLUMNS = [
+    ('nome', lambda doc, tz: doc.get('name')),
+    ('modelo', lambda doc, tz: doc.get('model')),
+    ('responsavel', lambda doc, tz: doc.get('current_borrower')),
+    ('email', lambda doc, tz: doc.get('current_borrower_email') or 'N/A'),
+    ('prazo_devolucao', lambda doc, tz: _pt_br_date(doc.get('expected_return_date'), tz)),
+]
+MOVEMENT_CSV_COLUMNS = [
+    ('equipamento', lambda doc, tz: doc.get('equipment_name')),
+    ('tipo', lambda doc, tz: 'Empréstimo' if doc.get('movement_type') == 'check_out' else 'Devolução'),
+    ('responsavel', lambda doc, tz: doc.get('borrower_name')),
+    ('email', lambda doc, tz: doc.get('borrower_email')),
+    ('data_hora', lambda doc, tz: _pt_br_datetime(doc.get('timestamp'), tz)),
+]
+
+def export_timezone(tz: Optional[str]):
+    """Dates in a CSV export are shown in the caller's time zone (UTC by default)"""
+    if not tz:
+        return timezone.utc
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown time zone: {tz}")
+
+async def _export_rows(cursor, fields: List[str], csv_columns: list, fmt: str, tz):
+    """Encode a Motor cursor as CSV or NDJSON, one chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow([header for header, _ in csv_columns])
+    
+    rows = 0
+    async for doc in cursor:
+        if fmt == 'csv':
+            writer.writerow([value(doc, tz) for _, value in csv_columns])
+        else:
+            buffer.write(orjson.dumps({field: doc.get(field) for field in fields}).decode())
+            buffer.write('\n')
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue()
+
+def export_response(rows, fields: List[str], csv_columns: list, fmt: str, tz: Optional[str], name: str) -> StreamingResponse:
+    """``rows`` is a Motor cursor or any async iterable of documents"""
+    media_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        _export_rows(rows, fields, csv_columns, fmt, export_timezone(tz)),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{name}.{fmt}"'}
+    )
+
+@api_router.get("/export/equipment")
+async def export_equipment(
+    status: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    tz: Optional[str] = Query(None)
+):
+    cursor = db.equipment.find(equipment_filter(status, search), EQUIPMENT_PROJECTION).sort(
+        [("name", ASCENDING), ("id", ASCENDING)]
+    ).batch_size(EXPORT_BATCH_SIZE)
+    return export_response(cursor, EQUIPMENT_EXPORT_FIELDS, EQUIPMENT_CSV_COLUMNS, fmt, tz, 'todos-equipamentos')
+
+@api_router.get("/export/movements")
+async def export_movements(
+    equipment_id: Optional[str] = Query(None),
+    movement_type: Optional[str] = Query(None),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    tz: Optional[str] = Query(None)
+):
+    query = movements_filter(equipment_id, movement_type, start_date, end_date)
+    
+    async def rows():
+        cursor = db.movements.find(query, MOVEMENT_PROJECTION).sort(
+            [("timestamp", DESCENDING), ("id", DESCENDING)]
+        ).batch_size(EXPORT_BATCH_SIZE)
+        last = None
+        async for doc in cursor:
+            last = doc
+            yield doc
+        # Archived rows are all older than the hot ones, so they simply follow
+        before = (last['timestamp'], last['id']) if last else None
+        matches, start, end = archived_movements_matcher(equipment_id, movement_type, start_date, end_date, before)
+        for segment in movement_archive.segments_for(start, end, await archived_months(equipment_id)):
+            for doc in await asyncio.to_thread(movement_archive.read_segment, segment):
+                if matches(doc):
+                    yield doc
+    
+    return export_response(rows(), MOVEMENT_EXPORT_FIELDS, MOVEMENT_CSV_COLUMNS, fmt, tz, 'historico-movimentacoes')
+
+@api_router.get("/export/overdue")
+async def export_overdue(
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    tz: Optional[str] = Query(None)
+):
+    cursor = db.equipment.find(overdue_filter(), EQUIPMENT_PROJECTION).sort(
+        "expected_return_date", ASCENDING
+    ).batch_size(EXPORT_BATCH_SIZE)
+    return export_response(cursor, EQUIPMENT_EXPORT_FIELDS, OVERDUE_CSV_COLUMNS, fmt, tz, 'equipamentos-atrasados')
+
 # ============= Settings Endpoints =============
 
-@api_router.get("/settings")
-async def get_settings():
+async def load_settings() -> dict:
     settings = await db.settings.find_one({"id": "system_settings"}, {"_id": 0})
     if not settings:
         # Return default settings
         default_settings = Settings()
         return default_settings.model_dump()
     
-    if settings.get('updated_at') and isinstance(settings['updated_at'], str):
-        settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
-    
     return settings
 
+@api_router.get("/settings")
+async def get_settings():
+    return await settings_cache.get_or_load("settings", load_settings)
+
 @api_router.put("/settings")
 async def update_settings(settings_update: SettingsUpdate):
     settings = Settings(
@@ -451,33 +1455,73 @@ async def update_settings(settings_update: SettingsUpdate):
     )
     
     doc = settings.model_dump()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    
     await db.settings.update_one(
         {"id": "system_settings"},
         {"$set": doc},
         upsert=True
     )
+    settings_cache.invalidate()
+    # Re-read the check interval now rather than at the next wake-up
+    overdue_monitor.invalidate()
     
     return {"message": "Settings updated successfully", "settings": settings.model_dump()}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of the request and Mongo command metrics"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Refuses oversized uploads before their bodies are spooled to disk
+app.add_middleware(UploadSizeLimit, paths=["/api/documents/upload"])
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
+# Outermost, so the timings include every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def prepare_database():
+    await ensure_indexes(db)
+    # Before any request: a document deleted meanwhile would release an uncounted blob
+    await backfill_blob_refs(db)
+    # Batched and resumable; runs in the background so startup is not blocked
+    app.state.migration_task = asyncio.create_task(run_migrations(db))
+    overdue_monitor.start()
+    if USE_CHANGE_STREAMS:
+        app.state.change_stream_task = asyncio.create_task(watch_change_streams(db, event_bus))
+    if USE_EQUIPMENT_REPLICA:
+        if USE_CHANGE_STREAMS:
+            # Loads once the stream is open, then follows the other workers' writes
+            equipment_replica.start_following(db)
+        else:
+            await equipment_replica.load(db)
+    if MOVEMENT_RETENTION_DAYS:
+        app.state.archive_task = asyncio.create_task(
+            archive_periodically(db, movement_archive, int(MOVEMENT_RETENTION_DAYS))
+        )
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await overdue_monitor.stop()
+    await equipment_replica.stop()
+    if USE_CHANGE_STREAMS:
+        app.state.change_stream_task.cancel()
+    if MOVEMENT_RETENTION_DAYS:
+        app.state.archive_task.cancel()
     client.close()
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""Content-addressed on-disk storage for uploaded documents.
+
+Blobs are named after the SHA-256 of their content, so identical uploads
+share one file. ``db.blobs`` counts each file's references, one per
+``db.documents`` record with that ``file_path``: ``retain_blob`` adds one
+before a file is published and ``release_blob`` removes the file when the
+count drops to zero. Files without a ``db.blobs`` record (uploaded before
+the counts existed and not yet backfilled) are never removed.
+
+``UploadSizeLimit`` caps request bodies on the upload routes before
+Starlette spools them to disk; ``receive_upload`` then enforces the exact
+limit on the file part itself.
+"""
+import hashlib
+import re
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pymongo import ReturnDocument
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Room for the multipart boundaries, part headers and the other form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_TOO_LARGE_DETAIL = f"File size must be less than {MAX_UPLOAD_BYTES // (1024 * 1024)}MB"
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """Pure ASGI middleware rejecting oversized request bodies on ``paths`` with 413.
+
+    Starlette parses a multipart form, spooling every file to disk, before
+    the endpoint runs. A declared Content-Length over the limit is refused
+    without reading the body; a chunked body is counted as it arrives and
+    the request fails as soon as it goes over.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > self.max_bytes:
+                    response = JSONResponse({"detail": UPLOAD_TOO_LARGE_DETAIL}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the form parser, which lets HTTPException through
+                    raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL)
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+async def receive_upload(upload: UploadFile, directory: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[Path, int, str]:
+    """Copy an upload to a temp file in ``directory`` one chunk at a time.
+
+    Returns ``(temp_path, size, sha256)``. The temp file lives next to its
+    final location so ``commit_upload`` is an atomic rename. Raises
+    ``UploadTooLarge`` as soon as ``max_bytes`` is exceeded, leaving nothing
+    behind.
+    """
+    temp_path = directory / f".upload-{uuid.uuid4()}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, 'wb') as out:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        await discard_upload(temp_path)
+        raise
+    return temp_path, size, digest.hexdigest()
+
+
+def blob_path(directory: Path, sha256: str, suffix: str) -> Path:
+    return directory / f"{sha256}{suffix.lower()}"
+
+
+async def commit_upload(temp_path: Path, final_path: Path) -> None:
+    # Replacing an existing blob is harmless: same name, same bytes
+    await aiofiles.os.replace(temp_path, final_path)
+
+
+async def retain_blob(db, file_path: str) -> None:
+    """Count one more reference to ``file_path``; call before publishing the file"""
+    await db.blobs.update_one({"_id": file_path}, {"$inc": {"refs": 1}}, upsert=True)
+
+
+async def release_blob(db, file_path: str) -> bool:
+    """Drop one reference to ``file_path``, deleting the file with the last one.
+
+    Once the count reaches zero the file is first moved aside, then the
+    record is deleted only if it is still at zero. A concurrent upload of the
+    same content retains the blob before it publishes the file, so if it got
+    in between, the record survives and the file is moved back (it has the
+    same bytes as anything the upload wrote meanwhile).
+    """
+    blob = await db.blobs.find_one_and_update(
+        {"_id": file_path}, {"$inc": {"refs": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["refs"] > 0:
+        return False
+
+    # Hidden like the upload temp files, which dedupe_uploads leaves alone
+    path = Path(file_path)
+    trash_path = path.with_name(f".{path.name}.{uuid.uuid4()}.deleted")
+    try:
+        await aiofiles.os.rename(path, trash_path)
+    except FileNotFoundError:
+        trash_path = None
+    deleted = await db.blobs.delete_one({"_id": file_path, "refs": {"$lte": 0}})
+    if trash_path is None:
+        return bool(deleted.deleted_count)
+    if deleted.deleted_count:
+        await aiofiles.os.remove(trash_path)
+        return True
+    await aiofiles.os.replace(trash_path, path)
+    return False
+
+
+async def discard_upload(temp_path: Path) -> None:
+    try:
+        await aiofiles.os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+# ============= Downloads =============
+
+# A document id always names the same blob, so clients may cache it forever;
+# documents are not meant for shared caches, so only the browser keeps them
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single byte range; None if not satisfiable.
+
+    Malformed and multi-range headers raise ValueError; the caller then
+    serves the whole file, as RFC 9110 allows.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        raise ValueError(header)
+    first, last = match.groups()
+    if not first and not last:
+        raise ValueError(header)
+    if not first:
+        # suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        raise ValueError(header)
+    if start >= size:
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+async def _read_range(path: Path, start: int, end: int):
+    remaining = end - start + 1
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def document_response(request: Request, path: Path, filename: str, sha256: Optional[str], media_type: str) -> Response:
+    """Serve a stored blob with ETag revalidation and single-range support.
+
+    Legacy documents without a stored hash are served whole, as before.
+    """
+    if not sha256:
+        return FileResponse(path=path, filename=filename, media_type=media_type)
+
+    etag = f'"{sha256}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    size = path.stat().st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = False
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            pass  # malformed or multi-range: ignore the header
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range:
+        start, end = byte_range
+        headers.update({
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+        })
+        return StreamingResponse(_read_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(path=path, filename=filename, media_type=media_type, headers=headers)
@@ -2,6 +2,7 @@ import requests
 import sys
 from datetime import datetime, timedelta
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 class EquipmentLoanAPITester:
     def __init__(self, base_url="https://loantrek-3.preview.emergentagent.com"):
@@ -212,6 +213,49 @@ class EquipmentLoanAPITester:
         )
         return success
 
+    def test_concurrent_checkout(self, attempts=200):
+        """Fire many parallel check-outs at one item; exactly one may win"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Concurrent Check Out ({attempts} requests)...")
+        
+        response = requests.post(f"{self.api_url}/equipment", json={
+            "name": "Concurrency Test Item",
+            "model": "Race",
+            "status": "Available"
+        })
+        if response.status_code != 200:
+            print(f"❌ Failed - Could not create equipment: {response.status_code}")
+            return False
+        equipment_id = response.json()['id']
+        
+        def checkout(i):
+            return requests.post(f"{self.api_url}/movements", json={
+                "equipment_id": equipment_id,
+                "movement_type": "check_out",
+                "borrower_name": f"Racer {i}",
+                "borrower_email": f"racer{i}@example.com"
+            }).status_code
+        
+        try:
+            with ThreadPoolExecutor(max_workers=50) as pool:
+                statuses = list(pool.map(checkout, range(attempts)))
+            
+            movements = requests.get(f"{self.api_url}/movements", params={"equipment_id": equipment_id}).json()
+            won = statuses.count(200)
+            conflicts = statuses.count(409)
+            print(f"   200: {won}, 409: {conflicts}, other: {attempts - won - conflicts}, movements: {len(movements)}")
+            
+            success = won == 1 and conflicts == attempts - 1 and len(movements) == 1
+        finally:
+            requests.delete(f"{self.api_url}/equipment/{equipment_id}")
+        
+        if success:
+            self.tests_passed += 1
+            print("✅ Passed - Exactly one check-out recorded")
+        else:
+            print("❌ Failed - Concurrent check-outs were not serialized")
+        return success
+
     def test_get_movements(self):
         """Test getting all movements"""
         success, response = self.run_test(
@@ -353,6 +397,7 @@ def main():
         tester.test_get_movements,
         tester.test_get_movements_by_equipment,
         tester.test_checkin_equipment,
+        tester.test_concurrent_checkout,
         tester.test_get_overdue_equipment,
         tester.test_document_upload,
         tester.test_get_equipment_documents,
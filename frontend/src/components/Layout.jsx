@@ -16,7 +16,6 @@ export default function Layout({ children }) {
   const location = useLocation();
   const [overdueCount, setOverdueCount] = useState(0);
   const [overdueItems, setOverdueItems] = useState([]);
-  const [checkInterval, setCheckInterval] = useState(3600000); // Default: 1 hour
   const [readNotifications, setReadNotifications] = useState([]);
 
   const navigation = [
@@ -32,32 +31,26 @@ export default function Layout({ children }) {
     return location.pathname.startsWith(path);
   };
 
+  const applyOverdue = (items) => {
+    setOverdueItems(items.slice(0, 5)); // Show only first 5 in notification
+    
+    const stored = localStorage.getItem('readNotifications');
+    const readIds = stored ? JSON.parse(stored) : [];
+    setReadNotifications(readIds);
+    
+    const unreadCount = items.filter(item => !readIds.includes(item.id)).length;
+    setOverdueCount(unreadCount);
+  };
+
   const fetchOverdue = async () => {
     try {
       const response = await axios.get(`${API}/overdue/detailed`);
-      setOverdueItems(response.data.slice(0, 5)); // Show only first 5 in notification
-      
-      const stored = localStorage.getItem('readNotifications');
-      const readIds = stored ? JSON.parse(stored) : [];
-      setReadNotifications(readIds);
-      
-      const unreadCount = response.data.filter(item => !readIds.includes(item.id)).length;
-      setOverdueCount(unreadCount);
+      applyOverdue(response.data);
     } catch (error) {
       console.error('Erro ao buscar atrasos:', error);
     }
   };
 
-  const fetchSettings = async () => {
-    try {
-      const response = await axios.get(`${API}/settings`);
-      const intervalHours = response.data.check_interval_hours || 1;
-      setCheckInterval(intervalHours * 3600000); // Convert hours to milliseconds
-    } catch (error) {
-      console.error('Erro ao buscar configurações:', error);
-    }
-  };
-
   const markAsRead = (itemId) => {
     const newReadList = [...readNotifications, itemId];
     setReadNotifications(newReadList);
@@ -81,17 +74,16 @@ export default function Layout({ children }) {
   };
 
   useEffect(() => {
-    fetchOverdue();
-    fetchSettings();
-  }, []);
+    // The server recomputes overdue state on its own schedule and pushes changes;
+    // fetch once on (re)connect so nothing is missed while disconnected
+    const events = new EventSource(`${API}/events`);
+    events.onopen = () => fetchOverdue();
+    events.addEventListener('overdue.changed', (event) => {
+      applyOverdue(JSON.parse(event.data).data.items);
+    });
 
-  useEffect(() => {
-    const interval = setInterval(() => {
-      fetchOverdue();
-    }, checkInterval);
-
-    return () => clearInterval(interval);
-  }, [checkInterval]);
+    return () => events.close();
+  }, []);
 
   return (
     <div className="flex h-screen bg-white" data-testid="main-layout">
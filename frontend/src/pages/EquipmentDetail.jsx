@@ -25,6 +25,7 @@ import { toast } from 'sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const MOVEMENTS_PAGE_SIZE = 20;
 
 const STATUS_MAP = {
   'Available': 'Disponível',
@@ -39,6 +40,8 @@ export default function EquipmentDetail() {
   const [equipment, setEquipment] = useState(null);
   const [movements, setMovements] = useState([]);
   const [documents, setDocuments] = useState([]);
+  const [movementsCursor, setMovementsCursor] = useState(null);
+  const [loadingMoreMovements, setLoadingMoreMovements] = useState(false);
   const [loading, setLoading] = useState(true);
   const [showCheckoutDialog, setShowCheckoutDialog] = useState(false);
   const [showEditDialog, setShowEditDialog] = useState(false);
@@ -68,21 +71,23 @@ export default function EquipmentDetail() {
   const fetchData = async () => {
     try {
       setLoading(true);
-      const [equipRes, movementsRes, docsRes] = await Promise.all([
-        axios.get(`${API}/equipment/${id}`),
-        axios.get(`${API}/movements?equipment_id=${id}`),
-        axios.get(`${API}/documents/equipment/${id}`),
-      ]);
-
-      setEquipment(equipRes.data);
-      setMovements(movementsRes.data);
-      setDocuments(docsRes.data);
+      // Equipment, recent movements and documents in one round trip; the item's
+      // history includes archived movements
+      const response = await axios.get(`${API}/equipment/${id}/full`, {
+        params: { movements_limit: MOVEMENTS_PAGE_SIZE, history: true },
+      });
+      const { equipment: equip, movements: recent, movements_next_cursor, documents: docs } = response.data;
+
+      setEquipment(equip);
+      setMovements(recent);
+      setMovementsCursor(movements_next_cursor);
+      setDocuments(docs);
       
       setEditForm({
-        name: equipRes.data.name,
-        model: equipRes.data.model,
-        serial_number: equipRes.data.serial_number || '',
-        status: equipRes.data.status,
+        name: equip.name,
+        model: equip.model,
+        serial_number: equip.serial_number || '',
+        status: equip.status,
       });
     } catch (error) {
       toast.error('Falha ao carregar detalhes do equipamento');
@@ -92,6 +97,22 @@ export default function EquipmentDetail() {
     }
   };
 
+  const fetchMoreMovements = async () => {
+    try {
+      setLoadingMoreMovements(true);
+      const response = await axios.get(`${API}/movements`, {
+        params: { equipment_id: id, limit: MOVEMENTS_PAGE_SIZE, cursor: movementsCursor, history: true },
+      });
+      setMovements((current) => [...current, ...response.data]);
+      setMovementsCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Falha ao carregar histórico de movimentações');
+      console.error(error);
+    } finally {
+      setLoadingMoreMovements(false);
+    }
+  };
+
   const handleCheckout = async (e) => {
     e.preventDefault();
     
@@ -541,6 +562,18 @@ export default function EquipmentDetail() {
                   ))}
                 </div>
               )}
+              {movementsCursor && (
+                <div className="mt-4 flex justify-center">
+                  <Button
+                    variant="outline"
+                    onClick={fetchMoreMovements}
+                    disabled={loadingMoreMovements}
+                    data-testid="load-more-movements-btn"
+                  >
+                    {loadingMoreMovements ? 'Carregando...' : 'Carregar mais'}
+                  </Button>
+                </div>
+              )}
             </CardContent>
           </Card>
         </div>
@@ -22,11 +22,18 @@ export default function Reports() {
   const [overdueEquipment, setOverdueEquipment] = useState([]);
   const [loading, setLoading] = useState(true);
   const [reportType, setReportType] = useState('overdue');
+  const [analytics, setAnalytics] = useState(null);
 
   useEffect(() => {
     fetchData();
   }, []);
 
+  useEffect(() => {
+    if (reportType === 'analytics' && !analytics) {
+      fetchAnalytics();
+    }
+  }, [reportType]);
+
   const fetchData = async () => {
     try {
       setLoading(true);
@@ -47,55 +54,50 @@ export default function Reports() {
     }
   };
 
-  const exportToCSV = (data, filename) => {
-    const csvContent = [
-      Object.keys(data[0]).join(','),
-      ...data.map((row) => Object.values(row).join(',')),
-    ].join('\n');
+  const fetchAnalytics = async () => {
+    try {
+      // Computed and cached server-side over the movements not yet archived
+      const [durationsRes, onTimeRes, borrowersRes] = await Promise.all([
+        axios.get(`${API}/reports/loan-durations`),
+        axios.get(`${API}/reports/on-time`),
+        axios.get(`${API}/reports/borrowers`, { params: { limit: 10 } }),
+      ]);
+      setAnalytics({
+        durations: durationsRes.data,
+        onTime: onTimeRes.data,
+        borrowers: borrowersRes.data,
+      });
+    } catch (error) {
+      toast.error('Falha ao carregar indicadores');
+      console.error(error);
+    }
+  };
 
-    const blob = new Blob([csvContent], { type: 'text/csv' });
-    const url = window.URL.createObjectURL(blob);
+  const downloadExport = (report) => {
+    // Streamed by the backend, so the browser never holds the whole report.
+    // The server names the file and formats dates in the browser's time zone.
+    const params = new URLSearchParams({
+      format: 'csv',
+      tz: Intl.DateTimeFormat().resolvedOptions().timeZone,
+    });
     const link = document.createElement('a');
-    link.href = url;
-    link.download = filename;
+    link.href = `${API}/export/${report}?${params}`;
     link.click();
-    window.URL.revokeObjectURL(url);
   };
 
   const handleExportOverdue = () => {
-    const data = overdueEquipment.map((item) => ({
-      nome: item.name,
-      modelo: item.model,
-      responsavel: item.current_borrower,
-      email: item.current_borrower_email || 'N/A',
-      prazo_devolucao: new Date(item.expected_return_date).toLocaleDateString('pt-BR'),
-    }));
-    exportToCSV(data, 'equipamentos-atrasados.csv');
-    toast.success('Relatório exportado com sucesso');
+    downloadExport('overdue');
+    toast.success('Exportação iniciada');
   };
 
   const handleExportAllEquipment = () => {
-    const data = equipment.map((item) => ({
-      nome: item.name,
-      modelo: item.model,
-      numero_serie: item.serial_number || 'N/A',
-      status: item.status,
-      responsavel_atual: item.current_borrower || 'N/A',
-    }));
-    exportToCSV(data, 'todos-equipamentos.csv');
-    toast.success('Relatório exportado com sucesso');
+    downloadExport('equipment');
+    toast.success('Exportação iniciada');
   };
 
   const handleExportMovements = () => {
-    const data = movements.map((mov) => ({
-      equipamento: mov.equipment_name,
-      tipo: mov.movement_type === 'check_out' ? 'Empréstimo' : 'Devolução',
-      responsavel: mov.borrower_name,
-      email: mov.borrower_email,
-      data_hora: new Date(mov.timestamp).toLocaleString('pt-BR'),
-    }));
-    exportToCSV(data, 'historico-movimentacoes.csv');
-    toast.success('Relatório exportado com sucesso');
+    downloadExport('movements');
+    toast.success('Exportação iniciada');
   };
 
   if (loading) {
@@ -188,6 +190,7 @@ export default function Reports() {
                 <SelectItem value="overdue">Equipamentos Atrasados</SelectItem>
                 <SelectItem value="current_loans">Empréstimos Atuais</SelectItem>
                 <SelectItem value="available">Equipamentos Disponíveis</SelectItem>
+                <SelectItem value="analytics">Indicadores de Empréstimo</SelectItem>
               </SelectContent>
             </Select>
           </div>
@@ -367,6 +370,90 @@ export default function Reports() {
         </Card>
       )}
 
+      {reportType === 'analytics' && (
+        <Card className="border border-slate-200 rounded-xl" data-testid="analytics-report">
+          <CardHeader>
+            <CardTitle>Indicadores de Empréstimo</CardTitle>
+          </CardHeader>
+          <CardContent>
+            {!analytics ? (
+              <p className="text-slate-500 text-center py-8">Carregando indicadores...</p>
+            ) : (
+              <div className="space-y-8">
+                <div className="grid grid-cols-1 md:grid-cols-4 gap-4">
+                  <div>
+                    <p className="text-sm text-slate-600">Empréstimos concluídos</p>
+                    <p className="text-2xl font-bold text-slate-900">{analytics.durations.loans}</p>
+                  </div>
+                  <div>
+                    <p className="text-sm text-slate-600">Devoluções no prazo</p>
+                    <p className="text-2xl font-bold text-slate-900">
+                      {analytics.onTime.rate === null ? 'N/A' : `${(analytics.onTime.rate * 100).toFixed(1)}%`}
+                    </p>
+                  </div>
+                  <div>
+                    <p className="text-sm text-slate-600">Duração mediana</p>
+                    <p className="text-2xl font-bold text-slate-900">
+                      {analytics.durations.p50_days === null ? 'N/A' : `${analytics.durations.p50_days} dias`}
+                    </p>
+                  </div>
+                  <div>
+                    <p className="text-sm text-slate-600">Duração (p90)</p>
+                    <p className="text-2xl font-bold text-slate-900">
+                      {analytics.durations.p90_days === null ? 'N/A' : `${analytics.durations.p90_days} dias`}
+                    </p>
+                  </div>
+                </div>
+
+                <div className="overflow-x-auto">
+                  <table className="w-full">
+                    <thead>
+                      <tr className="bg-slate-50 text-slate-500 uppercase text-xs font-bold tracking-wider">
+                        <th className="px-4 py-3 text-left">Duração (dias)</th>
+                        <th className="px-4 py-3 text-left">Empréstimos</th>
+                      </tr>
+                    </thead>
+                    <tbody>
+                      {analytics.durations.histogram.map((bucket) => (
+                        <tr key={bucket.bucket_days} className="border-t border-slate-200">
+                          <td className="px-4 py-3 text-slate-900">{bucket.bucket_days}</td>
+                          <td className="px-4 py-3 text-slate-600">{bucket.loans}</td>
+                        </tr>
+                      ))}
+                    </tbody>
+                  </table>
+                </div>
+
+                <div className="overflow-x-auto">
+                  <table className="w-full">
+                    <thead>
+                      <tr className="bg-slate-50 text-slate-500 uppercase text-xs font-bold tracking-wider">
+                        <th className="px-4 py-3 text-left">Responsável</th>
+                        <th className="px-4 py-3 text-left">E-mail</th>
+                        <th className="px-4 py-3 text-left">Empréstimos</th>
+                        <th className="px-4 py-3 text-left">Dias</th>
+                        <th className="px-4 py-3 text-left">Atrasos</th>
+                      </tr>
+                    </thead>
+                    <tbody>
+                      {analytics.borrowers.map((borrower) => (
+                        <tr key={borrower.borrower_email} className="border-t border-slate-200 hover:bg-slate-50 transition-colors">
+                          <td className="px-4 py-3 font-medium text-slate-900">{borrower.borrower_name}</td>
+                          <td className="px-4 py-3 text-slate-600 text-sm">{borrower.borrower_email}</td>
+                          <td className="px-4 py-3 text-slate-900">{borrower.loans}</td>
+                          <td className="px-4 py-3 text-slate-600">{borrower.total_days}</td>
+                          <td className="px-4 py-3 text-slate-600">{borrower.late_returns}</td>
+                        </tr>
+                      ))}
+                    </tbody>
+                  </table>
+                </div>
+              </div>
+            )}
+          </CardContent>
+        </Card>
+      )}
+
       {/* Export All Options */}
       <Card className="border border-slate-200 rounded-xl mt-8" data-testid="export-all-card">
         <CardHeader>
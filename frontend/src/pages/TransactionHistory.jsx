@@ -15,6 +15,7 @@ import { ArrowUpRight, ArrowDownRight, Calendar } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 100;
 
 export default function TransactionHistory() {
   const [movements, setMovements] = useState([]);
@@ -22,21 +23,29 @@ export default function TransactionHistory() {
   const [typeFilter, setTypeFilter] = useState('All');
   const [startDate, setStartDate] = useState('');
   const [endDate, setEndDate] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchMovements();
   }, []);
 
+  const buildParams = (cursor) => {
+    // The full history page keeps paging into archived movements
+    const params = { limit: PAGE_SIZE, history: true };
+    if (typeFilter !== 'All') params.movement_type = typeFilter;
+    if (startDate) params.start_date = startDate;
+    if (endDate) params.end_date = endDate;
+    if (cursor) params.cursor = cursor;
+    return params;
+  };
+
   const fetchMovements = async () => {
     try {
       setLoading(true);
-      const params = {};
-      if (typeFilter !== 'All') params.movement_type = typeFilter;
-      if (startDate) params.start_date = startDate;
-      if (endDate) params.end_date = endDate;
-
-      const response = await axios.get(`${API}/movements`, { params });
+      const response = await axios.get(`${API}/movements`, { params: buildParams() });
       setMovements(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Falha ao carregar histórico de movimentações');
       console.error(error);
@@ -45,6 +54,20 @@ export default function TransactionHistory() {
     }
   };
 
+  const fetchMoreMovements = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await axios.get(`${API}/movements`, { params: buildParams(nextCursor) });
+      setMovements((current) => [...current, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Falha ao carregar histórico de movimentações');
+      console.error(error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleFilter = () => {
     fetchMovements();
   };
@@ -108,7 +131,7 @@ export default function TransactionHistory() {
       ) : (
         <Card className="border border-slate-200 rounded-xl">
           <CardHeader>
-            <CardTitle>Todas as Movimentações ({movements.length})</CardTitle>
+            <CardTitle>Todas as Movimentações ({movements.length}{nextCursor ? '+' : ''})</CardTitle>
           </CardHeader>
           <CardContent>
             <div className="space-y-3">
@@ -183,6 +206,18 @@ export default function TransactionHistory() {
                 </div>
               ))}
             </div>
+            {nextCursor && (
+              <div className="mt-6 flex justify-center">
+                <Button
+                  variant="outline"
+                  onClick={fetchMoreMovements}
+                  disabled={loadingMore}
+                  data-testid="load-more-btn"
+                >
+                  {loadingMore ? 'Carregando...' : 'Carregar mais'}
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       )}
@@ -0,0 +1,39 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py connects lazily; the tests swap in mongomock before any request
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test_database"]
+
+
+@pytest.fixture
+async def api(db, monkeypatch, tmp_path):
+    """An HTTP client for the app, backed by ``db`` instead of a real server"""
+    import httpx
+    import server
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server.overdue_monitor, "db", db)
+    monkeypatch.setattr(server, "_supports_transactions", False)
+    monkeypatch.setattr(server, "UPLOADS_DIR", tmp_path)
+    server.invalidate_read_caches()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+        yield client
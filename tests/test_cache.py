@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from cache import ReadCache, SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Loader:
+    """Counts calls and blocks each one until ``release`` is set"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return call
+
+
+async def test_concurrent_runs_share_one_load():
+    flights, loader = SingleFlight(), Loader()
+    callers = [asyncio.ensure_future(flights.run("key", loader)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert "key" in flights
+    loader.release.set()
+    assert await asyncio.gather(*callers) == [1] * 5
+    assert loader.calls == 1
+    assert "key" not in flights
+
+
+async def test_cancelled_caller_does_not_cancel_the_load():
+    flights, loader = SingleFlight(), Loader()
+    leaving = asyncio.ensure_future(flights.run("key", loader))
+    staying = asyncio.ensure_future(flights.run("key", loader))
+    await asyncio.sleep(0)
+    leaving.cancel()
+    await asyncio.sleep(0)
+    loader.release.set()
+    assert await staying == 1
+    assert leaving.cancelled()
+    assert loader.calls == 1
+
+
+async def test_load_survives_when_every_caller_leaves():
+    flights, loader = SingleFlight(), Loader()
+    caller = asyncio.ensure_future(flights.run("key", loader))
+    await asyncio.sleep(0)
+    caller.cancel()
+    await asyncio.sleep(0)
+    assert "key" in flights
+    loader.release.set()
+    assert await flights.run("key", loader) == 1
+    assert loader.calls == 1
+
+
+async def test_failures_reach_every_caller_and_are_not_kept():
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(*(flights.run("key", failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert "key" not in flights
+
+
+async def test_invalidate_during_load_does_not_store_the_result():
+    cache, loader = ReadCache(ttl_seconds=60), Loader()
+    first = asyncio.ensure_future(cache.get_or_load("key", loader))
+    while not loader.calls:
+        await asyncio.sleep(0)
+    cache.invalidate()
+    second = asyncio.ensure_future(cache.get_or_load("key", loader))
+    while loader.calls < 2:
+        await asyncio.sleep(0)
+    loader.release.set()
+    assert await first == 1
+    assert await second == 2
+    assert await cache.get_or_load("key", loader) == 2
+    assert loader.calls == 2
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import changes
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+async def _insert(db, *rows):
+    """``(seq, collection, record_id, op, seconds ago)`` rows"""
+    await db.changes.insert_many([
+        {"seq": seq, "collection": collection, "record_id": record_id, "op": op, "at": NOW - timedelta(seconds=age)}
+        for seq, collection, record_id, op, age in rows
+    ])
+
+
+def _seqs(entries):
+    return [entry["seq"] for entry in entries]
+
+
+async def test_record_allocates_consecutive_sequence_numbers(db):
+    await changes.record(db, [("equipment", "a", "created"), ("movements", "m", "created")])
+    await changes.record(db, [("equipment", "a", "updated")])
+    entries, next_since, _, has_more = await changes.read_since(db, 0, None, 10, datetime.now(timezone.utc))
+    assert [(e["seq"], e["record_id"], e["op"]) for e in entries] == [(2, "m", "created"), (3, "a", "updated")]
+    assert (next_since, has_more) == (3, False)
+    assert await changes.latest(db) == 3
+
+
+async def test_stops_at_a_young_gap(db):
+    await _insert(db, (1, "equipment", "a", "created", 60), (3, "equipment", "b", "created", 1))
+    entries, next_since, next_since_at, has_more = await changes.read_since(db, 0, None, 10, NOW)
+    assert _seqs(entries) == [1]
+    assert (next_since, next_since_at, has_more) == (1, NOW - timedelta(seconds=60), True)
+
+    # The slow writer lands; the next read picks up from the same place
+    await _insert(db, (2, "equipment", "c", "created", 1))
+    entries, next_since, _, has_more = await changes.read_since(db, next_since, None, 10, NOW)
+    assert _seqs(entries) == [2, 3]
+    assert (next_since, has_more) == (3, False)
+
+
+async def test_steps_over_an_old_gap(db):
+    await _insert(db, (1, "equipment", "a", "created", 60), (3, "equipment", "b", "created", 30))
+    entries, next_since, _, has_more = await changes.read_since(db, 0, None, 10, NOW)
+    assert _seqs(entries) == [1, 3]
+    assert (next_since, has_more) == (3, False)
+
+
+async def test_gap_before_the_first_row_is_waited_on(db):
+    await _insert(db, (2, "equipment", "a", "created", 1))
+    entries, next_since, next_since_at, has_more = await changes.read_since(db, 0, None, 10, NOW)
+    assert (entries, next_since, next_since_at, has_more) == ([], 0, None, True)
+
+
+async def test_filtered_feed_waits_on_gaps_in_other_collections(db):
+    await _insert(
+        db,
+        (1, "movements", "m", "created", 60),
+        (3, "equipment", "a", "updated", 1),
+    )
+    entries, next_since, _, has_more = await changes.read_since(db, 0, ["equipment"], 10, NOW)
+    assert entries == []
+    assert (next_since, has_more) == (1, True)
+
+
+async def test_filtered_feed_advances_past_other_collections(db):
+    await _insert(db, (1, "movements", "m", "created", 1), (2, "equipment", "a", "updated", 1))
+    entries, next_since, _, _ = await changes.read_since(db, 0, ["equipment"], 10, NOW)
+    assert [(e["collection"], e["seq"]) for e in entries] == [("equipment", 2)]
+    assert next_since == 2
+
+
+async def test_compacts_to_the_last_entry_per_record(db):
+    await _insert(
+        db,
+        (1, "equipment", "a", "created", 5),
+        (2, "equipment", "b", "created", 5),
+        (3, "equipment", "a", "updated", 5),
+        (4, "movements", "a", "created", 5),
+        (5, "equipment", "b", "deleted", 5),
+    )
+    entries, next_since, _, has_more = await changes.read_since(db, 0, None, 10, NOW)
+    assert [(e["seq"], e["op"]) for e in entries] == [(3, "updated"), (4, "created"), (5, "deleted")]
+    assert (next_since, has_more) == (5, False)
+
+
+async def test_limit_reports_more(db):
+    await _insert(db, *[(seq, "equipment", str(seq), "created", 5) for seq in range(1, 6)])
+    entries, next_since, _, has_more = await changes.read_since(db, 0, None, 3, NOW)
+    assert _seqs(entries) == [1, 2, 3]
+    assert (next_since, has_more) == (3, True)
+    entries, next_since, _, has_more = await changes.read_since(db, next_since, None, 3, NOW)
+    assert _seqs(entries) == [4, 5]
+    assert (next_since, has_more) == (5, False)
@@ -0,0 +1,135 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+import storage
+from migrations import backfill_blob_refs, dedupe_uploads
+
+pytestmark = pytest.mark.anyio
+
+PDF = b"%PDF-1.4\n%%EOF\n"
+OTHER_PDF = b"%PDF-1.4\n% other\n%%EOF\n"
+
+
+async def _upload(api, content=PDF, equipment_id="eq-1"):
+    response = await api.post(
+        "/documents/upload",
+        data={"equipment_id": equipment_id},
+        files={"file": ("termo.pdf", content, "application/pdf")},
+    )
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+async def test_identical_uploads_share_one_counted_blob(api, db, tmp_path):
+    first = await _upload(api)
+    second = await _upload(api)
+    blob = tmp_path / f"{hashlib.sha256(PDF).hexdigest()}.pdf"
+    assert [p.name for p in tmp_path.iterdir()] == [blob.name]
+    assert await db.blobs.find_one({"_id": str(blob)}) == {"_id": str(blob), "refs": 2}
+
+    assert (await api.delete(f"/documents/{first}")).status_code == 200
+    assert blob.exists()
+    assert (await db.blobs.find_one({"_id": str(blob)}))["refs"] == 1
+
+    assert (await api.delete(f"/documents/{second}")).status_code == 200
+    assert not blob.exists()
+    assert await db.blobs.find_one({"_id": str(blob)}) is None
+    assert (await api.delete(f"/documents/{second}")).status_code == 404
+
+
+async def test_release_keeps_file_retained_meanwhile(db, tmp_path, monkeypatch):
+    blob = tmp_path / "blob.pdf"
+    blob.write_bytes(PDF)
+    await storage.retain_blob(db, str(blob))
+    rename = storage.aiofiles.os.rename
+
+    async def rename_then_upload(source, target):
+        await rename(source, target)
+        # An identical upload retains the blob while the file is set aside
+        await storage.retain_blob(db, str(blob))
+
+    monkeypatch.setattr(storage.aiofiles.os, "rename", rename_then_upload)
+    assert await storage.release_blob(db, str(blob)) is False
+    assert blob.read_bytes() == PDF
+    assert (await db.blobs.find_one({"_id": str(blob)}))["refs"] == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["blob.pdf"]
+
+
+async def test_release_without_record_keeps_file(db, tmp_path):
+    blob = tmp_path / "legacy.pdf"
+    blob.write_bytes(PDF)
+    assert await storage.release_blob(db, str(blob)) is False
+    assert blob.exists()
+
+
+async def test_backfill_counts_existing_documents_once(db):
+    await db.documents.insert_many([
+        {"id": "a", "file_path": "/uploads/x.pdf"},
+        {"id": "b", "file_path": "/uploads/x.pdf"},
+        {"id": "c", "file_path": "/uploads/y.pdf"},
+    ])
+    await backfill_blob_refs(db)
+    await storage.retain_blob(db, "/uploads/x.pdf")
+    await backfill_blob_refs(db)
+    refs = {blob["_id"]: blob["refs"] async for blob in db.blobs.find()}
+    assert refs == {"/uploads/x.pdf": 3, "/uploads/y.pdf": 1}
+
+
+async def _legacy_documents(db, uploads: Path):
+    for name, content in [("uuid-1.pdf", PDF), ("uuid-2.pdf", PDF), ("uuid-3.pdf", OTHER_PDF)]:
+        (uploads / name).write_bytes(content)
+        await db.documents.insert_one({"id": name, "file_path": str(uploads / name), "filename": name})
+    (uploads / "orphan.pdf").write_bytes(OTHER_PDF)
+    await backfill_blob_refs(db)
+
+
+async def _state(db, uploads: Path):
+    documents = {doc["id"]: Path(doc["file_path"]).name async for doc in db.documents.find()}
+    refs = {Path(blob["_id"]).name: blob["refs"] async for blob in db.blobs.find()}
+    return documents, refs, sorted(p.name for p in uploads.iterdir())
+
+
+async def test_dedupe_uploads_is_repeatable(db, tmp_path):
+    await _legacy_documents(db, tmp_path)
+    pdf_blob = f"{hashlib.sha256(PDF).hexdigest()}.pdf"
+    other_blob = f"{hashlib.sha256(OTHER_PDF).hexdigest()}.pdf"
+
+    await dedupe_uploads(db, tmp_path)
+    state = await _state(db, tmp_path)
+    assert state == (
+        {"uuid-1.pdf": pdf_blob, "uuid-2.pdf": pdf_blob, "uuid-3.pdf": other_blob},
+        {pdf_blob: 2, other_blob: 1},
+        sorted([pdf_blob, other_blob]),
+    )
+
+    await dedupe_uploads(db, tmp_path)
+    assert await _state(db, tmp_path) == state
+
+
+async def test_dedupe_uploads_resumes_after_interruption(db, tmp_path, monkeypatch):
+    await _legacy_documents(db, tmp_path)
+    collection_class = type(db.documents)
+    update_one = collection_class.update_one
+    calls = 0
+
+    async def crash_on_second_update(self, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("interrupted")
+        return await update_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "update_one", crash_on_second_update)
+    with pytest.raises(RuntimeError):
+        await dedupe_uploads(db, tmp_path)
+    # Nothing was deleted yet: every document still has its file
+    async for doc in db.documents.find():
+        assert Path(doc["file_path"]).read_bytes()
+
+    monkeypatch.setattr(collection_class, "update_one", update_one)
+    await dedupe_uploads(db, tmp_path)
+    documents, refs, files = await _state(db, tmp_path)
+    assert set(documents.values()) == set(refs) == set(files)
+    assert sum(refs.values()) == 3
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+CSV = (
+    "name,model,serial_number,status\n"
+    "Notebook 1,Latitude 5440,,\n"
+    "Notebook 2,ThinkPad T14,SN2,Maintenance\n"
+    ",Missing name,,\n"
+)
+
+
+async def test_csv_import_blank_optional_columns(api, db):
+    response = await api.post(
+        "/equipment/bulk", files={"file": ("equipment.csv", CSV.encode(), "text/csv")}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 2
+    assert body["failed"] == 1
+    assert body["errors"][0]["row"] == 4
+    assert body["errors"][0]["error"].startswith("name:")
+
+    first = await db.equipment.find_one({"name": "Notebook 1"})
+    assert first["status"] == "Available"
+    assert first["serial_number"] is None
+    second = await db.equipment.find_one({"name": "Notebook 2"})
+    assert second["status"] == "Maintenance"
+    assert second["serial_number"] == "SN2"
+
+
+async def test_ndjson_import_builds_batches_off_the_event_loop(api, db, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_BATCH_SIZE", 2)
+    search_fields = server.equipment_search.search_fields
+    threads = set()
+
+    def recording_search_fields(doc):
+        threads.add(threading.current_thread())
+        return search_fields(doc)
+
+    monkeypatch.setattr(server.equipment_search, "search_fields", recording_search_fields)
+    lines = [f'{{"name": "Item {n}", "model": "M"}}' for n in range(5)]
+    lines[1] = "not json"
+    lines[3] = '{"model": "no name"}'
+    response = await api.post(
+        "/equipment/bulk", files={"file": ("equipment.ndjson", "\n".join(lines).encode(), "application/x-ndjson")}
+    )
+    body = response.json()
+    assert (body["inserted"], body["failed"]) == (3, 2)
+    assert [error["row"] for error in body["errors"]] == [2, 4]
+    assert sorted([doc["name"] async for doc in db.equipment.find()]) == ["Item 0", "Item 2", "Item 4"]
+    assert threads and threading.main_thread() not in threads
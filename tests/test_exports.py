@@ -0,0 +1,61 @@
+import csv
+import io
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def _csv(response):
+    assert response.status_code == 200
+    return list(csv.reader(io.StringIO(response.text)))
+
+
+@pytest.fixture
+async def exported(db):
+    await db.equipment.insert_many([
+        server.Equipment(id="eq-1", name="Notebook 1", model="Latitude", serial_number="SN-1").model_dump(),
+        server.Equipment(
+            id="eq-2", name="Tablet 1", model="iPad", status="On Loan", current_borrower="Ana",
+            expected_return_date=datetime(2024, 5, 2, 1, 0, tzinfo=timezone.utc),
+        ).model_dump(),
+    ])
+    await db.movements.insert_one(server.Movement(
+        id="mv-1", equipment_id="eq-2", equipment_name="Tablet 1", movement_type="check_out",
+        borrower_name="Ana", borrower_email="ana@example.com",
+        timestamp=datetime(2024, 5, 1, 1, 30, tzinfo=timezone.utc),
+    ).model_dump())
+
+
+async def test_equipment_csv_keeps_the_spreadsheet_columns(api, exported):
+    response = await api.get("/export/equipment")
+    assert response.headers["content-disposition"] == 'attachment; filename="todos-equipamentos.csv"'
+    assert _csv(response) == [
+        ["nome", "modelo", "numero_serie", "status", "responsavel_atual"],
+        ["Notebook 1", "Latitude", "SN-1", "Available", "N/A"],
+        ["Tablet 1", "iPad", "N/A", "On Loan", "Ana"],
+    ]
+
+
+async def test_dates_follow_the_requested_time_zone(api, exported):
+    rows = _csv(await api.get("/export/movements", params={"tz": "America/Sao_Paulo"}))
+    assert rows == [
+        ["equipamento", "tipo", "responsavel", "email", "data_hora"],
+        ["Tablet 1", "Empréstimo", "Ana", "ana@example.com", "30/04/2024, 22:30:00"],
+    ]
+    response = await api.get("/export/overdue")
+    assert response.headers["content-disposition"] == 'attachment; filename="equipamentos-atrasados.csv"'
+    assert _csv(response)[1] == ["Tablet 1", "iPad", "Ana", "N/A", "02/05/2024"]
+    assert (await api.get("/export/overdue", params={"tz": "Mars/Olympus"})).status_code == 400
+
+
+async def test_ndjson_carries_the_raw_fields(api, exported):
+    response = await api.get("/export/movements", params={"format": "ndjson"})
+    assert response.headers["content-disposition"] == 'attachment; filename="historico-movimentacoes.ndjson"'
+    (row,) = [orjson.loads(line) for line in response.text.splitlines()]
+    assert list(row) == server.MOVEMENT_EXPORT_FIELDS
+    assert (row["movement_type"], row["timestamp"]) == ("check_out", "2024-05-01T01:30:00+00:00")
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import migrations
+
+pytestmark = pytest.mark.anyio
+
+FIELDS = ["timestamp", "expected_return_date"]
+CONVERTED = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+
+async def _legacy_movements(db, count):
+    await db.movements.insert_many([
+        {"_id": n, "timestamp": "2024-05-01T12:30:00", "expected_return_date": None}
+        for n in range(1, count + 1)
+    ])
+
+
+async def _timestamps(db):
+    return {doc["_id"]: doc["timestamp"] async for doc in db.movements.find()}
+
+
+async def test_converts_strings_and_marks_done(db, caplog):
+    await db.movements.insert_many([
+        {"_id": 1, "timestamp": "2024-05-01T12:30:00+00:00", "expected_return_date": "2024-05-08T00:00:00"},
+        {"_id": 2, "timestamp": CONVERTED, "expected_return_date": None},
+        {"_id": 3, "timestamp": "yesterday", "expected_return_date": "2024-05-08T00:00:00Z"},
+    ])
+    assert await migrations._migrate_collection_dates(db, "movements", FIELDS) == 2
+
+    docs = {doc["_id"]: doc async for doc in db.movements.find()}
+    assert docs[1] == {"_id": 1, "timestamp": CONVERTED, "expected_return_date": datetime(2024, 5, 8, tzinfo=timezone.utc)}
+    assert docs[2]["timestamp"] == CONVERTED
+    # The unparseable value is left alone (and logged); the rest of the document is converted
+    assert docs[3]["timestamp"] == "yesterday"
+    assert docs[3]["expected_return_date"] == datetime(2024, 5, 8, tzinfo=timezone.utc)
+    assert "Unparseable movements.timestamp on 3" in caplog.text
+    assert (await db.migrations.find_one({"_id": "dates_v1:movements"}))["done"] is True
+
+
+async def test_done_migration_is_not_run_again(db):
+    await _legacy_movements(db, 1)
+    await migrations._migrate_collection_dates(db, "movements", FIELDS)
+    await db.movements.insert_one({"_id": 9, "timestamp": "2024-05-01T12:30:00"})
+    assert await migrations._migrate_collection_dates(db, "movements", FIELDS) == 0
+    assert (await _timestamps(db))[9] == "2024-05-01T12:30:00"
+
+
+async def test_resumes_after_the_checkpoint(db, monkeypatch):
+    monkeypatch.setattr(migrations, "BATCH_SIZE", 2)
+    await _legacy_movements(db, 5)
+    collection_class = type(db.movements)
+    bulk_write = collection_class.bulk_write
+    calls = 0
+
+    async def crash_on_second_batch(self, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("interrupted")
+        return await bulk_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "bulk_write", crash_on_second_batch)
+    with pytest.raises(RuntimeError):
+        await migrations._migrate_collection_dates(db, "movements", FIELDS)
+    checkpoint = await db.migrations.find_one({"_id": "dates_v1:movements"})
+    assert checkpoint == {"_id": "dates_v1:movements", "last_id": 2}
+    assert [isinstance(value, datetime) for value in (await _timestamps(db)).values()] == [True, True, False, False, False]
+
+    monkeypatch.setattr(collection_class, "bulk_write", bulk_write)
+    # Only the documents after the checkpoint are read again
+    assert await migrations._migrate_collection_dates(db, "movements", FIELDS) == 3
+    assert set((await _timestamps(db)).values()) == {CONVERTED}
+    assert (await db.migrations.find_one({"_id": "dates_v1:movements"}))["done"] is True
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+CREATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+BORROWER = {"borrower_name": "Ana", "borrower_email": "ana@example.com"}
+
+
+@pytest.fixture
+async def items(db):
+    docs = [
+        server.Equipment(id=f"kit-{n}", name=f"Kit item {n}", model="Model", created_at=CREATED_AT, updated_at=CREATED_AT).model_dump()
+        for n in range(3)
+    ]
+    await db.equipment.insert_many(docs)
+    return [doc["id"] for doc in docs]
+
+
+@pytest.fixture
+def events(monkeypatch):
+    published = []
+    monkeypatch.setattr(server, "publish_event", lambda event_type, data: published.append((event_type, data)))
+    return published
+
+
+def _check_out(ids):
+    return {"movements": [{"equipment_id": i, "movement_type": "check_out", **BORROWER} for i in ids]}
+
+
+async def _assert_untouched(db, ids):
+    for doc in await db.equipment.find({"id": {"$in": ids}}).to_list(None):
+        assert doc["status"] == "Available"
+        assert doc["current_borrower"] is None
+        assert doc["updated_at"] == CREATED_AT
+    assert await db.movements.count_documents({}) == 0
+
+
+async def test_batch_checks_out_every_item(api, db, items, events):
+    response = await api.post("/movements/batch", json=_check_out(items))
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert await db.equipment.count_documents({"status": "On Loan", "current_borrower": "Ana"}) == 3
+    assert await db.movements.count_documents({}) == 3
+
+    updated = [data for event_type, data in events if event_type == "equipment.updated"]
+    assert sorted(data["id"] for data in updated) == items
+    assert all(data["status"] == "On Loan" and data["name"].startswith("Kit item") for data in updated)
+    assert sum(event_type == "movement.created" for event_type, _ in events) == 3
+
+
+async def test_batch_rejects_unavailable_item_up_front(api, db, items, events):
+    await db.equipment.update_one({"id": items[1]}, {"$set": {"status": "Maintenance"}})
+    response = await api.post("/movements/batch", json=_check_out(items))
+    assert response.status_code == 409
+    assert items[1] in response.json()["detail"]
+    assert await db.equipment.count_documents({"status": "On Loan"}) == 0
+    assert events == []
+
+
+async def test_concurrent_change_rolls_back_batch(api, db, items, events, monkeypatch):
+    async def supports_transactions():
+        # Another request takes one item between the status check and the update
+        await db.equipment.update_one({"id": items[2]}, {"$set": {"status": "Maintenance"}})
+        return False
+    monkeypatch.setattr(server, "supports_transactions", supports_transactions)
+
+    response = await api.post("/movements/batch", json=_check_out(items))
+    assert response.status_code == 409
+    await _assert_untouched(db, items[:2])
+    assert events == []
+
+
+async def test_failure_after_updates_rolls_back_and_propagates(api, db, items, events, monkeypatch):
+    async def failing_apply_updates(db, updates, session=None):
+        raise RuntimeError("equipment_stats unavailable")
+    monkeypatch.setattr(server.loan_stats, "apply_updates", failing_apply_updates)
+
+    with pytest.raises(RuntimeError):
+        await api.post("/movements/batch", json=_check_out(items))
+    await _assert_untouched(db, items)
+    assert events == []
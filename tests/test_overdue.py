@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from overdue import OverdueMonitor
+
+pytestmark = pytest.mark.anyio
+
+PROJECTION = {"_id": 0, "id": 1, "name": 1, "model": 1, "current_borrower": 1,
+              "current_borrower_email": 1, "expected_return_date": 1}
+
+
+def overdue_filter():
+    return {"status": "On Loan", "expected_return_date": {"$lt": datetime.now(timezone.utc)}}
+
+
+def _item(n, days_late):
+    return {
+        "id": f"eq-{n}", "name": f"Notebook {n}", "model": "Latitude", "status": "On Loan",
+        "current_borrower": "Ana", "current_borrower_email": "ana@example.com",
+        "expected_return_date": datetime.now(timezone.utc) - timedelta(days=days_late),
+    }
+
+
+async def _next_refresh(monitor, computed_at):
+    for _ in range(200):
+        if monitor.computed_at != computed_at:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("no background refresh")
+
+
+@pytest.fixture
+async def monitor(db):
+    changes = []
+    monitor = OverdueMonitor(db, overdue_filter, PROJECTION, on_change=changes.append)
+    monitor.changes = changes
+    yield monitor
+    await monitor.stop()
+
+
+async def test_snapshot_persisted_one_document_per_item(db, monitor):
+    await db.equipment.insert_many([_item(1, 3), _item(2, 10), _item(3, -5)])
+    await db.overdue_snapshot.insert_one({"id": "current", "equipment": [], "details": [],
+                                          "computed_at": datetime(2024, 1, 1, tzinfo=timezone.utc)})
+    monitor.start()
+    equipment, details = await monitor.snapshot()
+
+    assert [e["id"] for e in equipment] == ["eq-2", "eq-1"]
+    assert [(row["id"], row["days_overdue"]) for row in details] == [("eq-2", 10), ("eq-1", 3)]
+    stored = {doc["_id"]: doc async for doc in db.overdue_snapshot.find()}
+    assert set(stored) == {"eq-1", "eq-2"}
+    assert stored["eq-1"]["details"]["days_overdue"] == 3
+    assert stored["eq-1"]["equipment"]["name"] == "Notebook 1"
+
+
+async def test_writes_refresh_in_the_background_only(db, monitor):
+    await db.equipment.insert_many([_item(1, 3), _item(2, 10)])
+    monitor.start()
+    await monitor.snapshot()
+    computed_at = monitor.computed_at
+
+    await db.equipment.update_one({"id": "eq-2"}, {"$set": {"status": "Available"}})
+    await db.equipment.insert_one(_item(4, 1))
+    monitor.invalidate()
+    # Reads never query: until the task runs they get the previous list
+    equipment, _ = await monitor.snapshot()
+    assert [e["id"] for e in equipment] == ["eq-2", "eq-1"]
+
+    await _next_refresh(monitor, computed_at)
+    equipment, _ = await monitor.snapshot()
+    assert [e["id"] for e in equipment] == ["eq-1", "eq-4"]
+    assert {doc["_id"] async for doc in db.overdue_snapshot.find()} == {"eq-1", "eq-4"}
+    assert [[row["id"] for row in details] for details in monitor.changes] == [["eq-1", "eq-4"]]
+
+
+async def test_unchanged_rows_are_not_rewritten(db, monitor):
+    await db.equipment.insert_many([_item(1, 3), _item(2, 10)])
+    await monitor.refresh()
+    first = monitor.computed_at
+    await db.equipment.insert_one(_item(5, 2))
+    # Mongo keeps milliseconds: make sure the second refresh is stamped differently
+    await asyncio.sleep(0.005)
+    await monitor.refresh()
+
+    stored = {doc["_id"]: doc["computed_at"] async for doc in db.overdue_snapshot.find()}
+    assert stored["eq-1"] == stored["eq-2"] != stored["eq-5"]
+    assert abs(stored["eq-1"] - first) < timedelta(milliseconds=1)
+
+
+async def test_snapshot_does_not_wait_forever_for_the_first_refresh(db, monitor, monkeypatch):
+    monkeypatch.setattr("overdue.READY_WAIT_SECONDS", 0.05)
+    await db.equipment.insert_many([_item(1, 3), _item(2, 10)])
+    # No refresh has finished (the task is not even running): one direct query answers
+    equipment, details = await monitor.snapshot()
+    assert [e["id"] for e in equipment] == ["eq-2", "eq-1"]
+    assert [row["days_overdue"] for row in details] == [10, 3]
+    assert monitor.computed_at is None
+
+
+async def test_failed_persist_still_serves_and_rewrites_later(db, monitor, monkeypatch):
+    await db.equipment.insert_many([_item(1, 3), _item(2, 10)])
+    await db.overdue_snapshot.insert_one({"_id": "stale", "computed_at": datetime(2024, 1, 1, tzinfo=timezone.utc)})
+    collection_class = type(db.overdue_snapshot)
+    bulk_write = collection_class.bulk_write
+
+    async def failing_bulk_write(self, *args, **kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(collection_class, "bulk_write", failing_bulk_write)
+    with pytest.raises(RuntimeError):
+        await monitor.refresh()
+    equipment, _ = await asyncio.wait_for(monitor.snapshot(), timeout=1)
+    assert [e["id"] for e in equipment] == ["eq-2", "eq-1"]
+
+    monkeypatch.setattr(collection_class, "bulk_write", bulk_write)
+    await monitor.refresh()
+    assert {doc["_id"] async for doc in db.overdue_snapshot.find()} == {"eq-1", "eq-2"}
@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+
+def _raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    cursor = server.encode_cursor(timestamp, "mv-1")
+    assert server.decode_cursor(cursor, 2) == [timestamp.isoformat(), "mv-1"]
+    assert server.decode_cursor(server.encode_cursor(42, "x"), 2) == [42, "x"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/equipment", "/movements", "/borrowers"])
+@pytest.mark.parametrize("values", [[{"a": 1}, 2], [["a"], "b"], [True, "b"], [None, "b"], ["a", "b", "c"], "ab"])
+async def test_malformed_cursors_are_rejected(api, path, values):
+    if path == "/borrowers":
+        values = values[:1] if isinstance(values, list) and len(values) == 2 else values
+    response = await api.get(path, params={"cursor": _raw_cursor(values)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import search as equipment_search
+import server
+from replica import EquipmentReplica
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+ITEMS = [
+    ("Notebook 3", "Latitude 5440", "SN-0003", "Available"),
+    ("Notebook 1", "MacBook Air M2", "SN-0001", "On Loan"),
+    ("Projetor 1", "Epson PowerLite X49", None, "Maintenance"),
+    ("Notebook 2", "ThinkPad T14", "SN-0002", "Available"),
+    ("Tablet 1", "iPad 10", "SN-0004", "On Loan"),
+    ("Notebook 2", "Latitude 5440", "SN-0005", "Retired"),
+]
+
+
+def _equipment_docs():
+    docs = []
+    for n, (name, model, serial_number, status) in enumerate(ITEMS):
+        on_loan = status == "On Loan"
+        doc = server.Equipment(
+            id=f"id-{n}", name=name, model=model, serial_number=serial_number, status=status,
+            current_borrower="Ana" if on_loan else None,
+            expected_return_date=NOW - timedelta(days=n) if on_loan else None,
+            created_at=NOW, updated_at=NOW,
+        ).model_dump()
+        doc.update(equipment_search.search_fields(doc))
+        docs.append(doc)
+    return docs
+
+
+@pytest.fixture
+def replica():
+    replica = EquipmentReplica(server.Equipment.model_fields)
+    for doc in _equipment_docs():
+        replica.upsert(doc)
+    return replica
+
+
+def test_page_in_name_order_per_status(replica):
+    assert [doc["id"] for doc in replica.page(None, None, 10)] == ["id-1", "id-3", "id-5", "id-0", "id-2", "id-4"]
+    assert [doc["id"] for doc in replica.page("Available", None, 10)] == ["id-3", "id-0"]
+    assert replica.page("Unknown", None, 10) == []
+
+
+def test_page_resumes_after_key(replica):
+    first = replica.page(None, None, 2)
+    after = (first[-1]["name"], first[-1]["id"])
+    assert [doc["id"] for doc in replica.page(None, after, 2)] == ["id-5", "id-0"]
+
+
+def test_search_matches_every_term(replica):
+    assert [doc["id"] for doc in replica.search(None, ["note", "lat"], 10)] == ["id-5", "id-0"]
+    assert [doc["id"] for doc in replica.search("Available", ["note", "lat"], 10)] == ["id-0"]
+    assert [doc["id"] for doc in replica.search(None, ["note"], 2)] == ["id-1", "id-3"]
+
+
+def test_writes_move_items_between_indexes(replica):
+    replica.update("id-3", {"status": "On Loan"})
+    assert [doc["id"] for doc in replica.page("Available", None, 10)] == ["id-0"]
+    replica.remove("id-0")
+    assert replica.page("Available", None, 10) == []
+    assert replica.status_counts() == {"On Loan": 3, "Maintenance": 1, "Retired": 1}
+
+
+def test_overdue_most_overdue_first(replica):
+    assert [doc["id"] for doc in replica.overdue(NOW)] == ["id-4", "id-1"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("params", [
+    {},
+    {"status": "All"},
+    {"status": "Available"},
+    {"status": "On Loan", "limit": 1},
+    {"limit": 2},
+    {"search": "note"},
+    {"search": "Notebook lat", "status": "All"},
+    {"search": "sn0002"},
+    {"search": "sn00 02"},
+    {"search": "tablet", "status": "On Loan"},
+    {"search": "book"},
+    {"search": "latitude 5440", "limit": 1},
+])
+async def test_replica_answers_like_mongo(api, db, monkeypatch, params):
+    await db.equipment.insert_many(_equipment_docs())
+
+    async def pages(client):
+        results, query = [], dict(params)
+        while True:
+            response = await client.get("/equipment", params=query)
+            assert response.status_code == 200
+            results.append(response.json())
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                return results
+            query["cursor"] = cursor
+
+    from_mongo = await pages(api)
+    replica = EquipmentReplica(server.Equipment.model_fields)
+    await replica.load(db)
+    monkeypatch.setattr(server, "equipment_replica", replica)
+    monkeypatch.setattr(server, "USE_EQUIPMENT_REPLICA", True)
+    from_replica = await pages(api)
+
+    assert from_replica == from_mongo
+    assert any(from_mongo)
+
+
+def test_legacy_string_dates_are_parsed(replica):
+    # Inserted before the background date migration reached them
+    docs = _equipment_docs()
+    replica.upsert({**docs[1], "id": "legacy", "expected_return_date": "2024-05-20T00:00:00"})
+    replica.upsert({**docs[4], "id": "garbled", "expected_return_date": "next week"})
+    assert replica.get("legacy")["expected_return_date"] == datetime(2024, 5, 20, tzinfo=timezone.utc)
+    assert [doc["id"] for doc in replica.overdue(NOW)] == ["legacy", "id-4", "id-1"]
+    replica.remove("garbled")
+    assert replica.get("garbled") is None
@@ -0,0 +1,61 @@
+import pandas as pd
+
+import reports
+
+
+def _movements(rows):
+    return pd.DataFrame({
+        "movement_type": [movement_type for movement_type, _ in rows],
+        "timestamp": pd.to_datetime([timestamp for _, timestamp in rows], utc=True),
+    })
+
+
+def test_weekly_buckets_run_monday_to_sunday():
+    movements = _movements([
+        ("check_out", "2024-06-03T00:00:00Z"),  # Monday
+        ("check_in", "2024-06-09T23:59:00Z"),   # Sunday of the same week
+        ("check_out", "2024-06-10T00:00:00Z"),  # next Monday
+    ])
+    assert reports.checkouts_per_period(movements, "week") == [
+        {"period": "2024-06-03", "check_outs": 1, "check_ins": 1},
+        {"period": "2024-06-10", "check_outs": 1, "check_ins": 0},
+    ]
+
+
+def test_weekly_buckets_fill_empty_weeks():
+    movements = _movements([
+        ("check_out", "2024-06-05T12:00:00Z"),
+        ("check_out", "2024-06-19T12:00:00Z"),
+    ])
+    assert [row["period"] for row in reports.checkouts_per_period(movements, "week")] == [
+        "2024-06-03", "2024-06-10", "2024-06-17",
+    ]
+
+
+def test_on_time_returns_by_week():
+    completed = pd.DataFrame({
+        "returned_at": pd.to_datetime(["2024-06-09T23:59:00Z", "2024-06-10T00:00:00Z"], utc=True),
+        "on_time": [True, False],
+    })
+    result = reports.on_time_returns(completed, "week")
+    assert [(row["period"], row["on_time"]) for row in result["periods"]] == [
+        ("2024-06-03", 1), ("2024-06-10", 0),
+    ]
+
+
+def test_borrower_ranking_merges_email_spellings():
+    movements = pd.DataFrame({
+        "equipment_id": ["eq-1", "eq-1", "eq-2", "eq-3"],
+        "movement_type": ["check_out", "check_in", "check_out", "check_out"],
+        "borrower_name": ["Ana", "Ana", "Ana Souza", "Bia"],
+        "borrower_email": ["A@x.com", "A@x.com", " a@x.com", "b@x.com"],
+        "expected_return_date": pd.to_datetime(["2024-06-02T00:00:00Z", None, None, None], utc=True),
+        "timestamp": pd.to_datetime([
+            "2024-06-01T00:00:00Z", "2024-06-03T00:00:00Z", "2024-06-04T00:00:00Z", "2024-06-05T00:00:00Z",
+        ], utc=True),
+    })
+    ranking = reports.borrower_ranking(movements, reports.loans(movements), 10)
+    assert ranking == [
+        {"borrower_email": "a@x.com", "borrower_name": "Ana Souza", "loans": 2, "total_days": 2.0, "late_returns": 1},
+        {"borrower_email": "b@x.com", "borrower_name": "Bia", "loans": 1, "total_days": 0.0, "late_returns": 0},
+    ]
@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import search as equipment_search
+import server
+
+
+def test_tokens_cover_substrings_of_name_and_model():
+    tokens = set(equipment_search.build_search_tokens("MacBook Pro", "A2338", None))
+    assert {"m", "mac", "macbook", "book", "boo", "ook", "pro", "ro", "a2338", "233"} <= tokens
+    assert "macbookpro" not in tokens
+
+
+def test_tokens_normalize_case_and_accents():
+    tokens = equipment_search.build_search_tokens("Câmera Canon", "EOS R50", None)
+    assert "camera" in tokens and "mera" in tokens and "r50" in tokens
+
+
+def test_serial_matches_compacted_and_partially():
+    tokens = set(equipment_search.build_search_tokens("Tablet", "iPad", "SN-00-42"))
+    assert {"sn0042", "0042", "n00", "42"} <= tokens
+
+
+def test_grams_are_capped():
+    word = "x" * 10 + "abcdefghijklmnopqrstuvwxyz"
+    tokens = equipment_search.build_search_tokens(word, "", None)
+    assert max(len(token) for token in tokens) == equipment_search.MAX_GRAM
+    assert "qrstuvwxyz" in tokens
+
+
+def test_search_words_are_whole_words():
+    assert equipment_search.build_search_words("MacBook Pro", "A2338", "SN-42") == [
+        "42", "a2338", "macbook", "pro", "sn", "sn42",
+    ]
+
+
+def test_search_fields_carry_the_version():
+    fields = equipment_search.search_fields({"name": "Notebook", "model": "Latitude", "serial_number": None})
+    assert fields["search_version"] == equipment_search.SEARCH_TOKENS_VERSION == 2
+    assert "book" in fields["search_tokens"]
+    assert fields["search_words"] == ["latitude", "notebook"]
+
+
+def test_query_terms_normalized_and_capped():
+    terms = equipment_search.query_terms("  Câmera  " + " x" * 20)
+    assert terms[0] == "camera"
+    assert len(terms) == equipment_search.MAX_QUERY_TERMS
+
+
+def _doc(name, model="Model", serial_number=None):
+    return {"id": name, "name": name, "model": model, "serial_number": serial_number}
+
+
+def test_rank_prefers_whole_words_then_prefixes_then_substrings():
+    docs = [
+        _doc("A MacBook"),            # substring
+        _doc("B Bookcase"),           # name prefix
+        _doc("C Tablet", "Book"),     # model word
+        _doc("D Book"),               # name word
+    ]
+    ranked = equipment_search.rank(docs, ["book"])
+    assert [doc["id"] for doc in ranked] == ["D Book", "C Tablet", "B Bookcase", "A MacBook"]
+
+
+def test_rank_exact_serial_first_and_ties_keep_order():
+    docs = [_doc("Notebook 1", serial_number="SN-2"), _doc("Notebook 2", serial_number="SN-1"), _doc("Notebook 3")]
+    assert [doc["id"] for doc in equipment_search.rank(docs, ["sn", "1"])][0] == "Notebook 2"
+    assert [doc["id"] for doc in equipment_search.rank(docs, ["note"])] == ["Notebook 1", "Notebook 2", "Notebook 3"]
+
+
+def test_score_credits_serial_words_and_long_words():
+    serial = _doc("Z Tablet", serial_number="AB-1234")
+    prefix = _doc("A Abacus")
+    assert [doc["id"] for doc in equipment_search.rank([prefix, serial], ["ab"])] == ["Z Tablet", "A Abacus"]
+    long_word = _doc("Y Transmogrifier-Deluxe-Edition", "Transmogrifierdeluxeedition")
+    terms = equipment_search.query_terms("transmogrifierdeluxeedition")
+    assert equipment_search._score(long_word, terms) == 3
+
+
+def test_first_tier_takes_only_top_scores():
+    docs = [_doc("A Abacus"), _doc("Z Tablet", serial_number="AB-1234"), _doc("M Lab", serial_number="SN-00-42")]
+    for terms in (["ab"], ["sn00", "42"], ["lab", "42"]):
+        words = {doc["id"]: set(equipment_search.build_search_words(doc["name"], doc["model"], doc["serial_number"])) for doc in docs}
+        tokens = {doc["id"]: set(equipment_search.build_search_tokens(doc["name"], doc["model"], doc["serial_number"])) for doc in docs}
+        matching = [doc for doc in docs if tokens[doc["id"]].issuperset(terms)]
+        first = [doc for doc in matching if equipment_search.whole_word_match(words[doc["id"]], terms)]
+        rest = [doc for doc in matching if doc not in first]
+        assert first
+        # Every first-tier item outscores every other match
+        assert min(equipment_search._score(doc, terms) for doc in first) > max(
+            [equipment_search._score(doc, terms) for doc in rest], default=0
+        )
+
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+async def _insert(db, names):
+    docs = []
+    for name, model, *serial_number in names:
+        doc = server.Equipment(
+            id=name, name=name, model=model, serial_number=(serial_number or [None])[0], created_at=NOW, updated_at=NOW
+        ).model_dump()
+        doc.update(equipment_search.search_fields(doc))
+        docs.append(doc)
+    await db.equipment.insert_many(docs)
+
+
+@pytest.mark.anyio
+async def test_search_finds_substrings(api, db):
+    await _insert(db, [("Notebook 1", "MacBook Air"), ("Projetor", "Epson")])
+    response = await api.get("/equipment", params={"search": "book"})
+    assert [doc["id"] for doc in response.json()] == ["Notebook 1"]
+    assert "search_tokens" not in response.json()[0]
+
+
+@pytest.mark.anyio
+async def test_whole_word_matches_are_not_cut_off_by_name_order(api, db, monkeypatch):
+    monkeypatch.setattr(equipment_search, "MAX_CANDIDATES", 2)
+    await _insert(db, [("A MacBook", "Air"), ("B MacBook", "Pro"), ("C Notebook", "X"), ("Z Book", "Reader")])
+    response = await api.get("/equipment", params={"search": "book", "limit": 1})
+    assert response.status_code == 200
+    assert [doc["id"] for doc in response.json()] == ["Z Book"]
+
+
+@pytest.mark.anyio
+async def test_serial_words_are_not_crowded_by_name_order(api, db, monkeypatch):
+    monkeypatch.setattr(equipment_search, "MAX_CANDIDATES", 2)
+    await _insert(db, [
+        ("A Abacus", "X"), ("B Abbey", "X"), ("C Tablet", "X", "AB-1"), ("D Camera", "X", "SN-00-42"),
+    ])
+    response = await api.get("/equipment", params={"search": "ab", "limit": 1})
+    assert [doc["id"] for doc in response.json()] == ["C Tablet"]
+    response = await api.get("/equipment", params={"search": "sn00 42", "limit": 1})
+    assert [doc["id"] for doc in response.json()] == ["D Camera"]
+
+
+@pytest.mark.anyio
+async def test_cursor_with_search_is_rejected(api, db):
+    response = await api.get("/equipment", params={"search": "book", "cursor": server.encode_cursor("a", "b")})
+    assert response.status_code == 400
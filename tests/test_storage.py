@@ -0,0 +1,116 @@
+import httpx
+import pytest
+from fastapi import FastAPI, File, UploadFile
+
+from storage import IMMUTABLE_CACHE_CONTROL, UploadSizeLimit, _etag_matches, _parse_range
+
+ETAG = '"abc123"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes=0-0 ", (0, 0)),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0", "bytes=5000-6000"])
+def test_parse_range_unsatisfiable(header):
+    assert _parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=-", "bytes=10-5", "bytes=0-1,5-6", "items=0-1", "bytes=a-b"])
+def test_parse_range_malformed(header):
+    with pytest.raises(ValueError):
+        _parse_range(header, 1000)
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    ('"other", "abc123"', True),
+    (f"W/{ETAG}", True),
+    ("*", True),
+    ('"other"', False),
+    ("abc123", False),
+])
+def test_etag_matches(header, expected):
+    assert _etag_matches(header, ETAG) is expected
+
+
+def test_blobs_are_not_cached_by_shared_caches():
+    assert IMMUTABLE_CACHE_CONTROL.startswith("private,")
+
+
+@pytest.fixture
+def limited_app():
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/upload")
+    @app.post("/other")
+    async def upload(file: UploadFile = File(...)):
+        app.state.calls += 1
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadSizeLimit, paths=["/upload"], max_bytes=1000)
+    return app
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def _multipart(size):
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + b"x" * size + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+@pytest.mark.anyio
+async def test_upload_limit_allows_small_bodies(limited_app):
+    body, headers = _multipart(100)
+    async with _client(limited_app) as client:
+        response = await client.post("/upload", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}
+
+
+@pytest.mark.anyio
+async def test_upload_limit_refuses_declared_length(limited_app):
+    body, headers = _multipart(5000)
+    async with _client(limited_app) as client:
+        response = await client.post("/upload", content=body, headers=headers)
+    assert response.status_code == 413
+    assert limited_app.state.calls == 0
+
+
+@pytest.mark.anyio
+async def test_upload_limit_counts_chunked_bodies(limited_app):
+    body, headers = _multipart(5000)
+
+    async def chunks():
+        for start in range(0, len(body), 256):
+            yield body[start:start + 256]
+
+    async with _client(limited_app) as client:
+        response = await client.post("/upload", content=chunks(), headers=headers)
+    assert response.status_code == 413
+    assert limited_app.state.calls == 0
+
+
+@pytest.mark.anyio
+async def test_upload_limit_only_applies_to_its_paths(limited_app):
+    body, headers = _multipart(5000)
+    async with _client(limited_app) as client:
+        response = await client.post("/other", content=body, headers=headers)
+    assert response.status_code == 200